@@ -1,10 +1,101 @@
-from .modules.fpi_data import FPIData
+"""
+fpipy
 
-from .modules.fpi_tools import interpolate
-from .modules.fpi_tools import hor_vel_calc
-from .modules.fpi_tools import merge_vecs
-from .modules.fpi_tools import times_to_secs
-from .modules.fpi_tools import vector_shift
+Submodules and the names below are imported the first time they are used
+(PEP 562), so "import fpipy" stays cheap and heavy or optional dependencies
+(h5py, aacgmv2, madrigalWeb, lunapath) are only loaded by the code that needs
+them.
+"""
 
-from .modules import fpi_stations #to also load metadata
-from .modules.fpi_stations import FPIStation
+import importlib
+
+#public name -> submodule of fpipy.modules it comes from
+_exports = {
+	"FPIData": "fpi_data",
+	"download_data": "fpi_data",
+	
+	"LazyTable": "fpi_hdf5",
+	
+	"FPICache": "fpi_cache",
+	"default_cache": "fpi_cache",
+	
+	"ColumnCache": "fpi_columns",
+	
+	"TableFilter": "fpi_filter",
+	
+	"iter_chunks": "fpi_stream",
+	"iter_nights": "fpi_stream",
+	"stream_winds": "fpi_stream",
+	"WindStream": "fpi_stream",
+	
+	"derive_winds_parallel": "fpi_parallel",
+	
+	"Aggregator": "fpi_aggregate",
+	"aggregate_nights": "fpi_aggregate",
+	"hourly_means": "fpi_aggregate",
+	
+	"ConjunctionIndex": "fpi_conjunction",
+	"nearest": "fpi_conjunction",
+	"great_circle": "fpi_conjunction",
+	
+	"BulkDownloader": "fpi_download",
+	"download_range": "fpi_download",
+	
+	"AsyncMadrigalClient": "fpi_async",
+	"ConnectionPool": "fpi_async",
+	"download_data_async": "fpi_async",
+	"fetch_async": "fpi_async",
+	"download_many_async": "fpi_async",
+	
+	"interpolate": "fpi_tools",
+	"interpolate_batch": "fpi_tools",
+	"hor_vel_calc": "fpi_tools",
+	"interp_nan": "fpi_tools",
+	"combine_looks": "fpi_tools",
+	"merge_vecs": "fpi_tools",
+	"times_to_secs": "fpi_tools",
+	"columns_to_dtime64": "fpi_tools",
+	"dtime64_to_strings": "fpi_tools",
+	"to_epoch": "fpi_tools",
+	"classify_directions": "fpi_tools",
+	"direction_codes": "fpi_tools",
+	"vector_shift": "fpi_tools",
+	"rotate_vecs": "fpi_tools",
+	"shift_vecs": "fpi_tools",
+	"frame_rotation": "fpi_tools",
+	"aacgm_convert": "fpi_tools",
+	"LRUCache": "fpi_tools",
+	"lon360_to_180": "fpi_tools",
+	"look_points": "fpi_tools",
+	"unique_rows": "fpi_tools",
+	
+	"FPIStation": "fpi_stations",
+	"StationRegistry": "fpi_stations",
+	"registry": "fpi_stations",
+	}
+
+#submodules reachable as fpipy.<name>
+_modules = ["fpi_aggregate", "fpi_async", "fpi_cache", "fpi_columns", "fpi_conjunction",
+		   "fpi_data", "fpi_download", "fpi_filter", "fpi_hdf5", "fpi_instrument",
+		   "fpi_parallel", "fpi_stations", "fpi_stream", "fpi_tools"]
+
+__all__ = list(_exports) + _modules
+
+def __getattr__(name):
+	
+	if name in _exports:
+		module = importlib.import_module(".modules."+_exports[name], __name__)
+		value = getattr(module, name)
+	elif name in _modules:
+		value = importlib.import_module(".modules."+name, __name__)
+	else:
+		raise AttributeError("module {!r} has no attribute {!r}".format(__name__, name))
+	
+	#cache so later lookups skip __getattr__
+	globals()[name] = value
+	
+	return value
+
+def __dir__():
+	
+	return sorted(set(globals()) | set(__all__))
@@ -0,0 +1,6 @@
+from .synthetic import make_table
+from .synthetic import write_hdf5
+from .bench import run_benchmarks
+from .bench import save_results
+from .bench import compare_results
+from .bench import import_time
@@ -0,0 +1,60 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Runs the fpipy benchmarks
+
+	python -m fpipy.benchmarks --sizes 10000 100000 --out results.json
+	python -m fpipy.benchmarks --compare old.json
+	python -m fpipy.benchmarks --import-only --import-budget 0.5
+
+The import budget is also checked by fpipy/tests/test_import_time.py.
+"""
+
+import sys
+import argparse
+
+from .bench import run_benchmarks, save_results, compare_results, import_time
+
+def main(argv=None):
+
+	parser = argparse.ArgumentParser(description="Benchmark the fpipy hot paths")
+	parser.add_argument("--sizes", type=int, nargs="+", default=[10000, 100000],
+					 help="numbers of records to benchmark with")
+	parser.add_argument("--repeat", type=int, default=3, help="timed runs per benchmark")
+	parser.add_argument("--out", help="JSON file to save the results to")
+	parser.add_argument("--compare", help="earlier JSON results to check for regressions")
+	parser.add_argument("--tolerance", type=float, default=0.2,
+					 help="fractional slow down reported as a regression")
+	parser.add_argument("--import-budget", type=float, 
+					 help="seconds \"import fpipy\" may take before failing")
+	parser.add_argument("--import-only", action="store_true", 
+					 help="only time \"import fpipy\"")
+	args = parser.parse_args(argv)
+
+	seconds, loaded = import_time(repeat=args.repeat)
+	print("import fpipy {:.4f} s, heavy modules loaded: {}".format(
+		seconds, ", ".join(loaded) if len(loaded) > 0 else "none"))
+	failed = False
+	if args.import_budget is not None and seconds > args.import_budget:
+		print("OVER BUDGET import fpipy {:.4f} s > {:.4f} s".format(seconds, args.import_budget))
+		failed = True
+	if args.import_only:
+		return 1 if failed else 0
+
+	results = run_benchmarks(sizes=args.sizes, repeat=args.repeat)
+	results["import"] = {"seconds": seconds, "loaded": loaded}
+	if args.out is not None:
+		save_results(results, args.out)
+
+	if args.compare is not None:
+		regressions = compare_results(args.compare, results, tolerance=args.tolerance)
+		for name, nrecords, old, new, ratio in regressions:
+			print("REGRESSION {} ({} records): {:.4f} s -> {:.4f} s ({:.2f}x)".format(
+				name, nrecords, old, new, ratio))
+		if len(regressions) > 0:
+			failed = True
+
+	return 1 if failed else 0
+
+if __name__ == "__main__":
+	sys.exit(main())
@@ -0,0 +1,370 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Benchmarks of the fpipy data and tools hot paths
+
+Each benchmark is timed (best of repeat runs) and run once more under
+tracemalloc for its peak memory, on synthetic files of each requested size.
+Results can be saved as JSON and compared between releases.
+"""
+
+import os
+import sys
+import json
+import time
+import platform
+import tempfile
+import subprocess
+import tracemalloc
+
+import numpy as np
+
+import fpipy
+from ..modules import fpi_data
+from . import synthetic
+
+def measure(func, repeat=3):
+
+	"""
+	Returns the best run time (seconds) of func over repeat runs and its peak
+	traced memory (bytes)
+
+	Parameters
+	----------
+
+	func: function
+		function to time (no arguments)
+
+	repeat (optional): int
+		number of timed runs (default = 3)
+	"""
+
+	seconds = []
+	for i in range(repeat):
+		start = time.perf_counter()
+		func()
+		seconds.append(time.perf_counter()-start)
+
+	tracemalloc.start()
+	try:
+		func()
+		current, peak = tracemalloc.get_traced_memory()
+	finally:
+		tracemalloc.stop()
+
+	return min(seconds), peak
+
+def load(fname):
+
+	"""
+	Returns an FPIData holding the given file with get_table run
+	"""
+
+	data = fpi_data.FPIData.from_files([fname])
+	data.get_table()
+
+	return data
+
+def legacy_columns(data):
+
+	"""
+	Returns a dictionary of the parsed columns of data as the original
+	get_table stored them: every Table Layout column (including the six
+	calendar columns) as a 64-bit array, the record times as an array of
+	strings (built with np.append, so 32 characters each) and as an object
+	array of datetime objects
+	"""
+
+	columns = {}
+	dtimes64 = np.array(data.dtimes64, dtype="datetime64[s]")
+	secs = (dtimes64 - dtimes64.astype("datetime64[D]")).astype("int64")
+	columns["year"] = dtimes64.astype("datetime64[Y]").astype("int64")+1970
+	columns["month"] = dtimes64.astype("datetime64[M]").astype("int64") % 12 + 1
+	columns["day"] = (dtimes64.astype("datetime64[D]") 
+		- dtimes64.astype("datetime64[M]")).astype("int64") + 1
+	columns["hour"], columns["min"], columns["sec"] = secs // 3600, secs // 60 % 60, secs % 60
+	for attr, field, dtype in fpi_data.table_columns:
+		columns[attr] = np.asarray(getattr(data, attr), dtype="float64"
+							  if np.dtype(dtype).kind == "f" else "int64")
+	columns["times"] = np.append(np.array([]), fpipy.dtime64_to_strings(dtimes64))
+	columns["dtimes"] = dtimes64.astype(object)
+
+	return columns
+
+def column_bytes(column):
+
+	"""
+	Returns the bytes held by an array, including the objects of an object
+	array
+	"""
+
+	nbytes = column.nbytes
+	if column.dtype == object:
+		nbytes += sum(sys.getsizeof(value) for value in column)
+
+	return nbytes
+
+def legacy_bytes_per_record(data):
+
+	"""
+	Returns the bytes per record the parsed columns of data took with the
+	original get_table, measured from the arrays of legacy_columns
+	"""
+
+	if len(data.epoch) == 0:
+		return 0.0
+
+	return sum(column_bytes(column) for column in legacy_columns(data).values())/len(data.epoch)
+
+def footprint(fname):
+
+	"""
+	Returns a dictionary of the bytes per record of the parsed columns of a
+	file now (after get_table, and with the calendar and string times built)
+	and as the original get_table stored them (see legacy_columns)
+	"""
+
+	data = load(fname)
+	nbytes = data.bytes_per_record()
+	#derived columns are built on first access
+	for name, dtype in fpi_data.calendar_columns:
+		getattr(data, name)
+	with_calendar = data.bytes_per_record()
+	getattr(data, "times")
+	with_times = data.bytes_per_record()
+
+	return {"nrecords": len(data.epoch), "bytes_per_record": nbytes,
+		 "with_calendar": with_calendar, "with_times": with_times,
+		 "legacy_bytes_per_record": legacy_bytes_per_record(data)}
+
+def benchmarks(fname, fnames):
+
+	"""
+	Returns a list of (name, function) benchmarks on the given synthetic files
+
+	Parameters
+	----------
+
+	fname: str
+		path to a synthetic file
+
+	fnames: list of str
+		paths to synthetic files that together hold the records of fname
+	"""
+
+	data = load(fname)
+	N_index, E_index, S_index, W_index, zen_index = data.get_azm_indexes()
+	windows = np.arange(data.epoch.min(), data.epoch.max()+3600, 3600).astype("datetime64[s]")
+	NS = np.asarray(data.los_v, dtype="float")
+	EW = NS[::-1].copy()
+
+	def bench_load_HDF5():
+		data.load_HDF5(fname)
+
+	def bench_add_HDF5():
+		fpi_data.FPIData.from_files(fnames)
+
+	def bench_get_table():
+		data.get_table()
+
+	def bench_get_azm_vels():
+		for dtime_min, dtime_max in zip(windows[:-1], windows[1:]):
+			data.get_azm_vels(dtime_min, dtime_max)
+
+	def bench_FPIData_hor_vel_calc():
+		data.hor_vel_calc(data.los_v[N_index], data.dtimes64[N_index],
+					data.los_v[zen_index], data.dtimes64[zen_index])
+
+	def bench_fpi_tools_hor_vel_calc():
+		fpipy.hor_vel_calc(data.los_v[N_index], data.epoch[N_index],
+					 data.los_v[zen_index], data.epoch[zen_index])
+
+	def bench_merge_vecs():
+		fpipy.merge_vecs(NS, EW)
+
+	return [("load_HDF5", bench_load_HDF5),
+		 ("add_HDF5", bench_add_HDF5),
+		 ("get_table", bench_get_table),
+		 ("get_azm_vels", bench_get_azm_vels),
+		 ("FPIData.hor_vel_calc", bench_FPIData_hor_vel_calc),
+		 ("fpi_tools.hor_vel_calc", bench_fpi_tools_hor_vel_calc),
+		 ("merge_vecs", bench_merge_vecs)]
+
+def run_benchmarks(sizes=[10000, 100000], repeat=3, nfiles=4, path=None, verbose=True):
+
+	"""
+	Runs every benchmark on synthetic files of each size and returns the
+	results as a dictionary (see save_results)
+
+	Parameters
+	----------
+
+	sizes (optional): list of int
+		numbers of records to benchmark with
+
+	repeat (optional): int
+		number of timed runs of each benchmark (default = 3)
+
+	nfiles (optional): int
+		number of files the records are split over for add_HDF5 (default = 4)
+
+	path (optional): str
+		directory to write the synthetic files to (default = a temporary
+		directory that is removed afterwards)
+
+	verbose (optional): bool
+		if true will print each result as it is measured
+	"""
+
+	results = []
+	footprints = []
+	with tempfile.TemporaryDirectory(prefix="fpipy_bench_") as tmp_path:
+		if path is None:
+			path = tmp_path
+		for nrecords in sizes:
+			fname = os.path.join(path, "bench_{}.hdf5".format(nrecords))
+			synthetic.write_hdf5(fname, nrecords)
+			fnames = []
+			per_file = int(np.ceil(nrecords/nfiles))
+			for i in range(nfiles):
+				part = os.path.join(path, "bench_{}_{}.hdf5".format(nrecords, i))
+				start = np.datetime64("2013-10-02T00:00:00", "s") + i*per_file*60
+				synthetic.write_hdf5(part, min(per_file, nrecords-i*per_file), start=str(start))
+				fnames.append(part)
+
+			for name, func in benchmarks(fname, fnames):
+				seconds, peak = measure(func, repeat=repeat)
+				result = {"name": name, "nrecords": nrecords, "seconds": seconds,
+					"records_per_sec": nrecords/seconds if seconds > 0 else float("inf"),
+					"peak_bytes": peak}
+				results.append(result)
+				if verbose:
+					print("{:<24}{:>10d} records {:>10.4f} s {:>14.0f} rec/s {:>10.1f} MB".format(
+						name, nrecords, seconds, result["records_per_sec"], peak/1e6))
+
+			footprints.append(footprint(fname))
+			if verbose:
+				print("{:<24}{:>10d} records {:>10.1f} B/rec (legacy {:.1f} B/rec)".format(
+					"bytes_per_record", nrecords, footprints[-1]["bytes_per_record"],
+					footprints[-1]["legacy_bytes_per_record"]))
+
+	return {"fpipy_version": version(),
+		 "python": platform.python_version(),
+		 "numpy": np.__version__,
+		 "platform": platform.platform(),
+		 "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+		 "repeat": repeat,
+		 "footprint": footprints,
+		 "results": results}
+
+#dependencies "import fpipy" should not load by itself
+heavy_modules = ["h5py", "aacgmv2", "pydatadarn", "madrigalWeb", "lunapath", 
+				 "elliotools"]
+
+#seconds "import fpipy" may take (see import_time)
+import_budget = 0.5
+
+_import_script = """
+import sys, time, json
+start = time.perf_counter()
+import {module}
+seconds = time.perf_counter()-start
+print(json.dumps({{"seconds": seconds,
+	"loaded": [name for name in {heavy} if name in sys.modules]}}))
+"""
+
+def import_time(module="fpipy", repeat=5):
+
+	"""
+	Returns the best time (seconds) to import module in a fresh interpreter
+	over repeat runs, and the heavy dependencies (see heavy_modules) the
+	import loaded
+
+	Parameters
+	----------
+
+	module (optional): str
+		module to import (default = "fpipy")
+
+	repeat (optional): int
+		number of fresh interpreters to time the import in (default = 5)
+	"""
+
+	script = _import_script.format(module=module, heavy=heavy_modules)
+	#import the same fpipy this benchmark is running from
+	env = dict(os.environ)
+	root = os.path.dirname(os.path.dirname(os.path.abspath(fpipy.__file__)))
+	env["PYTHONPATH"] = os.pathsep.join([root]+[path for path in [env.get("PYTHONPATH")] if path])
+	seconds = []
+	loaded = []
+	for i in range(repeat):
+		output = subprocess.run([sys.executable, "-c", script], capture_output=True, 
+						  text=True, check=True, env=env).stdout
+		result = json.loads(output.strip().splitlines()[-1])
+		seconds.append(result["seconds"])
+		loaded = result["loaded"]
+
+	return min(seconds), loaded
+
+def version():
+
+	"""
+	Returns the installed fpipy version (or "unknown")
+	"""
+
+	try:
+		from importlib import metadata
+		return metadata.version("fpipy")
+	except Exception:
+		return "unknown"
+
+def save_results(results, fname):
+
+	"""
+	Saves benchmark results to a JSON file
+	"""
+
+	with open(fname, "w") as f:
+		json.dump(results, f, indent=1)
+
+	return
+
+def compare_results(old, new, tolerance=0.2):
+
+	"""
+	Compares two sets of benchmark results (dictionaries or JSON file paths),
+	returning a list of (name, nrecords, old seconds, new seconds, ratio) for 
+	benchmarks that got more than tolerance slower
+
+	Parameters
+	----------
+
+	old: dict or str
+		earlier results
+
+	new: dict or str
+		later results
+
+	tolerance (optional): float
+		fractional slow down allowed before a benchmark is reported
+		(default = 0.2)
+	"""
+
+	if isinstance(old, str):
+		with open(old, "r") as f:
+			old = json.load(f)
+	if isinstance(new, str):
+		with open(new, "r") as f:
+			new = json.load(f)
+
+	old_seconds = {(result["name"], result["nrecords"]): result["seconds"] for result in old["results"]}
+	regressions = []
+	for result in new["results"]:
+		key = (result["name"], result["nrecords"])
+		if key not in old_seconds or old_seconds[key] <= 0:
+			continue
+		ratio = result["seconds"]/old_seconds[key]
+		if ratio > 1+tolerance:
+			regressions.append((key[0], key[1], old_seconds[key], result["seconds"], ratio))
+
+	return regressions
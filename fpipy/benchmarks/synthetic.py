@@ -0,0 +1,118 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Synthetic Madrigal-style FPI files for benchmarking
+
+The files have the same layout as Madrigal FPI files (a "Data/Table Layout"
+compound dataset plus the "Metadata" tables) with the real Table Layout fields,
+filled with a zenith/N/E/zenith/S/W look cycle and random winds and
+temperatures.
+"""
+
+import numpy as np
+import h5py
+
+#Table Layout fields of Madrigal FPI files
+table_dtype = np.dtype([
+	("year", "int64"), ("month", "int64"), ("day", "int64"),
+	("hour", "int64"), ("min", "int64"), ("sec", "int64"),
+	("recno", "int64"), ("kindat", "int64"), ("kinst", "int64"),
+	("ut1_unix", "float64"), ("ut2_unix", "float64"),
+	("azm", "float64"), ("elm", "float64"), ("gdalt", "float64"),
+	("tn", "float64"), ("dtn", "float64"), ("vnu", "float64"), ("dvnu", "float64"),
+	("temp_err", "int64"), ("wind_err", "int64"),
+])
+
+#[azm, elm] of each look in the observing cycle
+look_cycle = np.array([[0, 90], [0, 45], [90, 45], [0, 90], [180, 45], [-90, 45]])
+
+def make_table(nrecords, start="2013-10-02T00:00:00", cadence=60, seed=0):
+
+	"""
+	Returns a synthetic Table Layout array
+
+	Parameters
+	----------
+
+	nrecords: int
+		number of records
+
+	start (optional): str
+		time of the first record (ISO format)
+
+	cadence (optional): int
+		seconds between records (default = 60)
+
+	seed (optional): int
+		random seed
+	"""
+
+	rng = np.random.default_rng(seed)
+	times = np.datetime64(start, "s") + np.arange(nrecords, dtype="int64")*cadence
+	looks = look_cycle[np.arange(nrecords) % len(look_cycle)]
+
+	years = times.astype("datetime64[Y]")
+	months = times.astype("datetime64[M]")
+	days = times.astype("datetime64[D]")
+	secs = (times - days).astype("int64")
+
+	table = np.zeros(nrecords, dtype=table_dtype)
+	table["year"] = years.astype("int64")+1970
+	table["month"] = (months - years).astype("int64")+1
+	table["day"] = (days - months).astype("int64")+1
+	table["hour"] = secs // 3600
+	table["min"] = (secs // 60) % 60
+	table["sec"] = secs % 60
+	table["recno"] = np.arange(nrecords)
+	table["kindat"] = 17001
+	table["kinst"] = 5340
+	table["ut1_unix"] = times.astype("int64")
+	table["ut2_unix"] = table["ut1_unix"]+cadence
+	table["azm"] = looks[:, 0]
+	table["elm"] = looks[:, 1]
+	table["gdalt"] = 250
+	table["tn"] = 900+rng.normal(0, 50, nrecords)
+	table["dtn"] = rng.uniform(5, 30, nrecords)
+	table["vnu"] = rng.normal(0, 50, nrecords)
+	table["dvnu"] = rng.uniform(1, 10, nrecords)
+	table["temp_err"] = rng.integers(0, 3, nrecords)
+	table["wind_err"] = rng.integers(0, 3, nrecords)
+
+	return table
+
+def write_hdf5(fname, nrecords, start="2013-10-02T00:00:00", cadence=60, seed=0):
+
+	"""
+	Writes a synthetic Madrigal-style FPI file and returns its Table Layout
+
+	Parameters
+	----------
+
+	fname: str
+		path to write the hdf5 file to
+
+	nrecords: int
+		number of records
+
+	start, cadence, seed (optional):
+		passed to make_table
+	"""
+
+	table = make_table(nrecords, start=start, cadence=cadence, seed=seed)
+
+	parameters = np.array([(name.encode(), name.encode()) for name in table_dtype.names],
+					   dtype=[("mnemonic", "S20"), ("description", "S40")])
+	notes = np.array([(b"synthetic FPI data for benchmarking",)], dtype=[("File Notes", "S80")])
+	experiment = np.array([(b"instrument", b"synthetic FPI")], dtype=[("name", "S40"), ("value", "S40")])
+	record_layout = np.ones(1, dtype=[(name, "int64") for name in table_dtype.names])
+
+	with h5py.File(fname, "w") as hdf:
+		Data = hdf.create_group("Data")
+		Data.create_dataset("Table Layout", data=table, chunks=True)
+		Metadata = hdf.create_group("Metadata")
+		Metadata.create_dataset("Data Parameters", data=parameters)
+		Metadata.create_dataset("Experiment Notes", data=notes)
+		Metadata.create_dataset("Experiment Parameters", data=experiment)
+		Metadata.create_dataset("_record_layout", data=record_layout)
+
+	return table
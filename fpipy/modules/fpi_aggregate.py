@@ -0,0 +1,521 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Grouped binning of FPI records into composites and climatologies
+
+An Aggregator bins records by station, look direction, day of year and time
+of night, and accumulates counts, sums and error weighted sums of each
+variable with np.bincount over a flat bin index, plus a sparse value histogram
+for medians. Aggregators built from different nights, stations, chunks or
+worker processes are merged by adding their accumulators, and result()
+returns one row per non-empty bin as a structured array.
+
+	agg = Aggregator(["merid", "zonal", "temp"], stations=["uao", "ann"],
+		time_bin=1800, doy_bin=30)
+	for night in iter_nights(fnames):
+		agg.update_winds(night.get_winds(cadence=600), "uao")
+	table = agg.result()
+"""
+
+import numpy as np
+
+from . import fpi_stream
+from . import fpi_tools
+
+#offset that keeps value histogram bins positive when packed into a key
+_value_offset = 2**31
+
+class Aggregator():
+
+	"""
+	A class used to accumulate binned statistics (count, mean, spread,
+	median and error weighted mean) of one or more variables
+	"""
+
+	def __init__(self, variables, stations=None, looks=None, time_bin=3600, doy_bin=None,
+			  day_start=0, median_res=1.0):
+
+		"""
+		Parameters
+		----------
+
+		variables: list of str
+			names of the variables to aggregate (e.g. ["merid", "zonal"] for
+			wind products, ["los_v", "temp"] for records)
+
+		stations (optional): list of str
+			stations to bin by (default = no station bins)
+
+		looks (optional): list of str
+			look directions to bin by, from fpi_tools.direction_codes
+			(default = no look bins)
+
+		time_bin (optional): int
+			width of the time of night bins in seconds, None for no time bins
+			(default = 1 hour)
+
+		doy_bin (optional): int
+			width of the day of year bins in days (e.g. 30 for monthly
+			composites), None for no day of year bins (default = None)
+
+		day_start (optional): int
+			UT second of day that time of night (and the day of year) is
+			counted from, e.g. 43200 so nights that span UT midnight fall in
+			consecutive bins of one day (default = 0)
+
+		median_res (optional): float
+			resolution of the value histogram medians are found from, in the
+			units of the variables (default = 1.0)
+		"""
+
+		self.variables = list(variables)
+		self.stations = None if stations is None else [station.lower() for station in stations]
+		self.looks = None if looks is None else list(looks)
+		self.time_bin = time_bin
+		self.doy_bin = doy_bin
+		self.day_start = day_start
+		self.median_res = median_res
+
+		self.shape = (1 if self.stations is None else len(self.stations),
+			1 if self.looks is None else len(self.looks),
+			1 if doy_bin is None else int(np.ceil(366/doy_bin)),
+			1 if time_bin is None else int(np.ceil(86400/time_bin)))
+		nbins = int(np.prod(self.shape))
+		nvars = len(self.variables)
+
+		self.count = np.zeros((nvars, nbins), dtype="int64")
+		self.total = np.zeros((nvars, nbins))
+		self.total_sq = np.zeros((nvars, nbins))
+		self.weight = np.zeros((nvars, nbins))
+		self.weighted_total = np.zeros((nvars, nbins))
+		#sparse value histograms: sorted packed (bin, value bin) keys and counts
+		self.hist_keys = [np.empty(0, dtype="int64") for var in self.variables]
+		self.hist_counts = [np.empty(0, dtype="int64") for var in self.variables]
+
+		#look direction code -> look bin (-1 for looks not aggregated)
+		self._look_bins = np.full(len(fpi_tools.direction_codes), -1, dtype="int64")
+		if self.looks is None:
+			self._look_bins[:] = 0
+		else:
+			for i, look in enumerate(self.looks):
+				self._look_bins[fpi_tools.direction_codes[look]] = i
+
+		return
+
+	def config(self):
+
+		"""
+		Returns the binning settings (aggregators can only be merged if these
+		match)
+		"""
+
+		return (self.variables, self.stations, self.looks, self.time_bin, self.doy_bin,
+			  self.day_start, self.median_res)
+
+	def bin_index(self, epoch, station=None, look=None):
+
+		"""
+		Returns the flat bin index of each record, -1 for records that are not
+		in any bin (stations or looks that are not aggregated)
+
+		Parameters
+		----------
+
+		epoch: int array
+			time of each record (seconds since 1970/01/01)
+
+		station (optional): str or array of str
+			station of the records
+
+		look (optional): str, array of str or array of direction codes
+			look direction of each record (see fpi_tools.direction_codes)
+		"""
+
+		epoch = np.asarray(epoch, dtype="int64") - self.day_start
+		n = len(epoch)
+		valid = np.ones(n, dtype="bool")
+
+		station_bin = np.zeros(n, dtype="int64")
+		if self.stations is not None:
+			if station is None:
+				raise Exception("records need a station to bin by station")
+			names = np.char.lower(np.broadcast_to(np.asarray(station, dtype="U"), (n,)))
+			station_bin = np.full(n, -1, dtype="int64")
+			for i, name in enumerate(self.stations):
+				station_bin[names == name] = i
+			valid &= station_bin >= 0
+
+		look_bin = np.zeros(n, dtype="int64")
+		if self.looks is not None:
+			if look is None:
+				raise Exception("records need a look direction to bin by look")
+			codes = np.asarray(look)
+			if codes.dtype.kind in "US":
+				names = np.broadcast_to(codes, (n,))
+				codes = np.full(n, fpi_tools.direction_codes["other"], dtype="int64")
+				for name, code in fpi_tools.direction_codes.items():
+					codes[names == name] = code
+			look_bin = self._look_bins[np.broadcast_to(codes, (n,)).astype("int64")]
+			valid &= look_bin >= 0
+
+		doy_bin = np.zeros(n, dtype="int64")
+		if self.doy_bin is not None:
+			days = (epoch // 86400).astype("datetime64[D]")
+			doy = (days - days.astype("datetime64[Y]")).astype("int64")
+			doy_bin = doy // self.doy_bin
+
+		time_bin = np.zeros(n, dtype="int64")
+		if self.time_bin is not None:
+			time_bin = (epoch % 86400) // self.time_bin
+
+		index = np.ravel_multi_index((np.where(valid, station_bin, 0), np.where(valid, look_bin, 0),
+			doy_bin, time_bin), self.shape)
+
+		return np.where(valid, index, -1)
+
+	def update(self, epoch, values, station=None, look=None):
+
+		"""
+		Adds records to the aggregate
+
+		Parameters
+		----------
+
+		epoch: int array
+			time of each record (seconds since 1970/01/01)
+
+		values: dict
+			variable name -> values or (values, errors) for each record,
+			variables that are not aggregated are ignored and NaN values are
+			skipped
+
+		station (optional): str or array of str
+			station of the records
+
+		look (optional): str, array of str or array of direction codes
+			look direction of each record
+		"""
+
+		index = self.bin_index(epoch, station=station, look=look)
+		nbins = self.count.shape[1]
+
+		for i, var in enumerate(self.variables):
+			if var not in values:
+				continue
+			value = values[var]
+			error = None
+			if isinstance(value, tuple):
+				value, error = value
+			value = np.asarray(value, dtype="float")
+			keep = (index >= 0) & np.isfinite(value)
+			bins = index[keep]
+			x = value[keep]
+
+			self.count[i] += np.bincount(bins, minlength=nbins)
+			self.total[i] += np.bincount(bins, weights=x, minlength=nbins)
+			self.total_sq[i] += np.bincount(bins, weights=x**2, minlength=nbins)
+
+			if error is not None:
+				error = np.asarray(error, dtype="float")[keep]
+				weighted = np.isfinite(error) & (error > 0)
+				w = 1/error[weighted]**2
+				self.weight[i] += np.bincount(bins[weighted], weights=w, minlength=nbins)
+				self.weighted_total[i] += np.bincount(bins[weighted], weights=w*x[weighted],
+										  minlength=nbins)
+
+			value_bins = np.floor(x/self.median_res).astype("int64") + _value_offset
+			keys, counts = np.unique((bins << 32) | value_bins, return_counts=True)
+			self.hist_keys[i], self.hist_counts[i] = _merge_hist(
+				self.hist_keys[i], self.hist_counts[i], keys, counts)
+
+		return
+
+	def update_data(self, data, station=None, variables={"los_v": "dlos_v", "temp": "dtemp"}):
+
+		"""
+		Adds the records of an FPIData (after get_table), binned by the look
+		direction of each record
+
+		Parameters
+		----------
+
+		data: FPIData
+			records to add
+
+		station (optional): str
+			station the data is from
+
+		variables (optional): dict
+			FPIData column -> column of its errors (or None)
+		"""
+
+		values = {}
+		for var, err in variables.items():
+			if var in self.variables:
+				values[var] = (getattr(data, var), None if err is None else getattr(data, err))
+
+		self.update(data.epoch, values, station=station, look=data.direction)
+
+		return
+
+	def update_winds(self, winds, station=None):
+
+		"""
+		Adds a wind product (see FPIData.get_winds and fpi_data.wind_dtype),
+		using each field's d<field> as its error
+
+		Parameters
+		----------
+
+		winds: structured array
+			wind product to add
+
+		station (optional): str
+			station the winds are from
+		"""
+
+		values = {}
+		for var in self.variables:
+			if var in winds.dtype.names:
+				err = "d"+var
+				values[var] = (winds[var], winds[err]) if err in winds.dtype.names else winds[var]
+
+		self.update(winds["epoch"], values, station=station)
+
+		return
+
+	def update_hor_vels(self, hor_vels, station=None, var="hor_v"):
+
+		"""
+		Adds horizontal winds by look (look -> [hor_v, dhor_v, epoch] as from
+		FPIData.get_hor_vels or WindStream.update)
+
+		Parameters
+		----------
+
+		hor_vels: dict
+			horizontal winds to add
+
+		station (optional): str
+			station the winds are from
+
+		var (optional): str
+			variable to add them as (default = "hor_v")
+		"""
+
+		for look, (hor_v, dhor_v, epoch) in hor_vels.items():
+			self.update(epoch, {var: (hor_v, dhor_v)}, station=station, look=look)
+
+		return
+
+	def merge(self, other):
+
+		"""
+		Adds the accumulated values of another Aggregator with the same
+		binning (e.g. from another worker, chunk or station)
+		"""
+
+		if other.config() != self.config():
+			raise Exception("can only merge Aggregators with the same variables and bins")
+
+		self.count += other.count
+		self.total += other.total
+		self.total_sq += other.total_sq
+		self.weight += other.weight
+		self.weighted_total += other.weighted_total
+		for i in range(len(self.variables)):
+			self.hist_keys[i], self.hist_counts[i] = _merge_hist(
+				self.hist_keys[i], self.hist_counts[i], other.hist_keys[i], other.hist_counts[i])
+
+		return
+
+	def mean(self):
+
+		"""
+		Returns the mean of each (variable, bin), NaN for empty bins
+		"""
+
+		with np.errstate(divide="ignore", invalid="ignore"):
+			return self.total / self.count
+
+	def std(self):
+
+		"""
+		Returns the standard deviation of each (variable, bin), NaN for empty
+		bins
+		"""
+
+		with np.errstate(divide="ignore", invalid="ignore"):
+			mean = self.total / self.count
+			return np.sqrt(np.maximum(self.total_sq/self.count - mean**2, 0))
+
+	def weighted_mean(self):
+
+		"""
+		Returns the error weighted (1/error**2) mean of each (variable, bin)
+		and its error, NaN for bins without errors
+		"""
+
+		with np.errstate(divide="ignore", invalid="ignore"):
+			return (self.weighted_total / self.weight,
+				np.where(self.weight > 0, 1/np.sqrt(self.weight), np.nan))
+
+	def median(self):
+
+		"""
+		Returns the median of each (variable, bin) to within median_res, NaN
+		for empty bins
+		"""
+
+		nbins = self.count.shape[1]
+		medians = np.full((len(self.variables), nbins), np.nan)
+		for i in range(len(self.variables)):
+			keys = self.hist_keys[i]
+			counts = self.hist_counts[i]
+			if len(keys) == 0:
+				continue
+			bins = keys >> 32
+			centres = ((keys & 0xffffffff) - _value_offset + 0.5)*self.median_res
+
+			#first histogram entry and number of values of each non-empty bin
+			starts = np.flatnonzero(np.r_[True, bins[1:] != bins[:-1]])
+			totals = np.add.reduceat(counts, starts)
+			cum = np.cumsum(counts)
+			before = np.r_[0, cum[:-1]][starts]
+
+			#entries holding the lower and upper middle values
+			lower = np.searchsorted(cum, before + (totals-1)//2, side="right")
+			upper = np.searchsorted(cum, before + totals//2, side="right")
+			medians[i, bins[starts]] = (centres[lower] + centres[upper])/2
+
+		return medians
+
+	def result(self):
+
+		"""
+		Returns a structured array with one row per non-empty bin: station,
+		look, doy (first day of year of the bin, from 1), time (seconds after
+		day_start the bin starts) and <var>_count, <var>_mean, <var>_std,
+		<var>_median, <var>_wmean and <var>_dwmean for each variable
+		"""
+
+		nonempty = np.flatnonzero(self.count.sum(axis=0) > 0)
+		station_bin, look_bin, doy_bin, time_bin = np.unravel_index(nonempty, self.shape)
+
+		fields = [("station", "U8"), ("look", "U8"), ("doy", "int16"), ("time", "int32")]
+		for var in self.variables:
+			fields += [(var+"_count", "int64"), (var+"_mean", "float64"), (var+"_std", "float64"),
+				(var+"_median", "float64"), (var+"_wmean", "float64"), (var+"_dwmean", "float64")]
+		out = np.zeros(len(nonempty), dtype=fields)
+
+		if self.stations is not None:
+			out["station"] = np.asarray(self.stations)[station_bin]
+		if self.looks is not None:
+			out["look"] = np.asarray(self.looks)[look_bin]
+		out["doy"] = 0 if self.doy_bin is None else doy_bin*self.doy_bin + 1
+		out["time"] = 0 if self.time_bin is None else time_bin*self.time_bin
+
+		mean = self.mean()
+		std = self.std()
+		median = self.median()
+		wmean, dwmean = self.weighted_mean()
+		for i, var in enumerate(self.variables):
+			out[var+"_count"] = self.count[i, nonempty]
+			out[var+"_mean"] = mean[i, nonempty]
+			out[var+"_std"] = std[i, nonempty]
+			out[var+"_median"] = median[i, nonempty]
+			out[var+"_wmean"] = wmean[i, nonempty]
+			out[var+"_dwmean"] = dwmean[i, nonempty]
+
+		return out
+
+def _merge_hist(keys, counts, new_keys, new_counts):
+
+	if len(keys) == 0:
+		return new_keys, new_counts
+	if len(new_keys) == 0:
+		return keys, counts
+
+	keys, inverse = np.unique(np.concatenate([keys, new_keys]), return_inverse=True)
+	counts = np.bincount(inverse.ravel(), weights=np.concatenate([counts, new_counts]),
+				   minlength=len(keys)).astype("int64")
+
+	return keys, counts
+
+def aggregate_nights(fnames, station, variables=["merid", "zonal", "vert", "temp"], cadence=None,
+					 elm=45, max_gap=None, filter=None, **bins):
+
+	"""
+	Returns an Aggregator of the wind products (see FPIData.get_winds) of many
+	nights from one station, loading one night at a time
+
+	Parameters
+	----------
+
+	fnames: list of str
+		paths to hdf5 files (one night each)
+
+	station: str
+		3-letter abbreviation for the FPI station
+
+	variables (optional): list of str
+		wind product fields to aggregate
+
+	cadence, elm, max_gap (optional):
+		passed to FPIData.get_winds
+
+	filter (optional): fpi_filter.TableFilter
+		only use the records matching these predicates
+
+	**bins:
+		binning settings passed to Aggregator (e.g. time_bin, doy_bin)
+	"""
+
+	bins.setdefault("stations", [station])
+	agg = Aggregator(variables, **bins)
+	columns = ["los_v", "dlos_v", "temp", "dtemp"]
+	for night in fpi_stream.iter_nights(fnames, columns=columns, filter=filter):
+		agg.update_winds(night.get_winds(cadence=cadence, elm=elm, max_gap=max_gap), station)
+
+	return agg
+
+def hourly_means(fnames, chunk_size=100000, elm=45, bin_secs=3600, filter=None, max_gap=None,
+				 looks=["N", "E", "S", "W"]):
+
+	"""
+	Streams horizontal winds across many files and returns an Aggregator of
+	them (as "hor_v") by look direction and time of day (hourly by default)
+
+	Parameters
+	----------
+
+	fnames: list of str
+		paths to hdf5 files (in time order)
+
+	chunk_size (optional): int
+		maximum number of records per chunk (default = 100000)
+
+	elm (optional): float
+		elevation of the line of sight measurements in degrees (default = 45)
+
+	bin_secs (optional): int
+		width of the time of day bins in seconds (default = 1 hour)
+
+	filter (optional): fpi_filter.TableFilter
+		only use the records matching these predicates
+
+	max_gap (optional): float
+		largest time in seconds between the zenith samples a line of sight
+		sample is interpolated between (see fpi_stream.WindStream, default =
+		no limit)
+
+	looks (optional): list of str
+		look directions to bin by
+	"""
+
+	agg = Aggregator(["hor_v"], looks=looks, time_bin=bin_secs)
+	for hor_vels in fpi_stream.stream_winds(fnames, chunk_size=chunk_size, elm=elm, filter=filter,
+										max_gap=max_gap):
+		agg.update_hor_vels(hor_vels)
+
+	return agg
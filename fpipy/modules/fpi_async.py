@@ -0,0 +1,810 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Asyncio download client for Madrigal
+
+An asyncio counterpart to fpi_data.download_data for use inside event loops.
+Requests go through a pool of keep-alive HTTP/1.1 connections (asyncio
+streams, no extra dependencies) with limits on the number of connections per
+host and overall. Files are streamed to disk as they arrive and a download
+that is interrupted (or cancelled) leaves its partial file behind, so the next
+attempt resumes it with an HTTP Range request. Files are named as
+fpi_data.download_data names them and can go straight into an FPICache.
+
+	async with AsyncMadrigalClient() as client:
+		fname = await fetch_async(cache, "uao", "2013/10/02", client=client)
+"""
+
+import os
+import ssl
+import json
+import time
+import asyncio
+import functools
+import contextlib
+import urllib.parse
+import datetime as dt
+
+from . import fpi_cache
+from . import fpi_data
+from . import fpi_stations
+from . import fpi_instrument
+
+#Madrigal file type codes used by getMadfile.cgi
+file_types = {"simple": -1, "hdf5": -2, "netCDF4": -3}
+
+class HTTPError(Exception):
+
+	"""
+	Raised for HTTP responses with an unexpected status
+	"""
+
+	def __init__(self, status, reason, url):
+
+		super().__init__("HTTP {} {} from {}".format(status, reason, url))
+		self.status = status
+		self.reason = reason
+		self.url = url
+
+		return
+
+def _in_thread(func, *args):
+
+	"""
+	Runs func(*args) in the event loop's default executor, returning a future
+	to await (asyncio.to_thread needs Python 3.9)
+	"""
+
+	return asyncio.get_event_loop().run_in_executor(None, functools.partial(func, *args))
+
+def _content_range(value):
+
+	"""
+	Returns the first byte and total length from a Content-Range header
+	("bytes first-last/total" or "bytes */total"), None for either part that
+	is missing or unknown
+	"""
+
+	if value is None:
+		return None, None
+	units, _, spec = value.strip().partition(" ")
+	rng, _, total = spec.partition("/")
+	if units.lower() != "bytes":
+		return None, None
+	first = rng.split("-")[0].strip()
+
+	return (int(first) if first.isdigit() else None,
+		int(total) if total.strip().isdigit() else None)
+
+class _Connection():
+
+	__slots__ = ["key", "reader", "writer", "last_used"]
+
+	def __init__(self, key, reader, writer):
+
+		self.key = key
+		self.reader = reader
+		self.writer = writer
+		self.last_used = time.monotonic()
+
+		return
+
+	def usable(self, idle_timeout):
+
+		return (not self.reader.at_eof() and not self.writer.is_closing()
+			and time.monotonic()-self.last_used < idle_timeout)
+
+	def close(self):
+
+		self.writer.close()
+
+		return
+
+class Response():
+
+	"""
+	A class used to read the status, headers and (streamed) body of one HTTP
+	response
+	"""
+
+	def __init__(self, url, conn, status, reason, headers, method="GET", timeout=60.0):
+
+		self.url = url
+		self.status = status
+		self.reason = reason
+		#header names are lower case
+		self.headers = headers
+		self.timeout = timeout
+		self._conn = conn
+		self._chunked = "chunked" in headers.get("transfer-encoding", "").lower()
+		self._remaining = None
+		self.complete = False
+
+		if method == "HEAD" or status in (204, 304) or 100 <= status < 200:
+			self._remaining = 0
+		elif not self._chunked and "content-length" in headers:
+			self._remaining = int(headers["content-length"])
+		#body runs to the end of the connection, so it can not be reused
+		self.keep_alive = (headers.get("connection", "").lower() != "close"
+					 and (self._chunked or self._remaining is not None))
+		if self._remaining == 0:
+			self.complete = True
+
+		return
+
+	async def _read(self, coro):
+
+		return await asyncio.wait_for(coro, self.timeout)
+
+	async def iter_chunks(self, chunk_size=1<<16):
+
+		"""
+		Yields the body in chunks of at most chunk_size bytes as they arrive
+		"""
+
+		reader = self._conn.reader
+		if self._chunked:
+			while True:
+				line = await self._read(reader.readline())
+				size = int(line.split(b";")[0].strip() or b"0", 16)
+				if size == 0:
+					#skip any trailer headers
+					while (await self._read(reader.readline())) not in (b"\r\n", b"\n", b""):
+						pass
+					break
+				while size > 0:
+					data = await self._read(reader.read(min(size, chunk_size)))
+					if len(data) == 0:
+						raise ConnectionError("connection closed mid chunk from "+self.url)
+					size -= len(data)
+					yield data
+				await self._read(reader.readline())
+		elif self._remaining is not None:
+			while self._remaining > 0:
+				data = await self._read(reader.read(min(self._remaining, chunk_size)))
+				if len(data) == 0:
+					raise ConnectionError("connection closed with {} bytes left from {}".format(
+						self._remaining, self.url))
+				self._remaining -= len(data)
+				yield data
+		else:
+			while True:
+				data = await self._read(reader.read(chunk_size))
+				if len(data) == 0:
+					break
+				yield data
+
+		self.complete = True
+
+		return
+
+	async def read(self):
+
+		"""
+		Returns the whole body
+		"""
+
+		return b"".join([data async for data in self.iter_chunks()])
+
+	async def text(self, encoding="utf-8"):
+
+		"""
+		Returns the whole body decoded as text
+		"""
+
+		return (await self.read()).decode(encoding, errors="replace")
+
+class ConnectionPool():
+
+	"""
+	A class used to share keep-alive HTTP/1.1 connections between requests,
+	with limits on the number of connections in use per host and overall
+	"""
+
+	def __init__(self, max_per_host=4, max_total=16, timeout=60.0, idle_timeout=30.0):
+
+		"""
+		Parameters
+		----------
+
+		max_per_host (optional): int
+			most requests in flight to one host at a time (default = 4)
+
+		max_total (optional): int
+			most requests in flight overall (default = 16)
+
+		timeout (optional): float
+			seconds to wait to connect and for each read (default = 60)
+
+		idle_timeout (optional): float
+			seconds an idle connection is kept for reuse (default = 30)
+		"""
+
+		self.max_per_host = max_per_host
+		self.max_total = max_total
+		self.timeout = timeout
+		self.idle_timeout = idle_timeout
+
+		self._total = asyncio.Semaphore(max_total)
+		self._hosts = {}
+		self._idle = {}
+		self._ssl = None
+
+		return
+
+	def _host_semaphore(self, key):
+
+		semaphore = self._hosts.get(key)
+		if semaphore is None:
+			semaphore = asyncio.Semaphore(self.max_per_host)
+			self._hosts[key] = semaphore
+
+		return semaphore
+
+	async def _connect(self, key):
+
+		idle = self._idle.get(key, [])
+		while len(idle) > 0:
+			conn = idle.pop()
+			if conn.usable(self.idle_timeout):
+				return conn, True
+			conn.close()
+
+		scheme, host, port = key
+		context = None
+		if scheme == "https":
+			if self._ssl is None:
+				self._ssl = ssl.create_default_context()
+			context = self._ssl
+		reader, writer = await asyncio.wait_for(
+			asyncio.open_connection(host, port, ssl=context), self.timeout)
+
+		return _Connection(key, reader, writer), False
+
+	def _release(self, conn, response):
+
+		if (response is not None and response.complete and response.keep_alive
+				and not conn.writer.is_closing()):
+			conn.last_used = time.monotonic()
+			self._idle.setdefault(conn.key, []).append(conn)
+		else:
+			conn.close()
+
+		return
+
+	async def _send(self, conn, method, url, target, headers):
+
+		scheme, host, port = conn.key
+		default_port = 443 if scheme == "https" else 80
+		lines = ["{} {} HTTP/1.1".format(method, target),
+			"Host: {}".format(host if port == default_port else "{}:{}".format(host, port)),
+			"Connection: keep-alive",
+			"Accept-Encoding: identity",
+			"User-Agent: fpipy"]
+		lines += ["{}: {}".format(name, value) for name, value in headers.items()]
+		conn.writer.write(("\r\n".join(lines)+"\r\n\r\n").encode("latin-1"))
+		await asyncio.wait_for(conn.writer.drain(), self.timeout)
+
+		reader = conn.reader
+		status_line = await asyncio.wait_for(reader.readline(), self.timeout)
+		if len(status_line) == 0:
+			raise ConnectionError("connection closed before a response from "+url)
+		version, status, reason = (status_line.decode("latin-1").strip().split(" ", 2)+[""])[:3]
+		response_headers = {}
+		while True:
+			line = await asyncio.wait_for(reader.readline(), self.timeout)
+			if line in (b"\r\n", b"\n", b""):
+				break
+			name, value = line.decode("latin-1").split(":", 1)
+			response_headers[name.strip().lower()] = value.strip()
+		if version == "HTTP/1.0" and response_headers.get("connection", "").lower() != "keep-alive":
+			response_headers["connection"] = "close"
+
+		return Response(url, conn, int(status), reason, response_headers,
+				   method=method, timeout=self.timeout)
+
+	@contextlib.asynccontextmanager
+	async def request(self, url, method="GET", headers=None):
+
+		"""
+		Sends a request and yields the Response once its headers are read. The
+		connection goes back to the pool when the block exits if the body was
+		read to the end, otherwise (e.g. on cancellation) it is closed
+
+		Parameters
+		----------
+
+		url: str
+			http or https URL
+
+		method (optional): str
+			HTTP method (default = "GET")
+
+		headers (optional): dict
+			extra request headers
+		"""
+
+		if headers is None:
+			headers = {}
+		parts = urllib.parse.urlsplit(url)
+		if parts.scheme not in ("http", "https"):
+			raise Exception("unsupported URL scheme: "+url)
+		port = parts.port or (443 if parts.scheme == "https" else 80)
+		key = (parts.scheme, parts.hostname, port)
+		target = parts.path or "/"
+		if parts.query:
+			target += "?"+parts.query
+
+		async with self._total, self._host_semaphore(key):
+			conn, reused = await self._connect(key)
+			response = None
+			try:
+				try:
+					response = await self._send(conn, method, url, target, headers)
+				except (ConnectionError, asyncio.IncompleteReadError):
+					if not reused:
+						raise
+					#the server closed an idle connection, try a new one
+					conn.close()
+					conn, reused = await self._connect(key)
+					response = await self._send(conn, method, url, target, headers)
+				yield response
+			finally:
+				self._release(conn, response)
+
+		return
+
+	def close(self):
+
+		"""
+		Closes every idle connection
+		"""
+
+		for conns in self._idle.values():
+			for conn in conns:
+				conn.close()
+		self._idle = {}
+
+		return
+
+class AsyncMadrigalClient():
+
+	"""
+	A class used to query and download from a Madrigal server with asyncio,
+	through a ConnectionPool
+	"""
+
+	def __init__(self, url=fpi_data.madrigalURL, cgi_url=None, pool=None, max_per_host=4,
+			  max_total=16, timeout=60.0, max_redirects=5, chunk_size=1<<16,
+			  user_fullname=fpi_data.user_fullname, user_email=fpi_data.user_email,
+			  user_affiliation=fpi_data.user_affiliation):
+
+		"""
+		Parameters
+		----------
+
+		url (optional): str
+			Madrigal server (default = fpi_data.madrigalURL)
+
+		cgi_url (optional): str
+			base URL of the Madrigal web services (getExperimentsService.py,
+			getExperimentFilesService.py and getMadfile.cgi)
+			(default = url)
+
+		pool (optional): ConnectionPool
+			connection pool to share (default = a new one with max_per_host,
+			max_total and timeout)
+
+		max_redirects (optional): int
+			most redirects followed per request (default = 5)
+
+		chunk_size (optional): int
+			bytes read and written at a time when downloading (default = 64 kB)
+
+		user_fullname, user_email, user_affiliation (optional): str
+			user details Madrigal asks for with each download
+		"""
+
+		self.url = url
+		self.cgi_url = (url if cgi_url is None else cgi_url).rstrip("/")+"/"
+		if pool is None:
+			pool = ConnectionPool(max_per_host=max_per_host, max_total=max_total,
+						 timeout=timeout)
+		self.pool = pool
+		self.max_redirects = max_redirects
+		self.chunk_size = chunk_size
+		self.user_fullname = user_fullname
+		self.user_email = user_email
+		self.user_affiliation = user_affiliation
+
+		return
+
+	async def __aenter__(self):
+
+		return self
+
+	async def __aexit__(self, *exc):
+
+		self.close()
+
+		return False
+
+	def close(self):
+
+		"""
+		Closes the pooled connections
+		"""
+
+		self.pool.close()
+
+		return
+
+	def service_url(self, service, params):
+
+		"""
+		Returns the URL of a Madrigal web service called with params
+		"""
+
+		return self.cgi_url+service+"?"+urllib.parse.urlencode(params)
+
+	@contextlib.asynccontextmanager
+	async def _get(self, url, headers=None):
+
+		for i in range(self.max_redirects+1):
+			async with self.pool.request(url, headers=headers) as response:
+				if response.status in (301, 302, 303, 307, 308) and "location" in response.headers:
+					#read the body so the connection can be reused
+					await response.read()
+					url = urllib.parse.urljoin(url, response.headers["location"])
+					continue
+				yield response
+				return
+
+		raise Exception("too many redirects from "+url)
+
+	async def get_text(self, service, params):
+
+		"""
+		Returns the text returned by a Madrigal web service
+		"""
+
+		url = self.service_url(service, params)
+		async with self._get(url) as response:
+			if response.status != 200:
+				await response.read()
+				raise HTTPError(response.status, response.reason, url)
+			text = await response.text()
+
+		if text.lstrip().startswith("Error"):
+			raise Exception("Madrigal error from {}: {}".format(url, text.strip()))
+
+		return text
+
+	async def get_experiments(self, instrument_id, start, end):
+
+		"""
+		Returns a list of dictionaries (id, url, name, instrument_id) of the
+		experiments of an instrument between two times
+
+		Parameters
+		----------
+
+		instrument_id: int
+			Madrigal instrument id (e.g. FPIStation(FPI).id)
+
+		start, end: datetime.datetime or datetime.date
+			time range to search
+		"""
+
+		params = {"code": instrument_id, "startyear": start.year, "startmonth": start.month,
+			"startday": start.day, "starthour": getattr(start, "hour", 0),
+			"startmin": getattr(start, "minute", 0), "startsec": getattr(start, "second", 0),
+			"endyear": end.year, "endmonth": end.month, "endday": end.day,
+			"endhour": getattr(end, "hour", 0), "endmin": getattr(end, "minute", 0),
+			"endsec": getattr(end, "second", 0), "local": 1}
+		text = await self.get_text("getExperimentsService.py", params)
+
+		experiments = []
+		for line in text.splitlines():
+			fields = line.split(",")
+			if len(fields) < 6 or not fields[0].strip().lstrip("-").isdigit():
+				continue
+			#id -1 means the experiment is not available
+			if int(fields[0]) == -1:
+				continue
+			experiments.append({"id": int(fields[0]), "url": fields[1], "name": fields[2],
+				"instrument_id": int(fields[5])})
+
+		return experiments
+
+	async def get_experiment_files(self, experiment_id):
+
+		"""
+		Returns a list of dictionaries (name, kindat, kindat_desc, category,
+		status, permission) of the files of an experiment
+
+		Parameters
+		----------
+
+		experiment_id: int
+			Madrigal experiment id
+		"""
+
+		text = await self.get_text("getExperimentFilesService.py", {"id": experiment_id})
+
+		files = []
+		for line in text.splitlines():
+			fields = line.split(",")
+			if len(fields) < 6:
+				continue
+			files.append({"name": fields[0], "kindat": int(fields[1]), "kindat_desc": fields[2],
+				"category": int(fields[3]), "status": fields[4], "permission": int(fields[5])})
+
+		return files
+
+	async def download_file(self, filename, fname, format="hdf5"):
+
+		"""
+		Streams a Madrigal file to fname, returning the number of bytes
+		downloaded. Data is written to fname + ".tmp" first and renamed into
+		place when complete. An fname + ".tmp" left by an interrupted download
+		of the same file is resumed with a Range request (and If-Range when the
+		server gave an ETag or Last-Modified), and the download starts again
+		from the beginning whenever the server's Content-Range does not carry
+		on from the partial file
+
+		Parameters
+		----------
+
+		filename: str
+			full Madrigal name of the file (from get_experiment_files)
+
+		fname: str
+			path to save the file as
+
+		format (optional): str
+			"hdf5", "simple" or "netCDF4" (default = "hdf5")
+		"""
+
+		url = self.service_url("getMadfile.cgi", {"fileName": filename,
+			"fileType": file_types[format], "user_fullname": self.user_fullname,
+			"user_email": self.user_email, "user_affiliation": self.user_affiliation})
+		tmp_name = fname+".tmp"
+		#what the partial file is part of, so only the same download is resumed
+		state_name = tmp_name+".json"
+		state = {"url": url}
+		offset = 0
+		if os.path.exists(tmp_name) and os.path.exists(state_name):
+			try:
+				with open(state_name) as f:
+					saved = json.load(f)
+			except ValueError:
+				saved = {}
+			if saved.get("url") == url:
+				state = saved
+				offset = os.path.getsize(tmp_name)
+
+		nbytes = 0
+		while True:
+			headers = {}
+			if offset > 0:
+				headers["Range"] = "bytes={}-".format(offset)
+				if state.get("validator") is not None:
+					headers["If-Range"] = state["validator"]
+
+			async with self._get(url, headers=headers) as response:
+				start, total = _content_range(response.headers.get("content-range"))
+				if response.status == 200:
+					#a new download (or the file changed and is sent whole)
+					state = {"url": url, "validator": response.headers.get("etag",
+						response.headers.get("last-modified"))}
+					fpi_cache.atomic_write(state_name, json.dumps(state))
+					with open(tmp_name, "wb") as f:
+						nbytes += await self._write_body(response, f)
+					expected = response.headers.get("content-length")
+					break
+				if offset > 0 and response.status == 206 and start == offset:
+					with open(tmp_name, "r+b") as f:
+						f.seek(offset)
+						f.truncate()
+						nbytes += await self._write_body(response, f)
+					expected = total
+					break
+				if offset > 0 and response.status == 416 and total == offset:
+					#the partial file already holds the whole file
+					await response.read()
+					expected = total
+					break
+				if offset == 0 or response.status not in (206, 416):
+					raise HTTPError(response.status, response.reason, url)
+
+			#the range the server answered with does not carry on from the
+			#partial file, so start again from the beginning (the unread body
+			#closes the connection)
+			offset = 0
+			os.remove(tmp_name)
+
+		if expected is not None and os.path.getsize(tmp_name) != int(expected):
+			raise ConnectionError("downloaded {} of {} bytes from {}".format(
+				os.path.getsize(tmp_name), expected, url))
+
+		os.replace(tmp_name, fname)
+		os.remove(state_name)
+		fpi_instrument.count("download_bytes", nbytes)
+
+		return nbytes
+
+	async def _write_body(self, response, f):
+
+		#writes run in the executor so a slow disk does not stall the other
+		#transfers, each one overlapping the read of the next chunk
+		nbytes = 0
+		writing = None
+		try:
+			async for data in response.iter_chunks(self.chunk_size):
+				if writing is not None:
+					await writing
+				writing = _in_thread(f.write, data)
+				nbytes += len(data)
+		finally:
+			#f is only closed once the last write is done
+			if writing is not None:
+				await writing
+
+		return nbytes
+
+	async def download(self, FPI, date, path, fname=None):
+
+		"""
+		Downloads data from the given FPI and date to path (as
+		fpi_data.download_data), returning True if data was downloaded or
+		False if none was available
+
+		Parameters
+		----------
+
+		FPI: str
+			3-letter abbreviation for FPI station
+
+		date: str
+			day to obtain data for (YYYY/MM/DD)
+
+		path: str
+			path to save data file to
+
+		fname (optional): str
+			full path to save data file as (default = path + fpi_cache.data_fname)
+		"""
+
+		if fname is None:
+			fname = os.path.join(path, fpi_cache.data_fname(FPI, date))
+		day = dt.datetime.strptime(date, "%Y/%m/%d")
+		station = fpi_stations.FPIStation(FPI)
+
+		experiments = await self.get_experiments(station.id, day, day+dt.timedelta(days=1))
+		if len(experiments) == 0:
+			return False
+		experiment_files = await self.get_experiment_files(experiments[0]["id"])
+		if len(experiment_files) == 0:
+			return False
+		experiment_file = experiment_files[0]
+		if experiment_file["category"] != 1:
+			return False
+
+		await self.download_file(experiment_file["name"], fname)
+
+		return True
+
+async def download_data_async(FPI, date, path, fname=None, client=None):
+
+	"""
+	Asyncio counterpart to fpi_data.download_data, returning True if data was
+	downloaded or False if none was available
+
+	Parameters
+	----------
+
+	FPI: str
+		3-letter abbreviation for FPI station
+
+	date: str
+		day to obtain data for (YYYY/MM/DD)
+
+	path: str
+		path to save data file to
+
+	fname (optional): str
+		full path to save data file as (default = path + fpi_cache.data_fname)
+
+	client (optional): AsyncMadrigalClient
+		client to reuse (default = open a new one for this download)
+	"""
+
+	if client is not None:
+		return await client.download(FPI, date, path, fname=fname)
+
+	async with AsyncMadrigalClient() as client:
+		return await client.download(FPI, date, path, fname=fname)
+
+async def fetch_async(cache, FPI, date, client=None):
+
+	"""
+	Returns the path of the cached file for the given FPI and date,
+	downloading it into the cache first if it is not there (as
+	FPICache.fetch). Returns None if no data was available
+
+	Parameters
+	----------
+
+	cache: FPICache
+		cache to download into (None for fpi_cache.default_cache())
+
+	FPI: str
+		3-letter abbreviation for FPI station
+
+	date: str
+		date (YYYY/MM/DD)
+
+	client (optional): AsyncMadrigalClient
+		client to reuse (default = open a new one for this download)
+	"""
+
+	if cache is None:
+		cache = fpi_cache.default_cache()
+	#looking up the cache takes its file lock, so do it off the event loop
+	fname = await _in_thread(cache.get, FPI, date)
+	if fname is not None:
+		return fname
+
+	#the .part.tmp file of an interrupted download is kept to resume from
+	tmp_name = cache.path(FPI, date)+".part"
+	try:
+		if not await download_data_async(FPI, date, cache.root, fname=tmp_name, client=client):
+			return None
+		#checksumming the file blocks, so do it off the event loop
+		return await _in_thread(cache.put, FPI, date, tmp_name)
+	finally:
+		if os.path.exists(tmp_name):
+			os.remove(tmp_name)
+
+async def download_many_async(FPIs, dates, cache=None, client=None, return_exceptions=True):
+
+	"""
+	Downloads every combination of FPIs and dates into a cache concurrently
+	(limited by the client's connection pool), returning a list of cached
+	paths (None where no data was available, or the exception raised if
+	return_exceptions is true) in (FPI, date) order
+
+	Parameters
+	----------
+
+	FPIs: str or list of str
+		3-letter abbreviations for FPI stations
+
+	dates: list of str
+		dates (YYYY/MM/DD)
+
+	cache (optional): FPICache
+		cache to download into (default = fpi_cache.default_cache())
+
+	client (optional): AsyncMadrigalClient
+		client to share (default = open a new one for these downloads)
+
+	return_exceptions (optional): bool
+		if true failed downloads give their exception instead of raising
+		(default = True)
+	"""
+
+	if isinstance(FPIs, str):
+		FPIs = [FPIs]
+	if cache is None:
+		cache = fpi_cache.default_cache()
+
+	async def run(client):
+		return await asyncio.gather(*[fetch_async(cache, FPI, date, client=client)
+			for FPI in FPIs for date in dates], return_exceptions=return_exceptions)
+
+	if client is not None:
+		return await run(client)
+	async with AsyncMadrigalClient() as client:
+		return await run(client)
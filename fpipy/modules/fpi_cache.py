@@ -0,0 +1,581 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Local on-disk cache of downloaded Madrigal FPI files
+
+Files are stored as <root>/<station>_<YYYYMMDD>.hdf5 and indexed by a small
+JSON manifest (<root>/index.json) holding the station, date, file name, size,
+checksum and last access time of every cached file, so looking up a
+station-night never needs a directory scan.
+
+Every change to the manifest re-reads it under a lock file
+(<root>/index.lock) before writing it back, so processes sharing a cache
+never drop each other's entries. Cache hits only note the access time in
+memory; these are written out in batches (see FPICache.flush).
+"""
+
+import os
+import json
+import time
+import hashlib
+import threading
+import tempfile
+import contextlib
+import datetime as dt
+
+try:
+	import fcntl
+except ImportError:
+	#no advisory file locks (Windows), only threads are serialised
+	fcntl = None
+
+from . import fpi_instrument
+
+def date_key(date):
+
+	"""
+	Returns the YYYYMMDD form of a date string
+
+	Parameters
+	----------
+
+	date: str
+		date (YYYY/MM/DD)
+	"""
+
+	return "{:04d}{:02d}{:02d}".format(int(date[0:4]), int(date[5:7]), int(date[8:10]))
+
+def date_range(date_min, date_max):
+
+	"""
+	Returns a list of every date from date_min to date_max (inclusive)
+
+	Parameters
+	----------
+
+	date_min: str
+		first date (YYYY/MM/DD)
+
+	date_max: str
+		last date (YYYY/MM/DD)
+	"""
+
+	day = dt.date(int(date_min[0:4]), int(date_min[5:7]), int(date_min[8:10]))
+	last_day = dt.date(int(date_max[0:4]), int(date_max[5:7]), int(date_max[8:10]))
+
+	dates = []
+	while day <= last_day:
+		dates.append("{:04d}/{:02d}/{:02d}".format(day.year, day.month, day.day))
+		day = day + dt.timedelta(days=1)
+
+	return dates
+
+def data_fname(FPI, date):
+
+	"""
+	Returns the local file name used for the given FPI and date
+
+	Parameters
+	----------
+
+	FPI: str
+		3-letter abbreviation for FPI station
+
+	date: str
+		date (YYYY/MM/DD)
+	"""
+
+	return "{}_{}.hdf5".format(FPI.lower(), date_key(date))
+
+def file_checksum(fname, block_size=1<<20):
+
+	"""
+	Returns the sha256 checksum of a file
+
+	Parameters
+	----------
+
+	fname: str
+		path to file
+
+	block_size (optional): int
+		number of bytes to read at a time
+	"""
+
+	sha = hashlib.sha256()
+	with open(fname, "rb") as f:
+		for block in iter(lambda: f.read(block_size), b""):
+			sha.update(block)
+
+	return "sha256:"+sha.hexdigest()
+
+def atomic_write(fname, data, mode="w"):
+
+	"""
+	Writes data to fname through a temporary file in the same directory and a
+	rename, so readers never see a partly written file
+
+	Parameters
+	----------
+
+	fname: str
+		path of file to write
+
+	data: str or bytes
+		contents to write
+
+	mode (optional): str
+		file mode ("w" for text, "wb" for bytes)
+	"""
+
+	directory = os.path.dirname(os.path.abspath(fname))
+	fd, tmp_name = tempfile.mkstemp(dir=directory, prefix=".tmp_")
+	try:
+		with os.fdopen(fd, mode) as f:
+			f.write(data)
+		os.replace(tmp_name, fname)
+	except BaseException:
+		if os.path.exists(tmp_name):
+			os.remove(tmp_name)
+		raise
+
+	return
+
+def default_cache_root():
+
+	"""
+	Returns the default cache directory, taken from the FPIPY_CACHE environment
+	variable or else the Madrigal data directory on luna
+	"""
+
+	root = os.environ.get("FPIPY_CACHE")
+	if root is None:
+		import lunapath
+		root = lunapath.base_path+"users/daye1/Madrigal/Data/"
+
+	return root
+
+class FPICache():
+
+	"""
+	A class used to store, look up and evict downloaded FPI data files
+	"""
+
+	def __init__(self, root=None, max_bytes=None, flush_every=64, flush_interval=60):
+
+		"""
+		Parameters
+		----------
+
+		root (optional): str
+			directory to keep cached files in (default = default_cache_root())
+
+		max_bytes (optional): int
+			maximum total size of cached files, least recently used files are
+			removed beyond this (default = no limit)
+
+		flush_every (optional): int
+			number of cache hits after which their access times are written
+			to the manifest (default = 64)
+
+		flush_interval (optional): float
+			seconds after which pending access times are written to the
+			manifest on the next cache hit (default = 60)
+		"""
+
+		if root is None:
+			root = default_cache_root()
+		self.root = root
+		self.max_bytes = max_bytes
+		self.flush_every = flush_every
+		self.flush_interval = flush_interval
+		self.manifest = os.path.join(root, "index.json")
+		self.lock_fname = os.path.join(root, "index.lock")
+
+		self._lock = threading.RLock()
+		self._locked = 0
+		self._mtime = None
+		self._index = {}
+		#access times of cache hits not yet written to the manifest
+		self._accessed = {}
+		self._flushed = time.time()
+
+		os.makedirs(root, exist_ok=True)
+		self._read_index()
+
+		return
+
+	def _read_index(self):
+
+		"""
+		(Re)loads the manifest from disk
+		"""
+
+		try:
+			mtime = os.stat(self.manifest).st_mtime_ns
+		except FileNotFoundError:
+			self._index = {}
+			self._mtime = None
+			return
+
+		with open(self.manifest, "r") as f:
+			self._index = json.load(f)
+		self._mtime = mtime
+
+		return
+
+	def _refresh(self):
+
+		"""
+		Reloads the manifest if another process has written to it
+		"""
+
+		try:
+			mtime = os.stat(self.manifest).st_mtime_ns
+		except FileNotFoundError:
+			mtime = None
+		if mtime != self._mtime:
+			self._read_index()
+
+		return
+
+	def _write_index(self):
+
+		"""
+		Writes the manifest to disk atomically (call inside _transaction)
+		"""
+
+		atomic_write(self.manifest, json.dumps(self._index, indent=1, sort_keys=True))
+		self._mtime = os.stat(self.manifest).st_mtime_ns
+
+		return
+
+	@contextlib.contextmanager
+	def _transaction(self):
+
+		"""
+		Context manager holding the manifest lock: the manifest is re-read from
+		disk on entry, pending access times are merged into it, and it is
+		written back on exit
+		"""
+
+		with self._lock:
+			#nested transactions share the outer one's lock and write
+			if self._locked > 0:
+				yield
+				return
+
+			with open(self.lock_fname, "a") as lock_file:
+				if fcntl is not None:
+					fcntl.flock(lock_file, fcntl.LOCK_EX)
+				self._locked += 1
+				try:
+					self._read_index()
+					self._merge_accessed()
+					yield
+					self._write_index()
+				finally:
+					self._locked -= 1
+					if fcntl is not None:
+						fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+		return
+
+	def _merge_accessed(self):
+
+		"""
+		Moves pending access times into the in-memory manifest
+		"""
+
+		for key, last_access in self._accessed.items():
+			entry = self._index.get(key)
+			if entry is not None:
+				entry["last_access"] = max(entry.get("last_access", 0), last_access)
+		self._accessed = {}
+		self._flushed = time.time()
+
+		return
+
+	def flush(self):
+
+		"""
+		Writes the access times of cache hits since the last write to the
+		manifest
+		"""
+
+		with self._lock:
+			if len(self._accessed) > 0:
+				with self._transaction():
+					pass
+
+		return
+
+	def key(self, FPI, date):
+
+		"""
+		Returns the manifest key for the given FPI and date
+		"""
+
+		return "{}_{}".format(FPI.lower(), date_key(date))
+
+	def path(self, FPI, date):
+
+		"""
+		Returns the path the given FPI and date are (or would be) cached at
+		"""
+
+		return os.path.join(self.root, data_fname(FPI, date))
+
+	def entry(self, FPI, date):
+
+		"""
+		Returns the manifest entry (station, date, file, size, checksum,
+		last_access) for the given FPI and date, or None if it is not cached
+		"""
+
+		with self._lock:
+			entry = self._index.get(self.key(FPI, date))
+			if entry is None:
+				self._refresh()
+				entry = self._index.get(self.key(FPI, date))
+
+			return None if entry is None else dict(entry)
+
+	def get(self, FPI, date):
+
+		"""
+		Returns the path of the cached file for the given FPI and date and marks
+		it as used, or None if it is not cached
+
+		Parameters
+		----------
+
+		FPI: str
+			3-letter abbreviation for FPI station
+
+		date: str
+			date (YYYY/MM/DD)
+		"""
+
+		with self._lock:
+			key = self.key(FPI, date)
+			if key not in self._index:
+				self._refresh()
+			entry = self._index.get(key)
+			if entry is None:
+				fpi_instrument.count("cache_miss")
+				return None
+
+			fname = os.path.join(self.root, entry["file"])
+			#file was removed behind our back
+			if not os.path.isfile(fname):
+				with self._transaction():
+					entry = self._index.get(key)
+					if entry is not None and entry["file"] == os.path.basename(fname):
+						del self._index[key]
+				fpi_instrument.count("cache_miss")
+				return None
+			fpi_instrument.count("cache_hit")
+
+			#access times are written in batches rather than on every hit
+			now = time.time()
+			self._accessed[key] = now
+			if (len(self._accessed) >= self.flush_every
+					or now - self._flushed >= self.flush_interval):
+				self.flush()
+
+			return fname
+
+	def put(self, FPI, date, fname):
+
+		"""
+		Moves a downloaded file into the cache and records it in the manifest,
+		returning its cached path
+
+		Parameters
+		----------
+
+		FPI: str
+			3-letter abbreviation for FPI station
+
+		date: str
+			date (YYYY/MM/DD)
+
+		fname: str
+			path to the downloaded file (should be on the same filesystem as
+			the cache so the move is an atomic rename)
+		"""
+
+		cache_fname = self.path(FPI, date)
+		checksum = file_checksum(fname)
+		size = os.path.getsize(fname)
+
+		with self._transaction():
+			os.replace(fname, cache_fname)
+			self._index[self.key(FPI, date)] = {
+				"station": FPI.lower(),
+				"date": date,
+				"file": os.path.basename(cache_fname),
+				"size": size,
+				"checksum": checksum,
+				"last_access": time.time(),
+			}
+			self.evict(keep=[self.key(FPI, date)])
+
+		return cache_fname
+
+	def fetch(self, FPI, date, download):
+
+		"""
+		Returns the path of the cached file for the given FPI and date, calling
+		download to get it first if it is not cached. Returns None if no data
+		could be downloaded
+
+		Parameters
+		----------
+
+		FPI: str
+			3-letter abbreviation for FPI station
+
+		date: str
+			date (YYYY/MM/DD)
+
+		download: function
+			called as download(FPI, date, path, fname=fname) and returns True
+			if data was downloaded to fname (e.g. fpi_data.download_data)
+		"""
+
+		fname = self.get(FPI, date)
+		if fname is not None:
+			return fname
+
+		#every fetch downloads to its own file, as other threads and processes
+		#sharing the cache can be fetching the same night
+		fd, tmp_name = tempfile.mkstemp(dir=self.root, prefix=".part_", suffix=".hdf5")
+		os.close(fd)
+		try:
+			if not download(FPI, date, self.root, fname=tmp_name):
+				return None
+			return self.put(FPI, date, tmp_name)
+		finally:
+			if os.path.exists(tmp_name):
+				os.remove(tmp_name)
+
+	def remove(self, FPI, date):
+
+		"""
+		Removes the given FPI and date from the cache
+		"""
+
+		with self._transaction():
+			self._accessed.pop(self.key(FPI, date), None)
+			entry = self._index.pop(self.key(FPI, date), None)
+			if entry is not None:
+				fname = os.path.join(self.root, entry["file"])
+				if os.path.exists(fname):
+					os.remove(fname)
+
+		return
+
+	def total_bytes(self):
+
+		"""
+		Returns the total size of the cached files in bytes
+		"""
+
+		with self._lock:
+			return sum(entry["size"] for entry in self._index.values())
+
+	def evict(self, max_bytes=None, keep=[]):
+
+		"""
+		Removes the least recently used files until the cache is no bigger than
+		max_bytes, returning the keys of the removed files
+
+		Parameters
+		----------
+
+		max_bytes (optional): int
+			size to shrink the cache to (default = self.max_bytes)
+
+		keep (optional): list of str
+			manifest keys that must not be removed
+		"""
+
+		if max_bytes is None:
+			max_bytes = self.max_bytes
+		if max_bytes is None:
+			return []
+
+		removed = []
+		with self._transaction():
+			total = self.total_bytes()
+			lru = sorted(self._index.items(), key=lambda item: item[1]["last_access"])
+			for key, entry in lru:
+				if total <= max_bytes:
+					break
+				if key in keep:
+					continue
+				fname = os.path.join(self.root, entry["file"])
+				if os.path.exists(fname):
+					os.remove(fname)
+				del self._index[key]
+				total -= entry["size"]
+				removed.append(key)
+
+		return removed
+
+	def rebuild(self):
+
+		"""
+		Rebuilds the manifest from the files in the cache directory (for files
+		downloaded before the manifest existed)
+		"""
+
+		with self._transaction():
+			index = {}
+			for fname in os.listdir(self.root):
+				name, ext = os.path.splitext(fname)
+				if ext != ".hdf5" or "_" not in name:
+					continue
+				FPI, date = name.rsplit("_", 1)
+				if len(date) != 8 or not date.isdigit():
+					continue
+				date = "{}/{}/{}".format(date[0:4], date[4:6], date[6:8])
+				path = os.path.join(self.root, fname)
+				index[self.key(FPI, date)] = {
+					"station": FPI,
+					"date": date,
+					"file": fname,
+					"size": os.path.getsize(path),
+					"checksum": file_checksum(path),
+					"last_access": os.path.getatime(path),
+				}
+			self._index = index
+
+		return
+
+	def __contains__(self, item):
+
+		FPI, date = item
+
+		return self.entry(FPI, date) is not None
+
+	def __len__(self):
+
+		return len(self._index)
+
+_default_cache = None
+
+def default_cache():
+
+	"""
+	Returns the shared FPICache at default_cache_root(), creating it on first
+	use
+	"""
+
+	global _default_cache
+	if _default_cache is None:
+		_default_cache = FPICache()
+
+	return _default_cache
@@ -0,0 +1,177 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Columnar cache of parsed FPI tables
+
+Every cached table is a directory of typed, contiguous .npy column files
+(<root>/<key>/<column>.npy) plus a meta.json holding the cache format version,
+the checksum of the source data, the number of rows and each column's dtype.
+Reading a cached table memory maps the columns, so nothing is decoded again.
+"""
+
+import os
+import json
+import shutil
+import tempfile
+
+import numpy as np
+
+from . import fpi_cache
+
+#bump whenever the columns written by FPIData.get_table change
+column_cache_version = 3
+
+class ColumnCache():
+
+	"""
+	A class used to save and load the parsed columns of FPI tables
+	"""
+
+	def __init__(self, root=None):
+
+		"""
+		Parameters
+		----------
+
+		root (optional): str
+			directory to keep cached columns in
+			(default = fpi_cache.default_cache_root() + "columns")
+		"""
+
+		if root is None:
+			root = os.path.join(fpi_cache.default_cache_root(), "columns")
+		self.root = root
+		os.makedirs(root, exist_ok=True)
+
+		return
+
+	def path(self, key):
+
+		"""
+		Returns the directory the given table is (or would be) cached in
+		"""
+
+		return os.path.join(self.root, key)
+
+	def meta(self, key):
+
+		"""
+		Returns the meta data (version, checksum, nrows, columns) of the given
+		table, or None if it is not cached
+		"""
+
+		try:
+			with open(os.path.join(self.path(key), "meta.json"), "r") as f:
+				return json.load(f)
+		except FileNotFoundError:
+			return None
+
+	def load(self, key, checksum, mmap=True):
+
+		"""
+		Returns a dictionary of the cached columns of the given table, or None
+		if it is not cached or was cached from a different version of the
+		source data or an older cache format
+
+		Parameters
+		----------
+
+		key: str
+			name of the cached table (e.g. "uao_20131002")
+
+		checksum: str
+			checksum of the source data the columns must have come from
+
+		mmap (optional): bool
+			if true will memory map the columns (read only) instead of reading
+			them into memory
+		"""
+
+		meta = self.meta(key)
+		if meta is None:
+			return None
+		if meta["version"] != column_cache_version or meta["checksum"] != checksum:
+			return None
+
+		mmap_mode = "r" if mmap else None
+		columns = {}
+		for name in meta["columns"]:
+			columns[name] = np.load(os.path.join(self.path(key), name+".npy"),
+						   mmap_mode=mmap_mode)
+
+		return columns
+
+	def save(self, key, checksum, columns):
+
+		"""
+		Writes the columns of a table to the cache, replacing anything already
+		cached under key. The columns are written to a temporary directory that
+		is then renamed into place
+
+		Parameters
+		----------
+
+		key: str
+			name of the cached table (e.g. "uao_20131002")
+
+		checksum: str
+			checksum of the source data the columns came from
+
+		columns: dict
+			column name -> array
+		"""
+
+		tmp_path = tempfile.mkdtemp(dir=self.root, prefix=".tmp_")
+		try:
+			nrows = None
+			dtypes = {}
+			for name, column in columns.items():
+				column = np.ascontiguousarray(column)
+				np.save(os.path.join(tmp_path, name+".npy"), column)
+				dtypes[name] = column.dtype.str
+				if nrows is None and column.ndim > 0:
+					nrows = len(column)
+			meta = {"version": column_cache_version, "checksum": checksum,
+				"nrows": nrows, "columns": dtypes}
+			with open(os.path.join(tmp_path, "meta.json"), "w") as f:
+				json.dump(meta, f, indent=1)
+
+			#move any old copy out of the way before renaming the new one in
+			path = self.path(key)
+			old_path = None
+			if os.path.exists(path):
+				old_path = tempfile.mkdtemp(dir=self.root, prefix=".old_")
+				os.rename(path, os.path.join(old_path, key))
+			os.rename(tmp_path, path)
+			if old_path is not None:
+				shutil.rmtree(old_path, ignore_errors=True)
+		except BaseException:
+			shutil.rmtree(tmp_path, ignore_errors=True)
+			raise
+
+		return
+
+	def invalidate(self, key):
+
+		"""
+		Removes the given table from the cache
+		"""
+
+		shutil.rmtree(self.path(key), ignore_errors=True)
+
+		return
+
+_default_column_cache = None
+
+def default_column_cache():
+
+	"""
+	Returns the shared ColumnCache under fpi_cache.default_cache_root(),
+	creating it on first use
+	"""
+
+	global _default_column_cache
+	if _default_column_cache is None:
+		_default_column_cache = ColumnCache()
+
+	return _default_column_cache
@@ -0,0 +1,331 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Conjunctions between FPI look points and radar (e.g. SuperDARN) vectors
+
+A ConjunctionIndex puts the FPI look points (see FPIData.get_look_points) in
+a uniform grid of cubic cells over Earth centred coordinates, which has no
+trouble at the poles or the date line, and sorts the points of each cell by
+time. Radar vectors are matched in bulk: each one looks up the 27 cells around
+it with a binary search over the occupied cells, takes the time window
+[t - max_dt, t + max_dt] within each by another binary search, and the
+candidates are then checked against the great circle distance. Queries run in
+chunks so memory stays bounded for full nights of radar data.
+
+	index = ConjunctionIndex.from_data(data, max_dist=200, max_dt=120)
+	pairs = index.query(radar_lat, radar_lon, radar_epoch)
+	winds = data.los_v[pairs["fpi"]]
+"""
+
+import numpy as np
+
+from . import fpi_tools
+
+earth_radius = 6371.0
+
+#smallest grid cell (km), so the packed cell keys of cell_keys fit in int64
+min_cell_size = 0.1
+
+#fields of each matched pair returned by ConjunctionIndex.query
+pair_dtype = np.dtype([
+	("fpi", "int64"), #index of the FPI point
+	("radar", "int64"), #index of the radar vector
+	("dist", "float64"), #great circle distance (km)
+	("dt", "int64"), #radar time - FPI time (s)
+])
+
+#offsets of a cell and its 26 neighbours
+_neighbours = np.stack(np.meshgrid([-1, 0, 1], [-1, 0, 1], [-1, 0, 1], indexing="ij"),
+				   axis=-1).reshape(-1, 3)
+
+def to_xyz(lat, lon, radius=earth_radius):
+
+	"""
+	Returns Earth centred x, y, z (km) of points on a sphere
+
+	Parameters
+	----------
+
+	lat, lon: float arrays
+		latitude and longitude (degrees)
+
+	radius (optional): float
+		radius of the sphere in km (default = earth_radius)
+	"""
+
+	lat = np.deg2rad(np.asarray(lat, dtype="float"))
+	lon = np.deg2rad(np.asarray(lon, dtype="float"))
+
+	return (radius*np.cos(lat)*np.cos(lon), radius*np.cos(lat)*np.sin(lon),
+		 radius*np.sin(lat))
+
+def great_circle(lat1, lon1, lat2, lon2, radius=earth_radius):
+
+	"""
+	Returns the great circle distance (km) between points (haversine)
+
+	Parameters
+	----------
+
+	lat1, lon1, lat2, lon2: float arrays
+		latitude and longitude of each point (degrees)
+
+	radius (optional): float
+		radius of the sphere in km (default = earth_radius)
+	"""
+
+	lat1, lon1, lat2, lon2 = [np.deg2rad(np.asarray(x, dtype="float")) for x in [lat1, lon1, lat2, lon2]]
+	a = np.sin((lat2-lat1)/2)**2 + np.cos(lat1)*np.cos(lat2)*np.sin((lon2-lon1)/2)**2
+
+	return 2*radius*np.arcsin(np.sqrt(np.clip(a, 0, 1)))
+
+class ConjunctionIndex():
+
+	"""
+	A class used to index FPI look points in space and time and find the
+	radar vectors within a distance and time of them
+	"""
+
+	def __init__(self, lat, lon, epoch, max_dist=200.0, max_dt=120):
+
+		"""
+		Parameters
+		----------
+
+		lat, lon: float arrays
+			geographic (or aacgm) latitude and longitude of every FPI point
+			(degrees)
+
+		epoch: int array
+			time of every FPI point (seconds since 1970/01/01, or anything
+			fpi_tools.to_epoch accepts)
+
+		max_dist (optional): float
+			largest distance of a match in km (default = 200), points are
+			gridded in cells of at least min_cell_size however small it is
+
+		max_dt (optional): int
+			largest time difference of a match in seconds (default = 120)
+		"""
+
+		self.lat = np.asarray(lat, dtype="float").ravel()
+		self.lon = np.asarray(lon, dtype="float").ravel()
+		self.epoch = np.asarray(fpi_tools.to_epoch(epoch), dtype="int64").ravel()
+		self.max_dist = float(max_dist)
+		self.max_dt = int(max_dt)
+		if not self.max_dist >= 0 or not np.isfinite(self.max_dist):
+			raise ValueError("max_dist must be a finite distance of at least 0 km")
+		if self.max_dt < 0:
+			raise ValueError("max_dt must be at least 0 s")
+		#chords are never longer than arcs, so cells at least max_dist wide
+		#hold every match of a point in its own or a neighbouring cell
+		self.cell_size = max(self.max_dist, min_cell_size)
+
+		#leave out points without a position
+		valid = np.flatnonzero(np.isfinite(self.lat) & np.isfinite(self.lon))
+		keys = self.cell_keys(self.cells(self.lat[valid], self.lon[valid]))
+
+		#sort by cell then time
+		order = np.lexsort((self.epoch[valid], keys))
+		self.order = valid[order]
+		self.keys, self.starts, counts = np.unique(keys[order], return_index=True, return_counts=True)
+		#one sorted key per point combining its cell and time, so every time
+		#window of every cell is found by a single searchsorted
+		self.epoch0 = int(self.epoch[self.order].min()) if len(order) > 0 else 0
+		self.span = int(self.epoch[self.order].max()) - self.epoch0 + 1 if len(order) > 0 else 1
+		self.sorted_keys = (np.repeat(np.arange(len(self.keys), dtype="int64"), counts)*self.span
+						+ self.epoch[self.order] - self.epoch0)
+		#rows of the FPI data each point refers to (see from_data)
+		self.rows = np.arange(len(self.lat))
+
+		return
+
+	@classmethod
+	def from_data(cls, data, max_dist=200.0, max_dt=120, index=None, aacgm=False, **kwargs):
+
+		"""
+		Indexes the look points of an FPIData (after get_table, see
+		FPIData.get_look_points)
+
+		Parameters
+		----------
+
+		data: FPIData
+			FPI records to index
+
+		max_dist, max_dt (optional):
+			match tolerances (see ConjunctionIndex)
+
+		index (optional): int array
+			records to index (default = all records), pair "fpi" indexes
+			still refer to rows of data
+
+		aacgm (optional): bool
+			if true will index the aacgm look points instead of the geographic
+			ones
+
+		**kwargs:
+			passed to FPIData.get_look_points (e.g. station, alt, time_res)
+		"""
+
+		rows = np.arange(len(data.epoch)) if index is None else np.asarray(index)
+		points = data.get_look_points(index=rows, aacgm=aacgm, **kwargs)
+		lat, lon = points[2:4] if aacgm else points[0:2]
+
+		self = cls(lat, lon, data.epoch[rows], max_dist=max_dist, max_dt=max_dt)
+		self.rows = rows
+
+		return self
+
+	def cells(self, lat, lon):
+
+		"""
+		Returns the (n, 3) integer grid cells of points
+		"""
+
+		x, y, z = to_xyz(lat, lon)
+
+		return np.floor(np.stack([x, y, z], axis=-1)/self.cell_size).astype("int64")
+
+	def cell_keys(self, cells):
+
+		"""
+		Packs (n, 3) grid cells into single int64 keys
+		"""
+
+		#cells span +-earth_radius/cell_size, shift them to be positive
+		offset = int(np.ceil(earth_radius/self.cell_size))+2
+		size = 2*offset+1
+		if size**3 >= 2**63:
+			raise ValueError("cells of {} km are too small to key".format(self.cell_size))
+		cells = np.asarray(cells) + offset
+
+		return (cells[..., 0]*size + cells[..., 1])*size + cells[..., 2]
+
+	def __len__(self):
+
+		return len(self.order)
+
+	def query(self, lat, lon, epoch, max_dist=None, max_dt=None, chunk_size=100000):
+
+		"""
+		Returns every (FPI point, radar vector) pair within max_dist and max_dt
+		of each other, as a pair_dtype array sorted by radar vector then FPI
+		point
+
+		Parameters
+		----------
+
+		lat, lon: float arrays
+			latitude and longitude of every radar vector (degrees, in the same
+			coordinates as the index)
+
+		epoch: int array
+			time of every radar vector (seconds since 1970/01/01, or anything
+			fpi_tools.to_epoch accepts)
+
+		max_dist, max_dt (optional):
+			tighter tolerances than the index was built for
+			(default = those of the index)
+
+		chunk_size (optional): int
+			radar vectors matched at a time (default = 100000)
+		"""
+
+		if max_dist is None:
+			max_dist = self.max_dist
+		if max_dt is None:
+			max_dt = self.max_dt
+		if max_dist > self.max_dist or max_dt > self.max_dt:
+			raise Exception("query tolerances can not be larger than the index's")
+
+		lat = np.asarray(lat, dtype="float").ravel()
+		lon = np.asarray(lon, dtype="float").ravel()
+		epoch = np.broadcast_to(np.asarray(fpi_tools.to_epoch(epoch), dtype="int64"), lat.shape)
+
+		pairs = []
+		for start in range(0, len(lat), max(chunk_size, 1)):
+			stop = min(start+chunk_size, len(lat))
+			pairs.append(self._query_chunk(lat[start:stop], lon[start:stop], epoch[start:stop],
+								  start, max_dist, max_dt))
+		if len(pairs) == 0:
+			return np.empty(0, dtype=pair_dtype)
+
+		return np.concatenate(pairs)
+
+	def _query_chunk(self, lat, lon, epoch, offset, max_dist, max_dt):
+
+		valid = np.flatnonzero(np.isfinite(lat) & np.isfinite(lon))
+		if len(valid) == 0 or len(self.keys) == 0:
+			return np.empty(0, dtype=pair_dtype)
+
+		#the 27 cells around every radar vector
+		cells = self.cells(lat[valid], lon[valid])
+		keys = self.cell_keys(cells[:, None, :] + _neighbours[None, :, :]).ravel()
+		query = np.repeat(valid, len(_neighbours))
+
+		#occupied cells, then the time window within each
+		slot = np.clip(np.searchsorted(self.keys, keys), 0, len(self.keys)-1)
+		found = self.keys[slot] == keys
+		query = query[found]
+		slot = slot[found]
+		t = epoch[query] - self.epoch0
+		lo = np.searchsorted(self.sorted_keys, slot*self.span + np.clip(t-max_dt, 0, self.span), side="left")
+		hi = np.searchsorted(self.sorted_keys, slot*self.span + np.clip(t+max_dt, -1, self.span-1), side="right")
+
+		#expand the [lo, hi) ranges into candidate pairs
+		counts = np.maximum(hi-lo, 0)
+		keep = counts > 0
+		query, lo, counts = query[keep], lo[keep], counts[keep]
+		total = int(counts.sum())
+		if total == 0:
+			return np.empty(0, dtype=pair_dtype)
+		radar = np.repeat(query, counts)
+		within = np.arange(total) - np.repeat(np.cumsum(counts)-counts, counts)
+		point = self.order[np.repeat(lo, counts) + within]
+
+		dist = great_circle(self.lat[point], self.lon[point], lat[radar], lon[radar])
+		match = dist <= max_dist
+
+		out = np.empty(int(match.sum()), dtype=pair_dtype)
+		out["fpi"] = self.rows[point[match]]
+		out["radar"] = radar[match] + offset
+		out["dist"] = dist[match]
+		out["dt"] = epoch[radar[match]] - self.epoch[point[match]]
+
+		return out[np.lexsort((out["fpi"], out["radar"]))]
+
+def nearest(pairs, by="radar", dt_scale=None):
+
+	"""
+	Returns the closest match of every radar vector (or FPI point) among
+	pairs from ConjunctionIndex.query
+
+	Parameters
+	----------
+
+	pairs: pair_dtype array
+		matches to reduce
+
+	by (optional): str
+		"radar" to keep one pair per radar vector, "fpi" to keep one per FPI
+		point (default = "radar")
+
+	dt_scale (optional): float
+		km per second of time difference added to the distance when ranking,
+		so closer times win among equally close points (default = rank by
+		distance, then by |dt|)
+	"""
+
+	if by not in ["radar", "fpi"]:
+		raise Exception("by must be 'radar' or 'fpi'")
+	if len(pairs) == 0:
+		return pairs
+
+	if dt_scale is None:
+		order = np.lexsort((np.abs(pairs["dt"]), pairs["dist"], pairs[by]))
+	else:
+		order = np.lexsort((pairs["dist"] + dt_scale*np.abs(pairs["dt"]), pairs[by]))
+	first = np.r_[True, pairs[by][order][1:] != pairs[by][order][:-1]]
+
+	return pairs[order[first]]
@@ -8,16 +8,16 @@ Created on Mon Jan 25 08:38:12 2021
 
 import numpy as np
 import os
-import h5py
-import pydatadarn
-import math
-import elliotools
-import lunapath
+import hashlib
 import fpipy
+from . import fpi_cache
+from . import fpi_hdf5
+from . import fpi_columns
+from . import fpi_filter
+from . import fpi_stations
+from . import fpi_instrument
 import datetime as dt
 
-import madrigalWeb.madrigalWeb
-
 self_path = "/home/elliott/Documents/madrigalWeb-3.2/madrigalWeb/Data/"
 fname = self_path+"minime05_uao_20131002.cedar.008.hdf5"
 
@@ -27,7 +27,79 @@ user_affiliation = "Lancaster University"
 
 madrigalURL = "http://cedar.openmadrigal.org"
 
-def download_data(FPI, date, path):
+#Table Layout fields get_table builds the epoch column from (year, month, day,
+#hour, min and sec are then derived from epoch when asked for)
+time_fields = fpi_filter.time_fields
+
+#attribute name, Table Layout field and dtype of each column made by get_table
+table_columns = [
+	("recno", "recno", "int32"),
+	("kindat", "kindat", "int16"),
+	("kinst", "kinst", "int16"),
+	("elm", "elm", "int16"),
+	("azm", "azm", "int16"),
+	("gdalt", "gdalt", "int16"),
+	("temp", "tn", "float32"),
+	("dtemp", "dtn", "float32"),
+	("los_v", "vnu", "float32"),
+	("dlos_v", "dvnu", "float32"),
+	("temp_err", "temp_err", "int8"),
+	("wind_err", "wind_err", "int8"),
+]
+
+#calendar columns derived from epoch and their dtypes
+calendar_columns = [("year", "int16"), ("month", "int8"), ("day", "int8"), 
+	("hour", "int8"), ("min", "int8"), ("sec", "int8")]
+
+#fields of the wind product made by FPIData.get_winds
+wind_dtype = np.dtype([
+	("epoch", "int64"), #seconds since 1970/01/01
+	("merid", "float64"), #meridional wind (northward positive)
+	("dmerid", "float64"),
+	("zonal", "float64"), #zonal wind (eastward positive)
+	("dzonal", "float64"),
+	("vert", "float64"), #vertical wind (upward positive)
+	("dvert", "float64"),
+	("temp", "float64"), #neutral temperature (K)
+	("dtemp", "float64"),
+])
+
+#columns get_table always needs (for look directions)
+required_columns = ["elm", "azm"]
+
+def compact_column(column, dtype, name="column"):
+	
+	"""
+	Returns column as an array of dtype, raising a ValueError if it holds
+	values outside the range of an integer dtype (instead of letting them
+	wrap around)
+	
+	Parameters
+	----------
+	
+	column: array
+		values to convert
+		
+	dtype: numpy dtype
+		dtype to convert to (see table_columns)
+		
+	name (optional): str
+		name of the column, for the error message
+	"""
+	
+	column = np.asarray(column)
+	dtype = np.dtype(dtype)
+	if dtype.kind in "iu" and column.size > 0 and not np.can_cast(column.dtype, dtype):
+		info = np.iinfo(dtype)
+		values = column[np.isfinite(column)] if column.dtype.kind == "f" else column
+		if values.size > 0 and (values.min() < info.min or values.max() > info.max):
+			raise ValueError("{} holds values from {} to {} which do not fit in {}".format(
+				name, values.min(), values.max(), dtype))
+	
+	return column.astype(dtype, copy=False)
+
+@fpi_instrument.timed("download_data")
+def download_data(FPI, date, path, fname=None, Data=None):
 	
 	"""
 	Downloads data from the given FPI and date to path
@@ -44,6 +116,12 @@ def download_data(FPI, date, path):
 	path: str
 		path to save data file to
 		
+	fname (optional): str
+		full path to save data file as (default = path + fpi_cache.data_fname)
+		
+	Data (optional): madrigalWeb.madrigalWeb.MadrigalData
+		Madrigal connection to reuse (default = open a new one)
+		
 	Returns
 	-------
 	
@@ -53,7 +131,9 @@ def download_data(FPI, date, path):
 	year = int(date[0:4])
 	month = int(date[5:7])
 	day = int(date[8:10])
-	save_name = "{}{}_{}{}{}.hdf5".format(path, FPI, year, month, day)
+	if fname is None:
+		fname = os.path.join(path, fpi_cache.data_fname(FPI, date))
+	next_day = dt.date(year, month, day) + dt.timedelta(days=1)
 	
 	#get FPI station id
 	FPI = fpipy.FPIStation(FPI)
@@ -64,20 +144,66 @@ def download_data(FPI, date, path):
 	user_affiliation = "Lancaster University"
 	madrigalURL = "http://cedar.openmadrigal.org"
 	
-	Data = madrigalWeb.madrigalWeb.MadrigalData(madrigalURL)
-	experiment = Data.getExperiments(FPI.id, year, month, day, 0, 0, 0, 
-								  year, month, day+1, 0, 0, 0)[0]
-	experiment_file = Data.getExperimentFiles(experiment.id)[0]
+	if Data is None:
+		import madrigalWeb.madrigalWeb
+		Data = madrigalWeb.madrigalWeb.MadrigalData(madrigalURL)
+	experiments = Data.getExperiments(FPI.id, year, month, day, 0, 0, 0, 
+								  next_day.year, next_day.month, next_day.day, 0, 0, 0)
+	if len(experiments) == 0:
+		return False
+	experiment_files = Data.getExperimentFiles(experiments[0].id)
+	if len(experiment_files) == 0:
+		return False
+	experiment_file = experiment_files[0]
 	if experiment_file.category == 1:
-		Data.downloadFile(experiment_file.name, save_name,  user_fullname, 
-					user_email, user_affiliation, "hdf5")
+		#download to a temporary file so a failed download never leaves a
+		#partial file at fname
+		tmp_name = fname+".tmp"
+		try:
+			Data.downloadFile(experiment_file.name, tmp_name,  user_fullname, 
+						user_email, user_affiliation, "hdf5")
+			os.replace(tmp_name, fname)
+			fpi_instrument.count("download_bytes", os.path.getsize(fname))
+		finally:
+			if os.path.exists(tmp_name):
+				os.remove(tmp_name)
 		return True
 	else:
 		return False
 
+#tables FPIData loads from its hdf5 files
+table_attrs = ["Table_Layout", "Data_Params", "Experiment_Notes", "Experiment_Params", 
+	"records"]
+
+def _table_property(attr, doc):
+	
+	#the tables are read from the files on first access when a column cache
+	#hit left them unread (see FPIData.read_files)
+	def get(self):
+		if self._unread:
+			self.read_files()
+		return self._tables.get(attr)
+	
+	def set(self, table):
+		self._tables[attr] = table
+		
+	return property(get, set, doc=doc)
+
 class FPIData():
+	
+	__slots__ = ["date", "station", "filter", "fname", "files", "file_offsets", "_tables", 
+			  "_unread", "column_cache", "column_key", "checksum", "epoch", "direction", 
+			  "dir_order", "dir_epoch", "dir_bounds", "_calendar", "_times", 
+			  "_dtimes"] + [attr for attr, field, dtype in table_columns]
+	
+	Table_Layout = _table_property("Table_Layout", "Table Layout rows")
+	Data_Params = _table_property("Data_Params", "Metadata/Data Parameters table")
+	Experiment_Notes = _table_property("Experiment_Notes", "Metadata/Experiment Notes table")
+	Experiment_Params = _table_property("Experiment_Params", 
+		"Metadata/Experiment Parameters table")
+	records = _table_property("records", "Metadata/_record_layout table")
 
-	def __init__(self, FPI, date):
+	def __init__(self, FPI, date, cache=None, lazy=False, column_cache=None, filter=None):
 		
 		"""
 		Collects data from the given FPI and date
@@ -90,27 +216,241 @@ class FPIData():
 			
 		date: str
 			date to obtain data for (YYYY/MM/DD)
+			
+		cache (optional): FPICache
+			local cache to load data from or download data into
+			(default = fpi_cache.default_cache())
+			
+		lazy (optional): bool
+			if true will keep the file open and only read columns when 
+			get_table asks for them (see load_HDF5)
+			
+		column_cache (optional): ColumnCache
+			cache of parsed columns for get_table to load from or save to, the
+			file is opened lazily when its columns are already cached
+			
+		filter (optional): fpi_filter.TableFilter
+			only load the Table Layout rows matching these predicates (see
+			load_HDF5)
 		"""
 		
 		self.date = date
-		#check if data has already been downloaded
-		luna_path = lunapath.base_path
-		data_path = luna_path+"users/daye1/Madrigal/Data/"
-		year = int(date[0:4])
-		month = int(date[5:7])
-		day = int(date[8:10])
-		fname = "{}{}_{}{}{}.hdf5".format(data_path, FPI, year, month, day)
-		file_list = os.listdir(data_path)
-		#if data has not been downloaded then do it now
-		if fname not in file_list:
-			download_data(FPI, date, data_path)
+		self.station = FPI
+		self.filter = filter
+		self._tables = {}
+		self._unread = False
+		#get the data from the local cache, downloading it if needed
+		if cache is None:
+			cache = fpi_cache.default_cache()
+		fname = cache.fetch(FPI, date, download_data)
+		if fname is None:
+			raise Exception("no {} data available for {}".format(FPI, date))
+		self.fname = fname
+		
+		self.column_cache = column_cache
+		self.column_key = cache.key(FPI, date)
+		if filter is not None:
+			self.column_key += "_"+filter.key()
+		self.checksum = cache.entry(FPI, date)["checksum"]
+		self.files = [fname]
+		#nothing needs to be read from the table if the columns are cached
+		if column_cache is not None and self.columns_cached():
+			if filter is not None:
+				#the cached columns are already filtered
+				self.defer_tables()
+				return
+			lazy = True
 		
 		#load the data
-		self.Table_Layout, self.Data_Params, self.Experiment_Notes, self.Experiment_Params, self.records = self.load_HDF5(fname)
+		self.Table_Layout, self.Data_Params, self.Experiment_Notes, self.Experiment_Params, self.records = self.load_HDF5(fname, lazy=lazy, filter=filter)
+		self.file_offsets = np.array([0, len(self.Table_Layout)], dtype="int64")
+		
+		return
+	
+	@classmethod
+	def from_files(cls, fnames, date=None, filter=None):
+		
+		"""
+		Loads data from a list of hdf5 files (see add_HDF5)
+		
+		Parameters
+		----------
+		
+		fnames: list of str
+			paths to hdf5 files
+			
+		date (optional): str
+			date (YYYY/MM/DD) that times are counted from in hor_vel_calc 
+			(default = date of the first record)
+			
+		filter (optional): fpi_filter.TableFilter
+			only load the Table Layout rows matching these predicates
+		"""
+		
+		self = cls.__new__(cls)
+		self.date = date
+		self.station = None
+		self.filter = filter
+		self.files = []
+		self._tables = {}
+		self._unread = False
+		self.column_cache = None
+		self.column_key = None
+		self.checksum = None
+		self.add_HDF5(list(fnames))
+		
+		if self.date is None and len(self.Table_Layout) > 0:
+			first = self.Table_Layout[0]
+			self.date = "{:04d}/{:02d}/{:02d}".format(int(first["year"]), int(first["month"]), int(first["day"]))
+			
+		return self
+	
+	@classmethod
+	def from_table(cls, table, date=None, filter=None):
+		
+		"""
+		Wraps a Table Layout array (or part of one) that is already in memory
+		
+		Parameters
+		----------
+		
+		table: structured array
+			Table Layout rows
+			
+		date (optional): str
+			date (YYYY/MM/DD) that times are counted from in hor_vel_calc
+			
+		filter (optional): fpi_filter.TableFilter
+			only keep the rows matching these predicates
+		"""
+		
+		if filter is not None:
+			table = filter.apply(table)
+		
+		self = cls.__new__(cls)
+		self.date = date
+		self.station = None
+		self.filter = filter
+		self.files = []
+		self.file_offsets = np.array([0, len(table)], dtype="int64")
+		self._tables = {}
+		self._unread = False
+		self.Table_Layout = table
+		self.Data_Params = None
+		self.Experiment_Notes = None
+		self.Experiment_Params = None
+		self.records = None
+		self.column_cache = None
+		self.column_key = None
+		self.checksum = None
+		
+		return self
+	
+	@classmethod
+	def from_range(cls, FPI, date_min, date_max, cache=None, column_cache=None, filter=None):
+		
+		"""
+		Loads data from the given FPI for every night from date_min to 
+		date_max (inclusive), downloading nights that are not cached yet.
+		Nights with no data are skipped
+		
+		Parameters
+		----------
+		
+		FPI: str
+			3-letter abbreviation for FPI
+			
+		date_min: str
+			first date (YYYY/MM/DD)
+			
+		date_max: str
+			last date (YYYY/MM/DD)
+			
+		cache (optional): FPICache
+			local cache to load data from or download data into
+			(default = fpi_cache.default_cache())
+			
+		column_cache (optional): ColumnCache
+			cache of parsed columns for get_table to load from or save to
+			
+		filter (optional): fpi_filter.TableFilter
+			only load the Table Layout rows matching these predicates
+		"""
+		
+		if cache is None:
+			cache = fpi_cache.default_cache()
+			
+		fnames = []
+		checksum = hashlib.sha256()
+		for date in fpi_cache.date_range(date_min, date_max):
+			fname = cache.fetch(FPI, date, download_data)
+			if fname is not None:
+				fnames.append(fname)
+				checksum.update(cache.entry(FPI, date)["checksum"].encode())
+		if len(fnames) == 0:
+			raise Exception("no {} data available from {} to {}".format(FPI, date_min, date_max))
+		
+		column_key = "{}_{}_{}".format(FPI.lower(), fpi_cache.date_key(date_min), 
+								 fpi_cache.date_key(date_max))
+		if filter is not None:
+			column_key += "_"+filter.key()
+		
+		self = cls.__new__(cls)
+		self.date = date_min
+		self.station = FPI
+		self.filter = filter
+		self.files = fnames
+		self.column_cache = column_cache
+		self.column_key = column_key
+		self.checksum = "sha256:"+checksum.hexdigest()
+		#nothing needs to be read from the files if the columns are cached
+		if column_cache is not None and self.columns_cached():
+			self.defer_tables()
+			return self
+		
+		self.files = []
+		self._tables = {}
+		self._unread = False
+		self.add_HDF5(fnames)
+		self.column_key = column_key
+				
+		return self
+	
+	def defer_tables(self):
+		
+		"""
+		Leaves the tables of the files unread, as the columns get_table makes
+		from them are in the column cache. They are read (see read_files) only
+		if they are asked for
+		"""
+		
+		self._tables = {}
+		self._unread = True
+		columns = self.column_cache.load(self.column_key, self.checksum)
+		self.file_offsets = np.array(columns["file_offsets"])
+		
+		return
+	
+	def read_files(self):
+		
+		"""
+		Reads the tables of every file (with the filter the data was loaded
+		with) left unread by defer_tables
+		"""
+		
+		fnames = self.files
+		column_key = self.column_key
+		self._unread = False
+		self.files = []
+		self._tables = {}
+		self.add_HDF5(fnames)
+		#the tables hold the same rows the cached columns were made from
+		self.column_key = column_key
 		
 		return
 
-	def load_HDF5(self, fname):
+	@fpi_instrument.timed("FPIData.load_HDF5")
+	def load_HDF5(self, fname, lazy=False, filter=None):
 		
 		"""
 		Loads hdf5 data for fabry-perot interferometers
@@ -120,7 +460,48 @@ class FPIData():
 		
 		fname: str
 			path to hdf5 file.
+			
+		lazy (optional): bool
+			if true will return fpi_hdf5.LazyTables that keep the file open and
+			only read the fields and rows that are used, instead of copying
+			every table into memory
+			
+		filter (optional): fpi_filter.TableFilter
+			if given the Table Layout is read chunk by chunk and only the rows
+			matching the predicates are kept (in memory, even if lazy)
 		"""
+		
+		import h5py
+		
+		fpi_instrument.count("hdf5_files")
+		if filter is not None:
+			hdf = h5py.File(fname, "r")
+			try:
+				Table_Layout = filter.apply(fpi_hdf5.LazyTable(hdf, "Data/Table Layout"))
+				fpi_instrument.count("hdf5_rows", len(Table_Layout))
+				fpi_instrument.count("hdf5_bytes", Table_Layout.nbytes)
+				if lazy:
+					return [Table_Layout,
+						fpi_hdf5.LazyTable(hdf, "Metadata/Data Parameters"),
+						fpi_hdf5.LazyTable(hdf, "Metadata/Experiment Notes"),
+						fpi_hdf5.LazyTable(hdf, "Metadata/Experiment Parameters"),
+						fpi_hdf5.LazyTable(hdf, "Metadata/_record_layout")]
+				Metadata = hdf.get("Metadata")
+				return [Table_Layout, np.array(Metadata.get("Data Parameters")),
+					np.array(Metadata.get("Experiment Notes")),
+					np.array(Metadata.get("Experiment Parameters")),
+					np.array(Metadata.get("_record_layout"))]
+			finally:
+				if not lazy:
+					hdf.close()
+		
+		if lazy:
+			hdf = h5py.File(fname, "r")
+			return [fpi_hdf5.LazyTable(hdf, "Data/Table Layout"),
+				fpi_hdf5.LazyTable(hdf, "Metadata/Data Parameters"),
+				fpi_hdf5.LazyTable(hdf, "Metadata/Experiment Notes"),
+				fpi_hdf5.LazyTable(hdf, "Metadata/Experiment Parameters"),
+				fpi_hdf5.LazyTable(hdf, "Metadata/_record_layout")]
 	
 		with h5py.File(fname, "r") as hdf:
 			
@@ -138,62 +519,389 @@ class FPIData():
 			Experiment_Params = np.array(Metadata.get("Experiment Parameters"))
 			records = np.array(Metadata.get("_record_layout"))
 			
+			fpi_instrument.count("hdf5_rows", len(Table_Layout))
+			fpi_instrument.count("hdf5_bytes", Table_Layout.nbytes)
+			
 			return [Table_Layout, Data_Params, Experiment_Notes,
 					   Experiment_Params, records]
 	
-	def add_HDF5(self, fname):
+	@fpi_instrument.timed("FPIData.add_HDF5")
+	def add_HDF5(self, fname, filter=None):
 		
 		"""
-		Adds new file to currently saved Data
+		Adds new file(s) to currently saved Data. All tables are concatenated
+		into one pre-sized array in a single pass, with fields that differ 
+		between file versions promoted to a common type
 		
 		Parameters
 		----------
-		fname: str
-			path to hdf5 file to add.
+		fname: str or list of str
+			path(s) to hdf5 file(s) to add.
+			
+		filter (optional): fpi_filter.TableFilter
+			only add the Table Layout rows matching these predicates
+			(default = the filter the data was loaded with, if any)
 		"""
 		
-		[Table, Data_Params, Experiment_Notes, Experiment_Params, records] = self.load_HDF5(fname)
+		fnames = [fname] if isinstance(fname, str) else list(fname)
+		if filter is None:
+			filter = getattr(self, "filter", None)
+		
+		names = ["Data/Table Layout", "Metadata/Data Parameters", 
+			"Metadata/Experiment Notes", "Metadata/Experiment Parameters",
+			"Metadata/_record_layout"]
+		attrs = table_attrs
+		
+		#concatenate every table before replacing any, lazily loaded tables
+		#share one open file that can only be closed once all are read
+		tables = {}
+		for name, attr in zip(names, attrs):
+			current = getattr(self, attr, None)
+			sources = fnames
+			if attr == "Table_Layout" and filter is not None:
+				#filter each file chunk by chunk before concatenating
+				sources = []
+				for source in fnames:
+					table = fpi_hdf5.LazyTable(source, name)
+					try:
+						sources.append(filter.apply(table))
+					finally:
+						table.close()
+			if current is not None:
+				sources = [current]+sources
+			tables[attr] = fpi_hdf5.concat_tables(sources, name)
 		
-		self.Table_Layout = np.append(self.Table_Layout, Table)
-		self.Experiment_Notes = np.append(self.Experiment_Notes, Experiment_Notes)
-		self.Experiment_Params = np.append(self.Experiment_Params, Experiment_Params)
-		self.records = np.append(self.records, records)
+		self.close()
+		fpi_instrument.count("hdf5_files", len(fnames))
+		for attr in attrs:
+			table, offsets = tables[attr]
+			if attr == "Table_Layout":
+				added = table[offsets[-len(fnames)-1]:]
+				fpi_instrument.count("hdf5_rows", len(added))
+				fpi_instrument.count("hdf5_bytes", added.nbytes)
+				#row offset of every file so rows can be traced to their file
+				if getattr(self, attr, None) is None:
+					self.file_offsets = offsets
+				else:
+					self.file_offsets = np.concatenate([self.file_offsets[:-1], offsets[1:]])
+			setattr(self, attr, table)
+		
+		self.files = self.files + fnames
+		#the table no longer matches any cached columns
+		self.column_key = None
 		
 		return
 	
-	def get_table(self):
-		
-		self.year = np.array(self.Table_Layout["year"], dtype = "int")
-		self.month = np.array(self.Table_Layout["month"], dtype= "int")
-		self.day = np.array(self.Table_Layout["day"], dtype = "int")
-		self.hour = np.array(self.Table_Layout["hour"], dtype = "int")
-		self.min = np.array(self.Table_Layout["min"], dtype = "int")
-		self.sec = np.array(self.Table_Layout["sec"], dtype = "int")
-		self.recno = np.array(self.Table_Layout["recno"], dtype = "int")
-		self.kindat = np.array(self.Table_Layout["kindat"], dtype = "int")
-		self.kinst = np.array(self.Table_Layout["kinst"], dtype = "int")
-		self.elm = np.array(self.Table_Layout["elm"], dtype = "int")
-		self.azm = np.array(self.Table_Layout["azm"], dtype = "int")
-		self.gdalt = np.array(self.Table_Layout["gdalt"], dtype = "int")
-		self.temp = np.array(self.Table_Layout["tn"], dtype = "int")
-		self.dtemp = np.array(self.Table_Layout["dtn"], dtype = "int")
-		self.los_v = np.array(self.Table_Layout["vnu"], dtype = "float")
-		self.dlos_v = np.array(self.Table_Layout["dvnu"], dtype = "float")
-		self.temp_err = np.array(self.Table_Layout["temp_err"], dtype = "int")
-		self.wind_err = np.array(self.Table_Layout["wind_err"], dtype = "int")
-		
-		self.times = np.array([])
-		for i in range(len(self.year)):
-			string_time = "{:02d}/{:02d}/{:02d} {:02d}:{:02d}:{:02d}".format(self.year[i], self.month[i], self.day[i], self.hour[i], self.min[i], self.sec[i])
-			self.times = np.append(self.times, string_time)
-		
-		self.dtimes = np.array([])
-		for i in range(len(self.times)):
-			dtime = elliotools.time_to_dtime(self.times[i])
-			self.dtimes = np.append(self.dtimes, dtime)
+	def source_file(self, rows):
+		
+		"""
+		Returns the file each Table Layout row was loaded from
+		
+		Parameters
+		----------
+		rows: int or int array
+			row indexes
+		"""
+		
+		file_index = np.searchsorted(self.file_offsets, rows, side="right")-1
+		
+		return np.asarray(self.files)[file_index]
+	
+	def close(self):
+		
+		"""
+		Closes the HDF5 file kept open by lazy loading
+		"""
+		
+		for attr in table_attrs:
+			table = self._tables.get(attr)
+			if isinstance(table, fpi_hdf5.LazyTable):
+				table.close()
+			
+		return
+	
+	@fpi_instrument.timed("FPIData.get_table")
+	def get_table(self, columns=None, start=0, stop=None):
+		
+		"""
+		Extracts the columns of the Table Layout into compact arrays (see
+		table_columns) and builds the record times as a single epoch column
+		(seconds since 1970/01/01)
+		
+		Parameters
+		----------
+		columns (optional): list of str
+			attribute names of the columns to extract (see table_columns), the
+			time and look direction columns are always extracted 
+			(default = all columns)
+		start (optional): int
+			first row to extract (default = 0)
+		stop (optional): int
+			row to stop extracting at (default = last row)
+		"""
+		
+		#the whole table can come from (and go to) the column cache
+		use_cache = (columns is None and start == 0 and stop is None 
+			   and getattr(self, "column_cache", None) is not None 
+			   and self.column_key is not None)
+		if use_cache and self.load_columns():
+			fpi_instrument.count("column_cache_hit")
+			return
+		if use_cache:
+			fpi_instrument.count("column_cache_miss")
+		
+		for attr, field, dtype in table_columns:
+			if columns is not None and attr not in columns and attr not in required_columns:
+				continue
+			column = fpi_hdf5.read_column(self.Table_Layout, field, start, stop)
+			setattr(self, attr, compact_column(column, dtype, field))
+		
+		#build record times in one pass, calendar columns, strings and 
+		#datetime objects are only made when they are first asked for
+		self.epoch = fpipy.columns_to_dtime64(
+			*[fpi_hdf5.read_column(self.Table_Layout, field, start, stop) 
+			 for field in time_fields]).astype("int64")
+		self._calendar = {}
+		self._times = None
+		self._dtimes = None
+		fpi_instrument.count("table_rows", len(self.epoch))
+		
+		self.index_directions()
+		
+		if use_cache:
+			self.save_columns()
 			
 		return
 	
+	def cached_column_names(self):
+		
+		"""
+		Returns the names of the attributes saved to the column cache
+		"""
+		
+		return ([attr for attr, field, dtype in table_columns] 
+		  + ["epoch", "direction", "dir_order", "dir_epoch", "dir_bounds", "file_offsets"])
+	
+	def columns_cached(self):
+		
+		"""
+		Returns True if the column cache holds up to date columns for this data
+		"""
+		
+		meta = self.column_cache.meta(self.column_key)
+		
+		return (meta is not None and meta["checksum"] == self.checksum 
+		  and meta["version"] == fpi_columns.column_cache_version)
+	
+	def save_columns(self):
+		
+		"""
+		Writes the columns made by get_table to the column cache
+		"""
+		
+		columns = {attr: getattr(self, attr) for attr in self.cached_column_names()}
+		self.column_cache.save(self.column_key, self.checksum, columns)
+		
+		return
+	
+	def load_columns(self, mmap=True):
+		
+		"""
+		Sets the columns made by get_table from the column cache (memory mapped
+		read only if mmap is True), returning False if they are not cached
+		"""
+		
+		columns = self.column_cache.load(self.column_key, self.checksum, mmap=mmap)
+		if columns is None:
+			return False
+		
+		for attr, column in columns.items():
+			setattr(self, attr, column)
+		self._calendar = {}
+		self._times = None
+		self._dtimes = None
+		
+		return True
+	
+	def index_directions(self):
+		
+		"""
+		Gives every record a look direction code and groups the record indexes
+		by direction (in time order) so time windows can be found by binary
+		search
+		"""
+		
+		self.direction = fpipy.classify_directions(self.azm, self.elm)
+		
+		#stable sort by direction then time
+		self.dir_order = np.lexsort((self.epoch, self.direction))
+		if len(self.dir_order) < 2**31:
+			self.dir_order = self.dir_order.astype("int32")
+		self.dir_epoch = self.epoch[self.dir_order]
+		self.dir_bounds = np.searchsorted(self.direction[self.dir_order], 
+									np.arange(len(fpipy.direction_codes)+1))
+		
+		return
+	
+	def get_azm_indexes(self, dtime_min=0, dtime_max=0):
+		
+		"""
+		Returns the record indexes of the North, East, South, West and Zenith
+		looks respectively (in time order)
+		
+		Parameters
+		----------
+		dtime_min (optional): dtime object
+			minimum time to get data for
+		dtime_max (optional): dtime object
+			maximum time to get data for
+		"""
+		
+		epoch_min = None if (isinstance(dtime_min, int) and dtime_min == 0) else fpipy.to_epoch(dtime_min)
+		epoch_max = None if (isinstance(dtime_max, int) and dtime_max == 0) else fpipy.to_epoch(dtime_max)
+		
+		indexes = []
+		for look in ["N", "E", "S", "W", "zen"]:
+			code = fpipy.direction_codes[look]
+			lo = self.dir_bounds[code]
+			hi = self.dir_bounds[code+1]
+			look_epoch = self.dir_epoch[lo:hi]
+			
+			start = 0
+			stop = hi-lo
+			if epoch_min is not None:
+				start = np.searchsorted(look_epoch, epoch_min, side="left")
+				#for calculating horizontal velocites we need an extra zenith
+				#measurement before the minimum time
+				if look == "zen" and start > 0:
+					start -= 1
+			if epoch_max is not None:
+				stop = np.searchsorted(look_epoch, epoch_max, side="left")
+			
+			indexes.append(self.dir_order[lo+start:lo+max(start, stop)])
+			
+		return indexes
+	
+	def format_times(self, index):
+		
+		"""
+		Returns the string times (YYYY/MM/DD hh:mm:ss) of the given records 
+		without building the string times of the whole table
+		
+		Parameters
+		----------
+		index: int array
+			record indexes
+		"""
+		
+		if self._times is not None:
+			return self._times[index]
+		
+		return fpipy.dtime64_to_strings(self.dtimes64[index])
+	
+	@property
+	def dtimes64(self):
+		
+		"""
+		Record times as datetime64[s] (a view of epoch)
+		"""
+		
+		return self.epoch.view("datetime64[s]")
+	
+	def _calendar_column(self, name):
+		
+		column = self._calendar.get(name)
+		if column is None:
+			dtimes64 = self.dtimes64
+			if name == "year":
+				column = dtimes64.astype("datetime64[Y]").astype("int64")+1970
+			elif name == "month":
+				column = dtimes64.astype("datetime64[M]").astype("int64") % 12 + 1
+			elif name == "day":
+				column = (dtimes64.astype("datetime64[D]") 
+					- dtimes64.astype("datetime64[M]")).astype("int64") + 1
+			else:
+				secs = self.epoch % 86400
+				column = {"hour": secs // 3600, "min": secs // 60 % 60, "sec": secs % 60}[name]
+			column = column.astype(dict(calendar_columns)[name])
+			self._calendar[name] = column
+			
+		return column
+	
+	year = property(lambda self: self._calendar_column("year"), 
+				 doc="Year of each record (derived from epoch)")
+	month = property(lambda self: self._calendar_column("month"), 
+				  doc="Month of each record (derived from epoch)")
+	day = property(lambda self: self._calendar_column("day"), 
+				doc="Day of month of each record (derived from epoch)")
+	hour = property(lambda self: self._calendar_column("hour"), 
+				 doc="Hour of each record (derived from epoch)")
+	min = property(lambda self: self._calendar_column("min"), 
+				doc="Minute of each record (derived from epoch)")
+	sec = property(lambda self: self._calendar_column("sec"), 
+				doc="Second of each record (derived from epoch)")
+	
+	def memory_usage(self):
+		
+		"""
+		Returns a dictionary of the bytes held by each parsed column (columns
+		made by get_table, the direction index and any calendar, string or
+		datetime columns built so far), not counting the Table Layout
+		"""
+		
+		usage = {}
+		for attr in ([attr for attr, field, dtype in table_columns] 
+			   + ["epoch", "direction", "dir_order", "dir_epoch"]):
+			column = getattr(self, attr, None)
+			if column is not None:
+				usage[attr] = column.nbytes
+		for name, column in getattr(self, "_calendar", {}).items():
+			usage[name] = column.nbytes
+		if getattr(self, "_times", None) is not None:
+			usage["times"] = self._times.nbytes
+		if getattr(self, "_dtimes", None) is not None:
+			#object array of pointers plus one datetime object per record
+			usage["dtimes"] = self._dtimes.nbytes + len(self._dtimes)*48
+			
+		return usage
+	
+	def bytes_per_record(self):
+		
+		"""
+		Returns the bytes held by the parsed columns per record (see 
+		memory_usage)
+		"""
+		
+		if len(self.epoch) == 0:
+			return 0.0
+		
+		return sum(self.memory_usage().values())/len(self.epoch)
+	
+	@property
+	def times(self):
+		
+		"""
+		Record times as strings (YYYY/MM/DD hh:mm:ss), built on first access
+		"""
+		
+		if self._times is None:
+			self._times = fpipy.dtime64_to_strings(self.dtimes64)
+			
+		return self._times
+	
+	@property
+	def dtimes(self):
+		
+		"""
+		Record times as datetime objects, built on first access
+		"""
+		
+		if self._dtimes is None:
+			self._dtimes = self.dtimes64.astype(dt.datetime)
+			
+		return self._dtimes
+	
+	@fpi_instrument.timed("FPIData.get_azm_vels")
 	def get_azm_vels(self, dtime_min=0, dtime_max=0):
 		
 		"""
@@ -208,19 +916,7 @@ class FPIData():
 			maximum time to get data for
 		"""
 
-		#get indexes of east, south and west look +/- 5deg
-		E_index = np.where((self.azm >= 85) & (self.azm <= 95))
-		S_index = np.where((abs(self.azm) >= 175) & (abs(self.azm) <= 185))
-		W_index = np.where((self.azm >= -95) & (self.azm <= -85))
-		
-		#get indexes of 0 azimuth (could be north or zenith look)
-		zero_index = np.where((self.azm >= -5) & (self.azm <= 5))
-		#get indexes of north or zenith look
-		N_elm_index = np.where(self.elm == 45)
-		#zenith indexes are where elevation angles are at 90deg
-		zen_index = np.where(self.elm == 90)
-		#north indexes are where azm == 0 and elm == 45
-		N_index = np.intersect1d(zero_index, N_elm_index)
+		N_index, E_index, S_index, W_index, zen_index = self.get_azm_indexes(dtime_min, dtime_max)
 		
 		#get velocity data
 		N = self.los_v[N_index]
@@ -236,75 +932,17 @@ class FPIData():
 		dW = self.dlos_v[W_index]
 		dzen = self.dlos_v[zen_index]
 		
-		N_times = self.times[N_index]
-		E_times = self.times[E_index]
-		S_times = self.times[S_index]
-		W_times = self.times[W_index]
-		zen_times = self.times[zen_index]
-	
-		N_dtimes = self.dtimes[N_index]
-		E_dtimes = self.dtimes[E_index]
-		S_dtimes = self.dtimes[S_index]
-		W_dtimes = self.dtimes[W_index]
-		zen_dtimes = self.dtimes[zen_index]
-		
-		if dtime_min !=0 or dtime_max !=0:
-			
-			if dtime_min !=0:
-				
-				N = N[np.where(N_dtimes >= dtime_min)]
-				E = E[np.where(E_dtimes >= dtime_min)]
-				S = S[np.where(S_dtimes >= dtime_min)]
-				W = W[np.where(W_dtimes >= dtime_min)]
-				#for calculating horizontal velocites we need an extra zenith
-				#measurement before the minimu time
-				zen_indexes = np.where(zen_dtimes >= dtime_min)[0]
-				zen_indexes = np.insert(zen_indexes, 0, min(zen_indexes)-1)
-				zen = zen[zen_indexes]
-				
-				dN = dN[np.where(N_dtimes >= dtime_min)]
-				dE = dE[np.where(E_dtimes >= dtime_min)]
-				dS = dS[np.where(S_dtimes >= dtime_min)]
-				dW = dW[np.where(W_dtimes >= dtime_min)]
-				dzen = dzen[zen_indexes]
-				
-				N_times = N_times[np.where(N_dtimes >= dtime_min)]
-				E_times = E_times[np.where(E_dtimes >= dtime_min)]
-				S_times = S_times[np.where(S_dtimes >= dtime_min)]
-				W_times = W_times[np.where(W_dtimes >= dtime_min)]
-				zen_times = zen_times[zen_indexes]
-				
-				N_dtimes = N_dtimes[np.where(N_dtimes >= dtime_min)]
-				E_dtimes = E_dtimes[np.where(E_dtimes >= dtime_min)]
-				S_dtimes = S_dtimes[np.where(S_dtimes >= dtime_min)]
-				W_dtimes = W_dtimes[np.where(W_dtimes >= dtime_min)]
-				zen_dtimes = zen_dtimes[zen_indexes]
-				
-			if dtime_max !=0:
-				
-				N = N[np.where(N_dtimes < dtime_max)]
-				E = E[np.where(E_dtimes < dtime_max)]
-				S = S[np.where(S_dtimes < dtime_max)]
-				W = W[np.where(W_dtimes < dtime_max)]
-				zen = zen[np.where(zen_dtimes < dtime_max)]				
-				
-				dN = dN[np.where(N_dtimes < dtime_max)]
-				dE = dE[np.where(E_dtimes < dtime_max)]
-				dS = dS[np.where(S_dtimes < dtime_max)]
-				dW = dW[np.where(W_dtimes < dtime_max)]
-				dzen = dzen[np.where(zen_dtimes < dtime_max)]				
-				
-				N_times = N_times[np.where(N_dtimes < dtime_max)]
-				E_times = E_times[np.where(E_dtimes < dtime_max)]
-				S_times = S_times[np.where(S_dtimes < dtime_max)]
-				W_times = W_times[np.where(W_dtimes < dtime_max)]
-				zen_times = zen_times[np.where(zen_dtimes < dtime_max)]
-				
+		N_times = self.format_times(N_index)
+		E_times = self.format_times(E_index)
+		S_times = self.format_times(S_index)
+		W_times = self.format_times(W_index)
+		zen_times = self.format_times(zen_index)
 		
 		return [N, E, S, W, zen, dN, dE, dS, dW, dzen, N_times, E_times, 
 					   S_times, W_times, zen_times]
 		
-	def hor_vel_calc(self, los_v, los_dtimes, zen_v, zen_dtimes):
+	@fpi_instrument.timed("FPIData.hor_vel_calc")
+	def hor_vel_calc(self, los_v, los_dtimes, zen_v, zen_dtimes, elm=45):
 		
 		"""
 		Calculates and returns the horizontal component of the line of sight
@@ -316,38 +954,226 @@ class FPIData():
 		los_v: float array
 			array of line of sight velocities
 			
-		los_dtimes: dtime array
-			array of dtimes of line of sight measurements
+		los_dtimes: dtime, datetime64, string or epoch second array
+			array of times of line of sight measurements
 			
 		zen_v: float array
 			array of zenith velocities
 			
-		zen_dtimes: dtime array
-			array of dtimes of zenith measurements
+		zen_dtimes: dtime, datetime64, string or epoch second array
+			array of times of zenith measurements
+			
+		elm (optional): float
+			elevation of the line of sight measurements in degrees 
+			(default = 45)
 		"""
 		
-		#convert dtimes to seconds from start time
-		year = int(self.date[0:4])
-		month = int(self.date[5:7])
-		day = int(self.date[8:10])	
-		start_dtime = dt.datetime(year, month, day, 0, 0, 0)
+		los_v = np.asarray(los_v, dtype="float")
+		zen_v = np.asarray(zen_v, dtype="float")
+		los_dtimes = np.asarray(los_dtimes)
 		
-		#remove los values that are outside of zenith time range
-		ix = np.where((los_dtimes >= min(zen_dtimes)) & (los_dtimes <= max(zen_dtimes)))[0]
-		los_v = los_v[ix]
-		los_dtimes = los_dtimes[ix]
+		los_epoch = fpipy.to_epoch(los_dtimes)
+		zen_epoch = fpipy.to_epoch(zen_dtimes)
+		if len(zen_epoch) == 0:
+			return np.array([], dtype="float"), los_dtimes[:0]
 		
-		los_time_indexes = np.empty(len(los_v), dtype="int")
-		zen_time_indexes = np.empty(len(zen_v), dtype="int")
-		for i in range(len(los_v)):
-			los_time_indexes[i] = (los_dtimes[i]-start_dtime).total_seconds()
-		for i in range(len(zen_v)):
-			zen_time_indexes[i] = (zen_dtimes[i]-start_dtime).total_seconds()
+		#np.interp needs the zenith times in order
+		if np.any(zen_epoch[1:] < zen_epoch[:-1]):
+			order = np.argsort(zen_epoch, kind="stable")
+			zen_epoch = zen_epoch[order]
+			zen_v = zen_v[order]
+		
+		#remove los values that are outside of zenith time range
+		ix = np.nonzero((los_epoch >= zen_epoch[0]) & (los_epoch <= zen_epoch[-1]))[0]
 			
 		#interpolate zenith at locations where we have los measurements
-		zen_v_interped = np.interp(los_time_indexes, zen_time_indexes, zen_v)
+		zen_v_interped = np.interp(los_epoch[ix], zen_epoch, zen_v)
 		
 		#calculate horizontal velocity
-		hor_v = (los_v - (zen_v_interped*np.sin(np.deg2rad(45)))) / np.cos(np.deg2rad(45))
+		elm = np.deg2rad(elm)
+		hor_v = (los_v[ix] - (zen_v_interped*np.sin(elm))) / np.cos(elm)
+		
+		return hor_v, los_dtimes[ix]
+	
+	@fpi_instrument.timed("FPIData.get_hor_vels")
+	def get_hor_vels(self, dtime_min=0, dtime_max=0, elm=45):
+		
+		"""
+		Calculates the horizontal velocities of the North, East, South and West
+		looks together, returning a dictionary of look ("N", "E", "S", "W") -> 
+		[horizontal velocity, error in horizontal velocity, epoch seconds]
+		
+		Parameters
+		----------
+		dtime_min (optional): dtime object
+			minimum time to get data for
+		dtime_max (optional): dtime object
+			maximum time to get data for
+		elm (optional): float
+			elevation of the line of sight measurements in degrees 
+			(default = 45)
+		"""
+		
+		indexes = self.get_azm_indexes(dtime_min, dtime_max)
+		zen_index = indexes[4]
+		zen_epoch = self.epoch[zen_index]
+		zen_v = np.asarray(self.los_v[zen_index], dtype="float")
+		dzen_v = np.asarray(self.dlos_v[zen_index], dtype="float")
+		
+		sin_elm = np.sin(np.deg2rad(elm))
+		cos_elm = np.cos(np.deg2rad(elm))
+		
+		hor_vels = {}
+		for look, index in zip(["N", "E", "S", "W"], indexes[:4]):
+			los_epoch = self.epoch[index]
+			if len(zen_epoch) == 0:
+				ix = np.array([], dtype="int")
+			else:
+				ix = np.nonzero((los_epoch >= zen_epoch[0]) & (los_epoch <= zen_epoch[-1]))[0]
+			los_epoch = los_epoch[ix]
+			index = index[ix]
+			
+			zen_v_interped = np.interp(los_epoch, zen_epoch, zen_v) if len(ix) > 0 else np.array([])
+			dzen_v_interped = np.interp(los_epoch, zen_epoch, dzen_v) if len(ix) > 0 else np.array([])
+			
+			hor_v = (self.los_v[index] - zen_v_interped*sin_elm) / cos_elm
+			dhor_v = np.sqrt(np.asarray(self.dlos_v[index], dtype="float")**2 
+					+ (dzen_v_interped*sin_elm)**2) / cos_elm
+			hor_vels[look] = [hor_v, dhor_v, los_epoch]
+			
+		return hor_vels
+	
+	@fpi_instrument.timed("FPIData.get_winds")
+	def get_winds(self, dtime_min=0, dtime_max=0, cadence=None, elm=45, max_gap=None):
+		
+		"""
+		Resamples every look direction onto a common time grid and returns a
+		structured array (see wind_dtype) of meridional wind (from the North 
+		and South looks), zonal wind (from the East and West looks), vertical
+		wind and temperature (from the zenith look), with errors. Grid points 
+		without data for a quantity are NaN
+		
+		Parameters
+		----------
+		dtime_min (optional): dtime object
+			minimum time to get data for
+		dtime_max (optional): dtime object
+			maximum time to get data for
+		cadence (optional): int
+			spacing of the time grid in seconds (default = use the times of
+			the zenith measurements)
+		elm (optional): float
+			elevation of the line of sight measurements in degrees 
+			(default = 45)
+		max_gap (optional): float
+			largest time in seconds to the nearest measurement that is 
+			interpolated across (default = no limit)
+		"""
+		
+		hor_vels = self.get_hor_vels(dtime_min, dtime_max, elm=elm)
+		zen_index = self.get_azm_indexes(dtime_min, dtime_max)[4]
+		zen_epoch = self.epoch[zen_index]
+		
+		#build the time grid
+		epoch_min = None if (isinstance(dtime_min, int) and dtime_min == 0) else fpipy.to_epoch(dtime_min)
+		epoch_max = None if (isinstance(dtime_max, int) and dtime_max == 0) else fpipy.to_epoch(dtime_max)
+		if cadence is None:
+			grid = zen_epoch
+			if epoch_min is not None:
+				grid = grid[grid >= epoch_min]
+		else:
+			first = epoch_min if epoch_min is not None else (self.epoch.min() // cadence) * cadence
+			last = epoch_max if epoch_max is not None else self.epoch.max()+1
+			grid = np.arange(first, last, cadence, dtype="int64")
+		
+		winds = np.empty(len(grid), dtype=wind_dtype)
+		winds["epoch"] = grid
+		
+		#resample each look, with South and West flipped to point N and E
+		looks = {}
+		for look, sign in [("N", 1), ("S", -1), ("E", 1), ("W", -1)]:
+			hor_v, dhor_v, look_epoch = hor_vels[look]
+			looks[look] = (sign*fpipy.interp_nan(grid, look_epoch, hor_v, max_gap),
+				  fpipy.interp_nan(grid, look_epoch, dhor_v, max_gap))
+		
+		winds["merid"], winds["dmerid"] = fpipy.combine_looks(
+			[looks["N"][0], looks["S"][0]], [looks["N"][1], looks["S"][1]])
+		winds["zonal"], winds["dzonal"] = fpipy.combine_looks(
+			[looks["E"][0], looks["W"][0]], [looks["E"][1], looks["W"][1]])
+		
+		for field, column in [("vert", self.los_v), ("dvert", self.dlos_v), 
+						("temp", self.temp), ("dtemp", self.dtemp)]:
+			winds[field] = fpipy.interp_nan(grid, zen_epoch, column[zen_index], max_gap)
+			
+		return winds
+	
+	@fpi_instrument.timed("FPIData.get_look_points")
+	def get_look_points(self, index=None, station=None, alt=None, aacgm=False, time_res=86400):
+		
+		"""
+		Returns the geographic latitude and longitude of the point each record
+		samples (where its look reaches its altitude, see 
+		fpi_tools.look_points), and optionally its aacgm latitude and 
+		longitude, for every record at once
+		
+		Parameters
+		----------
+		index (optional): int array or slice
+			records to geolocate (default = all records)
+		station (optional): str
+			station the records were measured from (default = the station the
+			data was loaded for, or the station of each record's kinst)
+		alt (optional): float or float array
+			altitude of the sampled points in km (default = gdalt column)
+		aacgm (optional): bool
+			if true will also return aacgm coordinates (converted with the 
+			cached fpi_tools.aacgm_convert)
+		time_res (optional): int
+			resolution in seconds that times are rounded down to for the aacgm
+			conversion (default = 1 day)
+			
+		Returns
+		-------
+		glat, glon (and mlat, mlon if aacgm) arrays in degrees
+		"""
+		
+		if index is None:
+			index = slice(None)
+		azm = self.azm[index]
+		elm = self.elm[index]
+		alt = self.gdalt[index] if alt is None else np.broadcast_to(alt, np.shape(azm))
+		
+		if station is None:
+			station = getattr(self, "station", None)
+		if station is not None:
+			record = fpi_stations.registry.get(station)
+			glat, glon, site_alt = record.glat, record.glon, record.alt
+		else:
+			#look up every record's station by its Madrigal instrument code
+			reg_glat, reg_glon, reg_alt, reg_ids = fpi_stations.registry.coords()
+			kinst = self.kinst[index]
+			order = np.argsort(reg_ids)
+			pos = np.clip(np.searchsorted(reg_ids[order], kinst), 0, len(order)-1)
+			row = order[pos]
+			unknown = reg_ids[row] != kinst
+			if np.any(unknown):
+				raise Exception("unknown instrument code(s): {}".format(np.unique(kinst[unknown])))
+			glat, glon, site_alt = reg_glat[row], reg_glon[row], reg_alt[row]
+		glat, glon, site_alt, azm, elm, alt = np.broadcast_arrays(glat, glon, site_alt, azm, elm, alt)
+		
+		#a night only has a few distinct looks, so geolocate (and convert)
+		#each distinct one once
+		columns = [glat, glon, site_alt, azm, elm, alt]
+		if aacgm:
+			columns.append(self.epoch[index] // time_res * time_res)
+		first, inverse = fpipy.unique_rows(*columns)
+		
+		look_lat, look_lon = fpipy.look_points(glat[first], glon[first], azm[first], elm[first], 
+										alt[first], site_alt=site_alt[first])
+		if not aacgm:
+			return look_lat[inverse], look_lon[inverse]
+		
+		mlat, mlon = fpipy.aacgm_convert(look_lat, look_lon, alt[first], columns[-1][first], 
+								   time_res=time_res)
 		
-		return hor_v, los_dtimes
\ No newline at end of file
+		return look_lat[inverse], look_lon[inverse], mlat[inverse], mlon[inverse]
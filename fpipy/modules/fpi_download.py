@@ -0,0 +1,255 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Bulk downloading of FPI data for many stations and nights
+
+Downloads run on a bounded thread pool, each worker thread keeps its own
+Madrigal connection, and failed downloads are retried with exponential
+backoff. Files go into an FPICache so nights that are already cached are
+never downloaded again.
+"""
+
+import time
+import threading
+import concurrent.futures
+
+from . import fpi_cache
+from . import fpi_data
+
+class DownloadResult():
+
+	"""
+	A class used to store the outcome of downloading one station-night
+	"""
+
+	__slots__ = ["FPI", "date", "fname", "status", "nbytes", "seconds",
+			  "attempts", "error"]
+
+	def __init__(self, FPI, date):
+
+		"""
+		Parameters
+		----------
+
+		FPI: str
+			3-letter abbreviation for FPI station
+
+		date: str
+			date (YYYY/MM/DD)
+		"""
+
+		self.FPI = FPI
+		self.date = date
+		self.fname = None
+		#one of "cached", "downloaded", "no data" or "failed"
+		self.status = None
+		self.nbytes = 0
+		self.seconds = 0.0
+		self.attempts = 0
+		self.error = None
+
+		return
+
+	def __repr__(self):
+
+		return "DownloadResult({}, {}, {}, {} bytes, {:.2f} s, {} attempts)".format(
+			self.FPI, self.date, self.status, self.nbytes, self.seconds, self.attempts)
+
+class BulkDownloader():
+
+	"""
+	A class used to download many station-nights on a thread pool, reusing one
+	Madrigal connection per worker thread
+	"""
+
+	def __init__(self, cache=None, workers=4, retries=3, backoff=1.0,
+			  madrigalURL=fpi_data.madrigalURL, connect=None):
+
+		"""
+		Parameters
+		----------
+
+		cache (optional): FPICache
+			cache to download files into (default = fpi_cache.default_cache())
+
+		workers (optional): int
+			number of download threads (default = 4)
+
+		retries (optional): int
+			number of times to retry a failed download (default = 3)
+
+		backoff (optional): float
+			seconds to wait before the first retry, doubled for every retry
+			after (default = 1.0)
+
+		madrigalURL (optional): str
+			Madrigal server to download from
+
+		connect (optional): function
+			called as connect(madrigalURL) to open a Madrigal connection with
+			the getExperiments, getExperimentFiles and downloadFile methods
+			of madrigalWeb (default = madrigalWeb.madrigalWeb.MadrigalData)
+		"""
+
+		if cache is None:
+			cache = fpi_cache.default_cache()
+		self.cache = cache
+		self.workers = workers
+		self.retries = retries
+		self.backoff = backoff
+		self.madrigalURL = madrigalURL
+		self.connect = connect
+
+		self._local = threading.local()
+
+		return
+
+	def client(self, reconnect=False):
+
+		"""
+		Returns this worker thread's Madrigal connection, opening it on first
+		use (or again if reconnect is True)
+		"""
+
+		if reconnect or getattr(self._local, "Data", None) is None:
+			connect = self.connect
+			if connect is None:
+				import madrigalWeb.madrigalWeb
+				connect = madrigalWeb.madrigalWeb.MadrigalData
+			self._local.Data = connect(self.madrigalURL)
+
+		return self._local.Data
+
+	def download_one(self, FPI, date):
+
+		"""
+		Downloads a single station-night into the cache (if it is not already
+		there) and returns a DownloadResult
+
+		Parameters
+		----------
+
+		FPI: str
+			3-letter abbreviation for FPI station
+
+		date: str
+			date (YYYY/MM/DD)
+		"""
+
+		result = DownloadResult(FPI, date)
+		start = time.perf_counter()
+
+		fname = self.cache.get(FPI, date)
+		if fname is not None:
+			result.fname = fname
+			result.status = "cached"
+			result.nbytes = self.cache.entry(FPI, date)["size"]
+			result.seconds = time.perf_counter()-start
+			return result
+
+		reconnect = False
+		while result.attempts <= self.retries:
+			result.attempts += 1
+			try:
+				Data = self.client(reconnect=reconnect)
+				download = lambda FPI, date, path, fname=None: fpi_data.download_data(
+					FPI, date, path, fname=fname, Data=Data)
+				fname = self.cache.fetch(FPI, date, download)
+				if fname is None:
+					result.status = "no data"
+				else:
+					result.fname = fname
+					result.status = "downloaded"
+					result.nbytes = self.cache.entry(FPI, date)["size"]
+				result.error = None
+				break
+			except Exception as error:
+				result.status = "failed"
+				result.error = error
+				#connection may be broken so open a new one for the retry
+				reconnect = True
+				if result.attempts <= self.retries:
+					time.sleep(self.backoff*2**(result.attempts-1))
+
+		result.seconds = time.perf_counter()-start
+
+		return result
+
+	def download(self, FPIs, dates, progress=None):
+
+		"""
+		Downloads every combination of FPIs and dates, returning a list of
+		DownloadResults in (FPI, date) order
+
+		Parameters
+		----------
+
+		FPIs: list of str
+			3-letter abbreviations for FPI stations
+
+		dates: list of str
+			dates (YYYY/MM/DD)
+
+		progress (optional): function
+			called as progress(result, n_done, n_total) in the calling thread as
+			each file finishes
+		"""
+
+		if isinstance(FPIs, str):
+			FPIs = [FPIs]
+		jobs = [(FPI, date) for FPI in FPIs for date in dates]
+		results = [None]*len(jobs)
+
+		with concurrent.futures.ThreadPoolExecutor(max_workers=self.workers) as pool:
+			futures = {pool.submit(self.download_one, FPI, date): i for i, (FPI, date) in enumerate(jobs)}
+			for n_done, future in enumerate(concurrent.futures.as_completed(futures), 1):
+				result = future.result()
+				results[futures[future]] = result
+				if progress is not None:
+					progress(result, n_done, len(jobs))
+		self.cache.flush()
+
+		return results
+
+def download_range(FPIs, date_min, date_max, cache=None, workers=4, retries=3,
+				   backoff=1.0, progress=None, madrigalURL=fpi_data.madrigalURL, connect=None):
+
+	"""
+	Downloads data for every FPI station and night from date_min to date_max
+	(inclusive) on a thread pool, returning a list of DownloadResults
+
+	Parameters
+	----------
+
+	FPIs: str or list of str
+		3-letter abbreviations for FPI stations
+
+	date_min: str
+		first date (YYYY/MM/DD)
+
+	date_max: str
+		last date (YYYY/MM/DD)
+
+	cache (optional): FPICache
+		cache to download files into (default = fpi_cache.default_cache())
+
+	workers (optional): int
+		number of download threads (default = 4)
+
+	retries (optional): int
+		number of times to retry a failed download (default = 3)
+
+	backoff (optional): float
+		seconds to wait before the first retry, doubled after (default = 1.0)
+
+	progress (optional): function
+		called as progress(result, n_done, n_total) as each file finishes
+
+	madrigalURL, connect (optional):
+		Madrigal server and connection to download with (see BulkDownloader)
+	"""
+
+	downloader = BulkDownloader(cache=cache, workers=workers, retries=retries,
+							 backoff=backoff, madrigalURL=madrigalURL, connect=connect)
+
+	return downloader.download(FPIs, fpi_cache.date_range(date_min, date_max), progress=progress)
@@ -0,0 +1,215 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Row filters pushed down into Table Layout reads
+
+A TableFilter holds predicates on a time window, the temp_err/wind_err
+quality flags, look geometry and kindat. It is evaluated chunk by chunk as a
+table is read: only the fields the predicates need are read for each chunk,
+and full rows are only kept for the records that match, so a filtered load
+never holds more than one chunk of unwanted rows in memory.
+
+	good = TableFilter(time_min="2013/10/02 00:30:00", max_wind_err=0,
+		looks=["N", "E", "S", "W", "zen"])
+	data = FPIData.from_files(fnames, filter=good)
+"""
+
+import hashlib
+
+import numpy as np
+
+from . import fpi_hdf5
+from . import fpi_tools
+
+#Table Layout fields holding the record time
+time_fields = ["year", "month", "day", "hour", "min", "sec"]
+
+class TableFilter():
+
+	"""
+	A class used to select Table Layout rows by time, quality flags, look
+	geometry and kindat while they are read
+	"""
+
+	def __init__(self, time_min=None, time_max=None, max_temp_err=None, max_wind_err=None,
+			  azm=None, elm=None, angle_tol=0, looks=None, kindat=None):
+
+		"""
+		Parameters
+		----------
+
+		time_min, time_max (optional): str, dtime object, datetime64 or int
+			keep records from time_min up to (not including) time_max (any
+			time fpi_tools.to_epoch accepts)
+
+		max_temp_err, max_wind_err (optional): int
+			keep records whose temp_err/wind_err quality flag is at most this
+
+		azm, elm (optional): list of float
+			keep records at one of these azimuths/elevations (degrees)
+
+		angle_tol (optional): float
+			tolerance in degrees for matching azm and elm (default = 0)
+
+		looks (optional): list of str
+			keep records in these look directions (see
+			fpi_tools.direction_codes, e.g. ["N", "E", "S", "W", "zen"])
+
+		kindat (optional): list of int
+			keep records of these Madrigal kinds of data
+		"""
+
+		self.epoch_min = None if time_min is None else int(fpi_tools.to_epoch(time_min))
+		self.epoch_max = None if time_max is None else int(fpi_tools.to_epoch(time_max))
+		self.max_temp_err = max_temp_err
+		self.max_wind_err = max_wind_err
+		self.azm = None if azm is None else np.atleast_1d(np.asarray(azm, dtype="float"))
+		self.elm = None if elm is None else np.atleast_1d(np.asarray(elm, dtype="float"))
+		self.angle_tol = angle_tol
+		self.looks = None if looks is None else [fpi_tools.direction_codes[look] for look in looks]
+		self.kindat = None if kindat is None else np.atleast_1d(np.asarray(kindat))
+
+		return
+
+	def __repr__(self):
+
+		params = ["epoch_min", "epoch_max", "max_temp_err", "max_wind_err", "azm", "elm",
+			"angle_tol", "looks", "kindat"]
+		values = []
+		for name in params:
+			value = getattr(self, name)
+			if isinstance(value, np.ndarray):
+				value = value.tolist()
+			values.append("{}={!r}".format(name, value))
+
+		return "TableFilter({})".format(", ".join(values))
+
+	def key(self):
+
+		"""
+		Returns a short hash identifying the predicates (e.g. to name cached
+		columns of a filtered table)
+		"""
+
+		return hashlib.sha256(repr(self).encode()).hexdigest()[:12]
+
+	def fields(self):
+
+		"""
+		Returns the Table Layout fields the predicates need
+		"""
+
+		fields = []
+		if self.epoch_min is not None or self.epoch_max is not None:
+			fields += time_fields
+		if self.max_temp_err is not None:
+			fields.append("temp_err")
+		if self.max_wind_err is not None:
+			fields.append("wind_err")
+		if self.azm is not None or self.looks is not None:
+			fields.append("azm")
+		if self.elm is not None or self.looks is not None:
+			fields.append("elm")
+		if self.kindat is not None:
+			fields.append("kindat")
+
+		return fields
+
+	def mask(self, table):
+
+		"""
+		Returns a boolean array, true for the rows of table that match every
+		predicate
+
+		Parameters
+		----------
+
+		table: structured array
+			Table Layout rows holding (at least) the fields in fields()
+		"""
+
+		keep = np.ones(len(table), dtype="bool")
+
+		if self.epoch_min is not None or self.epoch_max is not None:
+			epoch = fpi_tools.columns_to_dtime64(*[table[name] for name in time_fields]).astype("int64")
+			if self.epoch_min is not None:
+				keep &= epoch >= self.epoch_min
+			if self.epoch_max is not None:
+				keep &= epoch < self.epoch_max
+		if self.max_temp_err is not None:
+			keep &= table["temp_err"] <= self.max_temp_err
+		if self.max_wind_err is not None:
+			keep &= table["wind_err"] <= self.max_wind_err
+		if self.azm is not None:
+			#angular distance to the nearest wanted azimuth, across the 0/360 wrap
+			diff = np.abs(table["azm"][:, None] - self.azm[None, :]) % 360
+			keep &= np.min(np.minimum(diff, 360-diff), axis=1) <= self.angle_tol
+		if self.elm is not None:
+			diff = np.abs(table["elm"][:, None] - self.elm[None, :])
+			keep &= np.min(diff, axis=1) <= self.angle_tol
+		if self.looks is not None:
+			keep &= np.isin(fpi_tools.classify_directions(table["azm"], table["elm"]), self.looks)
+		if self.kindat is not None:
+			keep &= np.isin(table["kindat"], self.kindat)
+
+		return keep
+
+	def apply(self, table, fields=None, start=0, stop=None, chunk_size=100000):
+
+		"""
+		Returns the rows of table that match every predicate, reading chunk
+		by chunk: the predicate fields of each chunk are read first and the
+		remaining fields only for chunks with matching rows
+
+		Parameters
+		----------
+
+		table: LazyTable or structured array
+			Table Layout to filter
+
+		fields (optional): list of str
+			fields to keep in the result (default = all fields)
+
+		start, stop (optional): int
+			range of rows to filter (default = all rows)
+
+		chunk_size (optional): int
+			rows evaluated at a time (default = 100000)
+		"""
+
+		if stop is None or stop > len(table):
+			stop = len(table)
+		names = table.dtype.names if fields is None else fields
+		predicate_fields = self.fields()
+		missing = [name for name in predicate_fields if name not in table.dtype.names]
+		if len(missing) > 0:
+			raise Exception("table has no {} field(s) to filter on".format(", ".join(missing)))
+
+		parts = []
+		for chunk_start in range(start, stop, max(chunk_size, 1)):
+			chunk_stop = min(chunk_start+chunk_size, stop)
+			if len(predicate_fields) == 0:
+				keep = np.ones(chunk_stop-chunk_start, dtype="bool")
+			else:
+				keep = self.mask(_read(table, predicate_fields, chunk_start, chunk_stop))
+			if not keep.any():
+				continue
+			parts.append(_read(table, list(names), chunk_start, chunk_stop)[keep])
+
+		if len(parts) == 0:
+			return np.empty(0, dtype=[(name, table.dtype[name]) for name in names])
+
+		return np.concatenate(parts)
+
+def _read(table, fields, start, stop):
+
+	if isinstance(table, fpi_hdf5.LazyTable):
+		return table.read(fields, start, stop)
+
+	table = np.asarray(table)
+	out = np.empty(len(range(start, min(stop, len(table)))),
+			  dtype=[(name, table.dtype[name]) for name in fields])
+	for name in fields:
+		out[name] = table[name][start:stop]
+
+	return out
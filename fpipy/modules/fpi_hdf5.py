@@ -0,0 +1,316 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Lazy access to Madrigal HDF5 tables
+
+A LazyTable keeps the HDF5 file open and only reads the fields and rows that
+are asked for (h5py field selection and hyperslabs), or slices a memory map of
+the file when the dataset is stored contiguously and uncompressed.
+"""
+
+import numpy as np
+
+class LazyTable():
+
+	"""
+	A class used to read fields and row ranges of an HDF5 compound dataset on
+	demand
+	"""
+
+	def __init__(self, hdf, path, mmap=True):
+
+		"""
+		Parameters
+		----------
+
+		hdf: h5py.File or str
+			open HDF5 file (or path to one)
+
+		path: str
+			path of the dataset within the file (e.g. "Data/Table Layout")
+
+		mmap (optional): bool
+			if true will read contiguous, uncompressed datasets through a
+			memory map of the file instead of through h5py
+		"""
+
+		if isinstance(hdf, str):
+			import h5py
+			hdf = h5py.File(hdf, "r")
+		self.hdf = hdf
+		self.path = path
+		self.dset = hdf[path]
+		self.dtype = self.dset.dtype
+		self.shape = self.dset.shape
+
+		self._mmap = None
+		if mmap:
+			self._mmap = self.memmap()
+
+		return
+
+	def memmap(self):
+
+		"""
+		Returns a read only memory map of the dataset, or None if it is chunked,
+		compressed or has no data written yet
+		"""
+
+		offset = self.dset.id.get_offset()
+		if offset is None or self.dset.chunks is not None:
+			return None
+
+		return np.memmap(self.hdf.filename, mode="r", dtype=self.dtype,
+				   offset=offset, shape=self.shape)
+
+	@property
+	def names(self):
+
+		"""
+		Field names of the dataset
+		"""
+
+		return self.dtype.names
+
+	def __len__(self):
+
+		return self.shape[0] if len(self.shape) > 0 else 0
+
+	def read(self, fields=None, start=0, stop=None):
+
+		"""
+		Reads the given fields for rows start to stop
+
+		Parameters
+		----------
+
+		fields (optional): str or list of str
+			field(s) to read, a single name returns a plain array and a list a
+			structured array (default = all fields)
+
+		start (optional): int
+			first row to read (default = 0)
+
+		stop (optional): int
+			row to stop reading at (default = last row)
+		"""
+
+		rows = slice(start, stop)
+
+		if self._mmap is not None:
+			if fields is None:
+				return np.array(self._mmap[rows])
+			if isinstance(fields, str):
+				return np.array(self._mmap[fields][rows])
+			out = np.empty(len(range(*rows.indices(len(self)))),
+				  dtype=[(name, self.dtype[name]) for name in fields])
+			for name in fields:
+				out[name] = self._mmap[name][rows]
+			return out
+
+		if fields is None:
+			return self.dset[rows]
+
+		return self.dset.fields(fields)[rows]
+
+	def take(self, index, fields=None):
+
+		"""
+		Reads the given fields for the rows in index only
+
+		Parameters
+		----------
+
+		index: int array or bool array
+			rows to read (negative rows count from the end), or a mask with
+			one value per row
+
+		fields (optional): str or list of str
+			field(s) to read (see read, default = all fields)
+		"""
+
+		index = np.asarray(index)
+		if index.dtype == bool:
+			if index.shape != (len(self),):
+				raise IndexError("boolean index of shape {} does not match {} rows".format(
+					index.shape, len(self)))
+			index = np.flatnonzero(index)
+		index = index.astype("int64")
+		index = np.where(index < 0, index+len(self), index)
+		if np.any((index < 0) | (index >= len(self))):
+			raise IndexError("row index out of range for table of {} rows".format(len(self)))
+
+		if self._mmap is not None:
+			if fields is None or isinstance(fields, str):
+				return np.array(self._mmap[index] if fields is None else self._mmap[fields][index])
+			out = np.empty(index.shape, dtype=[(name, self.dtype[name]) for name in fields])
+			for name in fields:
+				out[name] = self._mmap[name][index]
+			return out
+
+		#h5py only selects increasing, unique rows
+		rows, inverse = np.unique(index.ravel(), return_inverse=True)
+		if len(rows) == 0:
+			return self.read(fields, 0, 0).reshape(index.shape)
+		dset = self.dset if fields is None else self.dset.fields(fields)
+
+		return dset[rows][inverse].reshape(index.shape)
+
+	def column(self, name, start=0, stop=None):
+
+		"""
+		Reads a single field for rows start to stop
+		"""
+
+		return self.read(name, start, stop)
+
+	def __getitem__(self, key):
+
+		if isinstance(key, str) or (isinstance(key, list) and len(key) > 0
+							   and all(isinstance(name, str) for name in key)):
+			return self.read(key)
+		if isinstance(key, slice):
+			start, stop, step = key.indices(len(self))
+			if step == 1:
+				return self.read(None, start, stop)
+			return self.take(np.arange(start, stop, step))
+		if isinstance(key, (int, np.integer)):
+			return self.take([key])[0]
+
+		return self.take(key)
+
+	def __array__(self, dtype=None, copy=None):
+
+		table = self.read()
+		if dtype is not None:
+			table = table.astype(dtype)
+
+		return table
+
+	def close(self):
+
+		"""
+		Closes the HDF5 file
+		"""
+
+		self._mmap = None
+		if self.hdf.id.valid:
+			self.hdf.close()
+
+		return
+
+def read_column(table, name, start=0, stop=None):
+
+	"""
+	Reads a single field of a table for rows start to stop, where table is
+	either a LazyTable or a structured array
+
+	Parameters
+	----------
+
+	table: LazyTable or structured array
+		table to read from
+
+	name: str
+		field name
+
+	start (optional): int
+		first row to read (default = 0)
+
+	stop (optional): int
+		row to stop reading at (default = last row)
+	"""
+
+	if isinstance(table, LazyTable):
+		return table.column(name, start, stop)
+
+	return table[name][start:stop]
+
+def merge_dtypes(dtypes):
+
+	"""
+	Returns a structured dtype holding every field of the given structured
+	dtypes, promoting fields whose type differs between them (e.g. between
+	Madrigal file versions)
+
+	Parameters
+	----------
+
+	dtypes: list of numpy dtypes
+		structured dtypes to merge
+	"""
+
+	names = []
+	types = {}
+	for dtype in dtypes:
+		for name in dtype.names:
+			if name not in types:
+				names.append(name)
+				types[name] = dtype[name]
+			else:
+				types[name] = np.promote_types(types[name], dtype[name])
+
+	return np.dtype([(name, types[name]) for name in names])
+
+def concat_tables(sources, path="Data/Table Layout"):
+
+	"""
+	Concatenates tables from many files (and/or arrays already in memory) into
+	one pre-sized structured array in a single pass, returning the array and
+	the row offset of each source (source i is rows offsets[i]:offsets[i+1])
+
+	Fields missing from a source are left as NaN (floats), 0 (numbers) or
+	empty (strings) for its rows
+
+	Parameters
+	----------
+
+	sources: list of str, structured arrays or LazyTables
+		hdf5 file names to read the table at path from, or tables to copy
+
+	path (optional): str
+		path of the dataset within each hdf5 file
+	"""
+
+	import h5py
+	
+	hdfs = []
+	try:
+		tables = []
+		for source in sources:
+			if isinstance(source, str):
+				hdf = h5py.File(source, "r")
+				hdfs.append(hdf)
+				tables.append(hdf[path])
+			elif isinstance(source, LazyTable):
+				tables.append(source.dset)
+			else:
+				tables.append(np.asarray(source))
+
+		dtype = merge_dtypes([table.dtype for table in tables])
+		lengths = [table.shape[0] if len(table.shape) > 0 else 1 for table in tables]
+		offsets = np.concatenate([[0], np.cumsum(lengths)]).astype("int64")
+
+		out = np.zeros(offsets[-1], dtype=dtype)
+		for table, start, stop in zip(tables, offsets[:-1], offsets[1:]):
+			if stop == start:
+				continue
+			#same layout so copy straight into the output
+			if table.dtype == dtype:
+				if isinstance(table, h5py.Dataset):
+					table.read_direct(out, dest_sel=np.s_[start:stop])
+				else:
+					out[start:stop] = table
+				continue
+
+			table = table[...]
+			for name in dtype.names:
+				if name in table.dtype.names:
+					out[name][start:stop] = table[name]
+				elif dtype[name].kind == "f":
+					out[name][start:stop] = np.nan
+	finally:
+		for hdf in hdfs:
+			hdf.close()
+
+	return out, offsets
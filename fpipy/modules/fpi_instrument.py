@@ -0,0 +1,226 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Optional instrumentation of the fpipy hot paths
+
+Timers, byte/row counters and cache hit/miss counts are only recorded while a
+collect() block is running; otherwise every hook returns after a single flag
+check. collect() can also run cProfile and tracemalloc for the block.
+
+	with fpipy.fpi_instrument.collect(profile=True) as report:
+		data = fpipy.FPIData("uao", "2013/10/02")
+		data.get_table()
+	print(report)
+"""
+
+import io
+import time
+import pstats
+import cProfile
+import threading
+import contextlib
+import functools
+import tracemalloc
+
+#true while a collect() block is running
+enabled = False
+_report = None
+
+class Report():
+
+	"""
+	A class used to hold the timers and counters recorded during one run
+	"""
+
+	def __init__(self):
+
+		#name -> [calls, total seconds, longest call in seconds]
+		self.timers = {}
+		#name -> count
+		self.counters = {}
+		self.profile = None
+		self.peak_memory = None
+		self.seconds = None
+		self._lock = threading.Lock()
+
+		return
+
+	def add_time(self, name, seconds):
+
+		with self._lock:
+			timer = self.timers.setdefault(name, [0, 0.0, 0.0])
+			timer[0] += 1
+			timer[1] += seconds
+			timer[2] = max(timer[2], seconds)
+
+		return
+
+	def add_count(self, name, n=1):
+
+		with self._lock:
+			self.counters[name] = self.counters.get(name, 0) + n
+
+		return
+
+	def to_dict(self):
+
+		"""
+		Returns the report as a dictionary (e.g. to save as JSON)
+		"""
+
+		return {"seconds": self.seconds,
+			"peak_memory": self.peak_memory,
+			"timers": {name: {"calls": calls, "total": total, "max": longest}
+				for name, (calls, total, longest) in self.timers.items()},
+			"counters": dict(self.counters)}
+
+	def __str__(self):
+
+		lines = ["{:<32}{:>8}{:>12}{:>12}".format("timer", "calls", "total (s)", "max (s)")]
+		for name, (calls, total, longest) in sorted(self.timers.items(), key=lambda item: -item[1][1]):
+			lines.append("{:<32}{:>8d}{:>12.4f}{:>12.4f}".format(name, calls, total, longest))
+		lines.append("")
+		lines.append("{:<32}{:>14}".format("counter", "count"))
+		for name, count in sorted(self.counters.items()):
+			lines.append("{:<32}{:>14d}".format(name, count))
+		if self.seconds is not None:
+			lines.append("")
+			lines.append("total run time {:.4f} s".format(self.seconds))
+		if self.peak_memory is not None:
+			lines.append("peak traced memory {:.1f} MB".format(self.peak_memory/1e6))
+
+		return "\n".join(lines)
+
+	def profile_stats(self, sort="cumulative", limit=30):
+
+		"""
+		Returns the cProfile statistics as text (if collect ran with
+		profile=True)
+		"""
+
+		if self.profile is None:
+			return ""
+		stream = io.StringIO()
+		pstats.Stats(self.profile, stream=stream).sort_stats(sort).print_stats(limit)
+
+		return stream.getvalue()
+
+class _Timer():
+
+	__slots__ = ["name", "start"]
+
+	def __init__(self, name):
+
+		self.name = name
+
+		return
+
+	def __enter__(self):
+
+		self.start = time.perf_counter()
+
+		return self
+
+	def __exit__(self, *exc):
+
+		report = _report
+		if report is not None:
+			report.add_time(self.name, time.perf_counter()-self.start)
+
+		return False
+
+_null_timer = contextlib.nullcontext()
+
+def timer(name):
+
+	"""
+	Returns a context manager that times its block under name (or does
+	nothing if instrumentation is off)
+	"""
+
+	if not enabled:
+		return _null_timer
+
+	return _Timer(name)
+
+def count(name, n=1):
+
+	"""
+	Adds n to the counter name (if instrumentation is on)
+	"""
+
+	if enabled:
+		_report.add_count(name, n)
+
+	return
+
+def timed(name):
+
+	"""
+	Decorator that times every call of a function under name (if
+	instrumentation is on)
+	"""
+
+	def decorator(func):
+
+		@functools.wraps(func)
+		def wrapper(*args, **kwargs):
+			if not enabled:
+				return func(*args, **kwargs)
+			with _Timer(name):
+				return func(*args, **kwargs)
+
+		return wrapper
+
+	return decorator
+
+@contextlib.contextmanager
+def collect(profile=False, trace_memory=False):
+
+	"""
+	Turns instrumentation on for the block and yields the Report it is
+	recorded in
+
+	Parameters
+	----------
+
+	profile (optional): bool
+		if true will also run cProfile over the block (see
+		Report.profile_stats)
+
+	trace_memory (optional): bool
+		if true will also run tracemalloc over the block and record the peak
+		memory
+	"""
+
+	global enabled, _report
+
+	previous = (enabled, _report)
+	report = Report()
+	enabled = True
+	_report = report
+
+	profiler = None
+	if profile:
+		profiler = cProfile.Profile()
+	tracing = trace_memory and not tracemalloc.is_tracing()
+	if tracing:
+		tracemalloc.start()
+
+	start = time.perf_counter()
+	if profiler is not None:
+		profiler.enable()
+	try:
+		yield report
+	finally:
+		if profiler is not None:
+			profiler.disable()
+			report.profile = profiler
+		report.seconds = time.perf_counter()-start
+		if trace_memory and tracemalloc.is_tracing():
+			report.peak_memory = tracemalloc.get_traced_memory()[1]
+			if tracing:
+				tracemalloc.stop()
+		enabled, _report = previous
+
+	return
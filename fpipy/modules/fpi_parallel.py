@@ -0,0 +1,158 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Parallel per-night wind derivation
+
+Every night's load_HDF5 -> get_table -> get_winds chain is independent, so
+nights (and stations) are fanned out over a ProcessPoolExecutor. Workers write
+their wind products (fpi_data.wind_dtype) to .npy files and only send the file
+name and row count back, and the driver memory maps the results in job order.
+"""
+
+import os
+import tempfile
+import concurrent.futures
+
+import numpy as np
+
+from . import fpi_cache
+from . import fpi_data
+
+def derive_night(job, out_fname, cadence=None, elm=45, max_gap=None, cache_root=None,
+				 filter=None):
+
+	"""
+	Derives the wind product of one night and saves it to out_fname, returning
+	(out_fname, number of rows, error message or None). Runs in a worker
+	process
+
+	Parameters
+	----------
+
+	job: (str, str) or str
+		(FPI, date (YYYY/MM/DD)) to load through the cache, or path to an hdf5
+		file
+
+	out_fname: str
+		path to save the wind product to (.npy)
+
+	cadence, elm, max_gap (optional):
+		passed to FPIData.get_winds
+
+	cache_root (optional): str
+		root of the FPICache to load (FPI, date) jobs from
+		(default = fpi_cache.default_cache_root())
+
+	filter (optional): fpi_filter.TableFilter
+		only use the records matching these predicates
+	"""
+
+	try:
+		if isinstance(job, str):
+			data = fpi_data.FPIData.from_files([job], filter=filter)
+		else:
+			FPI, date = job
+			cache = fpi_cache.default_cache() if cache_root is None else fpi_cache.FPICache(cache_root)
+			data = fpi_data.FPIData(FPI, date, cache=cache, lazy=True, filter=filter)
+			cache.flush()
+		try:
+			data.get_table(columns=["temp", "dtemp", "los_v", "dlos_v"])
+			winds = data.get_winds(cadence=cadence, elm=elm, max_gap=max_gap)
+		finally:
+			#workers live for the whole pool, so never keep the file open
+			data.close()
+		error = None
+	except Exception as exception:
+		winds = np.empty(0, dtype=fpi_data.wind_dtype)
+		error = "{}: {}".format(type(exception).__name__, exception)
+
+	np.save(out_fname, winds)
+
+	return out_fname, len(winds), error
+
+def _derive_night(args):
+
+	return derive_night(*args)
+
+def derive_winds_parallel(jobs, out_dir=None, workers=None, chunksize=1, cadence=None,
+						  elm=45, max_gap=None, cache_root=None, out_fname=None, filter=None):
+
+	"""
+	Derives the wind products (see FPIData.get_winds) of many nights on a
+	process pool. Results come back as read only memory maps in the same order
+	as jobs (empty for nights that failed), or as one memory mapped array if
+	out_fname is given
+
+	Parameters
+	----------
+
+	jobs: list of (str, str) or str
+		(FPI, date (YYYY/MM/DD)) pairs to load through the cache and/or paths to
+		hdf5 files
+
+	out_dir (optional): str
+		directory for the per-night .npy results (default = a new temporary
+		directory)
+
+	workers (optional): int
+		number of worker processes (default = os.cpu_count())
+
+	chunksize (optional): int
+		number of nights sent to a worker at a time (default = 1)
+
+	cadence, elm, max_gap (optional):
+		passed to FPIData.get_winds
+
+	cache_root (optional): str
+		root of the FPICache to load (FPI, date) jobs from
+
+	out_fname (optional): str
+		if given every night is concatenated (in job order) into one .npy file
+		here and that is returned memory mapped instead of the list
+
+	filter (optional): fpi_filter.TableFilter
+		only use the records matching these predicates (sent to every worker)
+
+	Returns
+	-------
+
+	list of memory mapped wind arrays (or one array if out_fname is given) and
+	a list of error messages (None for nights that worked)
+	"""
+
+	jobs = list(jobs)
+	if out_dir is None:
+		out_dir = tempfile.mkdtemp(prefix="fpipy_winds_")
+	os.makedirs(out_dir, exist_ok=True)
+	if workers is None:
+		workers = os.cpu_count()
+
+	args = []
+	for i, job in enumerate(jobs):
+		if isinstance(job, str):
+			name = os.path.splitext(os.path.basename(job))[0]
+		else:
+			name = "{}_{}".format(job[0].lower(), fpi_cache.date_key(job[1]))
+		args.append((job, os.path.join(out_dir, "{:06d}_{}.npy".format(i, name)),
+			   cadence, elm, max_gap, cache_root, filter))
+
+	#map keeps the results in job order
+	with concurrent.futures.ProcessPoolExecutor(max_workers=workers) as pool:
+		results = list(pool.map(_derive_night, args, chunksize=chunksize))
+
+	errors = [error for fname, nrows, error in results]
+	winds = [np.load(fname, mmap_mode="r") for fname, nrows, error in results]
+
+	if out_fname is None:
+		return winds, errors
+
+	total = sum(nrows for fname, nrows, error in results)
+	out = np.lib.format.open_memmap(out_fname, mode="w+", dtype=fpi_data.wind_dtype,
+								 shape=(total,))
+	start = 0
+	for night in winds:
+		out[start:start+len(night)] = night
+		start += len(night)
+	out.flush()
+
+	return np.load(out_fname, mmap_mode="r"), errors
@@ -7,112 +7,301 @@ Created on Tue Mar  2 16:12:54 2021
 """
 
 import numpy as np
-import elliotools
+import os
+import csv
+import json
+from . import fpi_tools
+from . import fpi_instrument
 
 
 
-uao_coords = [40.133, elliotools.lon360_to_180(271.8), 0.2, 5548] #[glat, glon, alt(km)]
-ann_coords = [42.27, elliotools.lon360_to_180(276.25), 0.3, 5551] #[glat, glon, alt(km)]
-mh_coords = [42.61, elliotools.lon360_to_180(288.52), 0]
-eku_coords = [37.75, elliotools.lon360_to_180(275.71), 0.3, 5554]
-vti_coords = [37.206, elliotools.lon360_to_180(279.58), 0.3, 5550]
-par_coords = [35.2, elliotools.lon360_to_180(277.15), 0.9, 5547]
+uao_coords = [40.133, fpi_tools.lon360_to_180(271.8), 0.2, 5548] #[glat, glon, alt(km)]
+ann_coords = [42.27, fpi_tools.lon360_to_180(276.25), 0.3, 5551] #[glat, glon, alt(km)]
+mh_coords = [42.61, fpi_tools.lon360_to_180(288.52), 0]
+eku_coords = [37.75, fpi_tools.lon360_to_180(275.71), 0.3, 5554]
+vti_coords = [37.206, fpi_tools.lon360_to_180(279.58), 0.3, 5550]
+par_coords = [35.2, fpi_tools.lon360_to_180(277.15), 0.9, 5547]
 
-class FPIStation():
+class StationRecord():
 	
 	"""
-	A class used to access and store hardware data for FPI stations. 
+	A class used to store the location and Madrigal instrument id of one FPI
+	station
 	"""
 	
-	def __init__(self, FPI_name):
+	__slots__ = ["name", "glat", "glon", "alt", "id"]
+	
+	def __init__(self, name, glat, glon, alt, id=None):
 		
 		"""
 		Parameters
 		----------
 		
-		rad: string
-			3 letter station code for requested radar data (e.g. "ann")
+		name: str
+			3 letter station code (e.g. "ann")
 			
-		Returns
-		----------
+		glat: float
+			geographic latitude
+			
+		glon: float
+			geographic longitude (-180 -> 180)
+			
+		alt: float
+			altitude (km)
+			
+		id (optional): int
+			Madrigal instrument id (None if the station has no Madrigal data)
+		"""
+		
+		self.name = name.lower()
+		self.glat = float(glat)
+		self.glon = float(glon)
+		self.alt = float(alt)
+		self.id = None if id is None else int(id)
+		
+		return
+	
+	def __repr__(self):
+		
+		return "StationRecord({}, {}, {}, {}, {})".format(self.name, self.glat, 
+													 self.glon, self.alt, self.id)
+
+class StationRegistry():
+	
+	"""
+	A class used to look up FPI stations by code (case insensitive) or by 
+	Madrigal instrument id
+	"""
+	
+	def __init__(self):
+		
+		self._by_name = {}
+		self._by_id = {}
+		self._records = []
+		self._arrays = None
+		
+		return
+	
+	def add(self, name, glat, glon, alt, id=None):
 		
-		geographic latitude, geographic longitude (-180 -> 180) and altitude (km)
 		"""
+		Adds (or replaces) a station, returning its StationRecord
 		
-		self.name = FPI_name
+		Parameters
+		----------
 		
-		if (FPI_name == "uao") or (FPI_name == "UAO"):
-			self.glat = uao_coords[0]
-			self.glon = uao_coords[1]
-			self.alt = uao_coords[2]
-			self.id = uao_coords[3]
+		name: str
+			3 letter station code (e.g. "ann")
 			
-		elif (FPI_name == "ann") or (FPI_name == "ANN"):
-			self.glat = ann_coords[0]
-			self.glon = ann_coords[1]
-			self.alt = ann_coords[2]
-			self.id = ann_coords[3]
+		glat: float
+			geographic latitude
 			
-		elif (FPI_name == "mh") or (FPI_name == "MH"):
-			self.glat = mh_coords[0]
-			self.glon = mh_coords[1]
-			self.alt = mh_coords[2]
+		glon: float
+			geographic longitude (-180 -> 180 or 0 -> 360)
 			
-		elif (FPI_name == "eku") or (FPI_name == "EKU"):
-			self.glat = eku_coords[0]
-			self.glon = eku_coords[1]
-			self.alt = eku_coords[2]
-			self.id = eku_coords[3]
+		alt: float
+			altitude (km)
 			
-		elif (FPI_name == "vti") or (FPI_name == "VTI"):
-			self.glat = vti_coords[0]
-			self.glon = vti_coords[1]
-			self.alt = vti_coords[2]
-			self.id = vti_coords[3]
+		id (optional): int
+			Madrigal instrument id
+		"""
+		
+		record = StationRecord(name, glat, fpi_tools.lon360_to_180(float(glon)), alt, id)
+		
+		old = self._by_name.get(record.name)
+		if old is not None:
+			self._records.remove(old)
+			if old.id is not None:
+				del self._by_id[old.id]
+		
+		self._records.append(record)
+		self._by_name[record.name] = record
+		if record.id is not None:
+			self._by_id[record.id] = record
+		self._arrays = None
+		
+		return record
+	
+	def get(self, key):
+		
+		"""
+		Returns the StationRecord of a station
+		
+		Parameters
+		----------
+		
+		key: str or int
+			3 letter station code (any case) or Madrigal instrument id
+		"""
+		
+		if isinstance(key, str):
+			record = self._by_name.get(key.lower())
+		else:
+			record = self._by_id.get(int(key))
+		if record is None:
+			raise KeyError("Unknown station {}".format(key))
 			
-		elif (FPI_name == "par") or (FPI_name == "PAR"):
-			self.glat = par_coords[0]
-			self.glon = par_coords[1]
-			self.alt = par_coords[2]
-			self.id = par_coords[3]
+		return record
+	
+	def __getitem__(self, key):
+		
+		return self.get(key)
+	
+	def __contains__(self, key):
+		
+		try:
+			self.get(key)
+		except (KeyError, ValueError, TypeError):
+			return False
+		
+		return True
+	
+	def __iter__(self):
+		
+		return iter(self._records)
+	
+	def __len__(self):
+		
+		return len(self._records)
+	
+	@property
+	def names(self):
+		
+		"""
+		Station codes in the order they were added
+		"""
+		
+		return [record.name for record in self._records]
+	
+	def coords(self):
+		
+		"""
+		Returns arrays of the geographic latitude, geographic longitude 
+		(-180 -> 180), altitude (km) and Madrigal id (-1 if none) of every 
+		station, in the same order as names
+		"""
+		
+		if self._arrays is None:
+			glat = np.array([record.glat for record in self._records], dtype="float")
+			glon = np.array([record.glon for record in self._records], dtype="float")
+			alt = np.array([record.alt for record in self._records], dtype="float")
+			ids = np.array([-1 if record.id is None else record.id for record in self._records], dtype="int")
+			for array in [glat, glon, alt, ids]:
+				array.flags.writeable = False
+			self._arrays = (glat, glon, alt, ids)
 			
+		return self._arrays
+	
+	def load(self, fname):
+		
+		"""
+		Adds the stations in a data file, either a .json list of objects or a
+		.csv file with columns name, glat, glon, alt and id (id may be empty)
+		
+		Parameters
+		----------
+		
+		fname: str
+			path to station file
+		"""
+		
+		if fname.endswith(".json"):
+			with open(fname, "r") as f:
+				stations = json.load(f)
 		else:
+			with open(fname, "r", newline="") as f:
+				stations = list(csv.DictReader(f))
+		
+		for station in stations:
+			id = station.get("id")
+			if id == "":
+				id = None
+			self.add(station["name"], station["glat"], station["glon"], 
+				station["alt"], id)
 			
-			print("Unkown station, parameters unable to load")
+		return
+
+#registry of every known station
+registry = StationRegistry()
+for name, coords in [("uao", uao_coords), ("ann", ann_coords), ("mh", mh_coords),
+					 ("eku", eku_coords), ("vti", vti_coords), ("par", par_coords)]:
+	registry.add(name, coords[0], coords[1], coords[2], 
+			  coords[3] if len(coords) > 3 else None)
+#extra stations can be added from a file without code changes
+if os.environ.get("FPIPY_STATIONS") is not None:
+	registry.load(os.environ["FPIPY_STATIONS"])
+
+class FPIStation():
+	
+	"""
+	A class used to access and store hardware data for FPI stations. 
+	"""
+	
+	__slots__ = ["name", "glat", "glon", "alt", "id"]
+	
+	@fpi_instrument.timed("FPIStation.__init__")
+	def __init__(self, FPI_name):
+		
+		"""
+		Parameters
+		----------
+		
+		rad: string or int
+			3 letter station code for requested radar data (e.g. "ann"), in any
+			case, or Madrigal instrument id
+			
+		Returns
+		----------
+		
+		geographic latitude, geographic longitude (-180 -> 180) and altitude (km)
+		"""
+		
+		record = registry.get(FPI_name)
+		
+		self.name = FPI_name if isinstance(FPI_name, str) else record.name
+		self.glat = record.glat
+		self.glon = record.glon
+		self.alt = record.alt
+		self.id = record.id
 		
 		return
 
 		
-	def get_coords(self, dtime, alt=0, aacgm=True):			
+	@fpi_instrument.timed("FPIStation.get_coords")
+	def get_coords(self, dtime, alt=0, aacgm=True, time_res=86400):			
 	
 		"""
 		Calculates and returns aacmgv2 coordinates (mlat, mlon) for this radar 
-		for the specified time
+		for the specified time(s). Arrays of times and/or altitudes give arrays
+		of coordinates, converted in one batched and memoised call (see 
+		fpi_tools.aacgm_convert)
 		
 		Parameters
 		----------
 		
-		time: datetime object
+		time: datetime object or array
 			datetime object of format datetime.datetime(YYYY, MM, DD, hh, mm, ss)
+			(or datetime64/epoch second array)
 			
-		alt: float
+		alt: float or float array
 			altitude in km
 			
 		aacgm (optional): bool
 			if true will return coords in aacgm coordinates, if false in geographic
+			
+		time_res (optional): int
+			resolution in seconds that times are rounded to for the aacgm
+			conversion (default = 1 day)
 		"""
 
 		if aacgm == True:
 
 			#get mlat and mlon
-			mlat, mlon = elliotools.geo_to_aacgm(self.glat, self.glon, dtime, self.alt+alt)
-			if isinstance(mlat, np.ndarray):
-				mlat = mlat[0]
-			if isinstance(mlon, np.ndarray):
-				mlon = mlon[0]
+			mlat, mlon = fpi_tools.aacgm_convert(self.glat, self.glon, self.alt+np.asarray(alt), 
+										dtime, "G2A", time_res=time_res)
 		
 			return mlat, mlon
 		
 		elif aacgm == False:
 			
-			return self.glat, self.glon
\ No newline at end of file
+			return self.glat, self.glon
@@ -0,0 +1,248 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Streaming processing of long FPI archives
+
+Records are read from many Madrigal files in fixed-size chunks (or one file,
+i.e. one night, at a time) so memory use does not grow with the length of the
+archive. Look directions are classified and horizontal winds derived for each
+chunk, with the last zenith sample and any line of sight samples after it
+carried over to the next chunk of the same file (night), and reductions such
+as hourly means (see fpi_aggregate.hourly_means) are accumulated as the
+chunks go by.
+"""
+
+import numpy as np
+
+from . import fpi_data
+from . import fpi_hdf5
+
+def chunk_fields(columns=None):
+
+	"""
+	Returns the Table Layout fields needed to make the given get_table columns
+
+	Parameters
+	----------
+
+	columns (optional): list of str
+		attribute names of the columns (see fpi_data.table_columns)
+		(default = all columns)
+	"""
+
+	return fpi_data.time_fields + [field for attr, field, dtype in fpi_data.table_columns
+		 if columns is None or attr in columns or attr in fpi_data.required_columns]
+
+def iter_chunks(fnames, chunk_size=100000, columns=None, filter=None):
+
+	"""
+	Yields FPIData objects (with get_table already run) holding consecutive
+	chunks of at most chunk_size records from each file in turn. Only the
+	fields needed for columns are read, one chunk at a time
+
+	Parameters
+	----------
+
+	fnames: list of str
+		paths to hdf5 files (in time order)
+
+	chunk_size (optional): int
+		maximum number of records per chunk, None for one chunk per file
+		(default = 100000)
+
+	columns (optional): list of str
+		attribute names of the columns to extract (see fpi_data.table_columns)
+		(default = all columns)
+
+	filter (optional): fpi_filter.TableFilter
+		only keep the records matching these predicates, evaluated on each
+		chunk as it is read (chunks can then hold fewer than chunk_size
+		records)
+	"""
+
+	if isinstance(fnames, str):
+		fnames = [fnames]
+	fields = chunk_fields(columns)
+
+	for fname in fnames:
+		table = fpi_hdf5.LazyTable(fname, "Data/Table Layout")
+		try:
+			size = len(table) if chunk_size is None else chunk_size
+			for start in range(0, len(table), max(size, 1)):
+				if filter is None:
+					rows = table.read(fields, start, start+size)
+				else:
+					rows = filter.apply(table, fields=fields, start=start, stop=start+size,
+						 chunk_size=size)
+				chunk = fpi_data.FPIData.from_table(rows)
+				chunk.files = [fname]
+				chunk.file_offsets = np.array([0, len(chunk.Table_Layout)], dtype="int64")
+				chunk.get_table(columns)
+				yield chunk
+		finally:
+			table.close()
+
+	return
+
+def iter_nights(fnames, columns=None, filter=None):
+
+	"""
+	Yields one FPIData object (with get_table already run) per file, i.e. one
+	night at a time
+
+	Parameters
+	----------
+
+	fnames: list of str
+		paths to hdf5 files
+
+	columns (optional): list of str
+		attribute names of the columns to extract (default = all columns)
+
+	filter (optional): fpi_filter.TableFilter
+		only keep the records matching these predicates
+	"""
+
+	return iter_chunks(fnames, chunk_size=None, columns=columns, filter=filter)
+
+class WindStream():
+
+	"""
+	A class used to derive horizontal winds chunk by chunk, carrying the last
+	zenith sample (the extra zenith measurement get_azm_vels adds before
+	dtime_min) and any line of sight samples after it over to the next chunk
+	"""
+
+	def __init__(self, elm=45, max_gap=None):
+
+		"""
+		Parameters
+		----------
+
+		elm (optional): float
+			elevation of the line of sight measurements in degrees
+			(default = 45)
+
+		max_gap (optional): float
+			largest time in seconds between the two zenith samples a line of
+			sight sample is interpolated between, samples in longer gaps are
+			dropped (default = no limit)
+		"""
+
+		self.elm = elm
+		self.max_gap = max_gap
+		self.reset()
+
+		return
+
+	def reset(self):
+
+		"""
+		Forgets the carried over samples (e.g. between unrelated data sets)
+		"""
+
+		empty = (np.array([], dtype="int64"), np.array([]), np.array([]))
+		self._zen = empty
+		self._pending = {look: empty for look in ["N", "E", "S", "W"]}
+
+		return
+
+	def update(self, chunk):
+
+		"""
+		Derives the horizontal winds of every line of sight sample that can be
+		bracketed by zenith samples so far, returning a dictionary of look
+		("N", "E", "S", "W") -> [hor_v, dhor_v, epoch] (as
+		FPIData.get_hor_vels)
+
+		Parameters
+		----------
+
+		chunk: FPIData
+			next chunk of records (with get_table run), later than every
+			chunk before it
+		"""
+
+		indexes = chunk.get_azm_indexes()
+		zen_index = indexes[4]
+		zen_epoch = np.concatenate([self._zen[0], chunk.epoch[zen_index]])
+		zen_v = np.concatenate([self._zen[1], chunk.los_v[zen_index]])
+		dzen_v = np.concatenate([self._zen[2], chunk.dlos_v[zen_index]])
+
+		sin_elm = np.sin(np.deg2rad(self.elm))
+		cos_elm = np.cos(np.deg2rad(self.elm))
+
+		hor_vels = {}
+		for look, index in zip(["N", "E", "S", "W"], indexes[:4]):
+			pending = self._pending[look]
+			epoch = np.concatenate([pending[0], chunk.epoch[index]])
+			los_v = np.concatenate([pending[1], chunk.los_v[index]])
+			dlos_v = np.concatenate([pending[2], chunk.dlos_v[index]])
+
+			if len(zen_epoch) == 0:
+				#samples before the first zenith can never be derived
+				ix = np.array([], dtype="int")
+				later = ix
+			else:
+				ix = np.nonzero((epoch >= zen_epoch[0]) & (epoch <= zen_epoch[-1]))[0]
+				later = np.nonzero(epoch > zen_epoch[-1])[0]
+				if self.max_gap is not None and len(ix) > 0:
+					#zenith samples either side of each line of sight sample
+					after = np.searchsorted(zen_epoch, epoch[ix], side="left")
+					before = np.where(zen_epoch[after] == epoch[ix], after, after-1)
+					ix = ix[zen_epoch[after] - zen_epoch[before] <= self.max_gap]
+
+			zen_v_interped = np.interp(epoch[ix], zen_epoch, zen_v) if len(ix) > 0 else np.array([])
+			dzen_v_interped = np.interp(epoch[ix], zen_epoch, dzen_v) if len(ix) > 0 else np.array([])
+			hor_v = (los_v[ix] - zen_v_interped*sin_elm) / cos_elm
+			dhor_v = np.sqrt(dlos_v[ix]**2 + (dzen_v_interped*sin_elm)**2) / cos_elm
+			hor_vels[look] = [hor_v, dhor_v, epoch[ix]]
+
+			self._pending[look] = (epoch[later], los_v[later], dlos_v[later])
+
+		if len(zen_epoch) > 0:
+			self._zen = (zen_epoch[-1:], zen_v[-1:], dzen_v[-1:])
+
+		return hor_vels
+
+def stream_winds(fnames, chunk_size=100000, elm=45, filter=None, max_gap=None, reset_files=True):
+
+	"""
+	Yields the horizontal winds (look -> [hor_v, dhor_v, epoch]) of each chunk
+	of records across many files (see iter_chunks and WindStream)
+
+	Parameters
+	----------
+
+	fnames: list of str
+		paths to hdf5 files (in time order)
+
+	chunk_size (optional): int
+		maximum number of records per chunk (default = 100000)
+
+	elm (optional): float
+		elevation of the line of sight measurements in degrees (default = 45)
+
+	filter (optional): fpi_filter.TableFilter
+		only use the records matching these predicates (keep the zenith
+		looks, they are needed to derive the horizontal winds)
+
+	max_gap (optional): float
+		largest time in seconds between the zenith samples a line of sight
+		sample is interpolated between (see WindStream, default = no limit)
+
+	reset_files (optional): bool
+		if true nothing is carried over from one file (night) to the next, so
+		no sample is derived from another night's zenith (default = True)
+	"""
+
+	stream = WindStream(elm=elm, max_gap=max_gap)
+	columns = ["los_v", "dlos_v"]
+	fname = None
+	for chunk in iter_chunks(fnames, chunk_size=chunk_size, columns=columns, filter=filter):
+		if reset_files and chunk.files[0] != fname:
+			stream.reset()
+			fname = chunk.files[0]
+		yield stream.update(chunk)
+
+	return
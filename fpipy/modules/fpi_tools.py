@@ -1,7 +1,10 @@
 import numpy as np
-import math
-import aacgmv2
-import pydatadarn
+import datetime as dt
+import collections
+from . import fpi_instrument
+
+#direction codes given to each record by classify_directions
+direction_codes = {"N": 0, "E": 1, "S": 2, "W": 3, "zen": 4, "other": 5}
 
 def interpolate(y, x, time):
 
@@ -54,7 +57,122 @@ def interpolate(y, x, time):
 
 	return vel
 		
-def hor_vel_calc(losv, losv_time_indexes, zen_v, zen_time_indexes):
+@fpi_instrument.timed("fpi_tools.interpolate_batch")
+def interpolate_batch(y, x, times):
+	
+	"""
+	Vectorised form of interpolate, gets interpolated values at every requested
+	time at once. Each time uses the line through the two points that 
+	bracket it, or the first/last two points when it is outside of x (as 
+	interpolate does)
+	
+	Parameters
+	----------
+	
+	y: float array
+		y values to interpolate
+		
+	x: int array
+		time of each y value in seconds
+		
+	times: int array
+		times to get interpolated values at in seconds
+	"""
+	
+	y = np.asarray(y, dtype="float")
+	x = np.asarray(x)
+	times = np.asarray(times)
+	
+	if len(x) < 2:
+		raise Exception("at least two points are needed to interpolate")
+	
+	#make sure x is in time order for searchsorted
+	if np.any(x[1:] < x[:-1]):
+		order = np.argsort(x, kind="stable")
+		x = x[order]
+		y = y[order]
+	
+	#index of the 1st point of each bracketing pair, clipped to the ends
+	index0 = np.clip(np.searchsorted(x, times, side="left")-1, 0, len(x)-2)
+	index1 = index0+1
+	
+	x1 = x[index0]
+	x2 = x[index1]
+	y1 = y[index0]
+	y2 = y[index1]
+	
+	#calculate y=mx+c line
+	m = (y2-y1)/(x2-x1)
+	c = y1 - (m*x1)
+	
+	return (m*times) + c
+		
+def interp_nan(x, xp, fp, max_gap=None):
+	
+	"""
+	Linearly interpolates fp (sampled at xp) onto x, giving NaN outside of xp 
+	and, if max_gap is given, where the nearest sample is more than max_gap 
+	away
+	
+	Parameters
+	----------
+	
+	x: float array
+		points to interpolate to
+		
+	xp: float array
+		sample points (in increasing order)
+		
+	fp: float array
+		sample values
+		
+	max_gap (optional): float
+		largest distance to the nearest sample that is interpolated across
+	"""
+	
+	x = np.asarray(x)
+	if len(xp) == 0:
+		return np.full(x.shape, np.nan)
+	
+	f = np.interp(x, xp, np.asarray(fp, dtype="float"), left=np.nan, right=np.nan)
+	
+	if max_gap is not None:
+		index = np.clip(np.searchsorted(xp, x), 1, max(len(xp)-1, 1))
+		gap = np.minimum(np.abs(x - xp[index-1]), np.abs(xp[np.minimum(index, len(xp)-1)] - x))
+		f[gap > max_gap] = np.nan
+	
+	return f
+
+def combine_looks(values, errors):
+	
+	"""
+	Averages several estimates of the same quantity (e.g. the meridional wind
+	from the North and South looks), ignoring NaNs, and returns the mean and 
+	its error
+	
+	Parameters
+	----------
+	
+	values: list of float arrays
+		estimates to average
+		
+	errors: list of float arrays
+		error in each estimate
+	"""
+	
+	values = np.asarray(values, dtype="float")
+	errors = np.asarray(errors, dtype="float")
+	valid = np.isfinite(values) & np.isfinite(errors)
+	count = valid.sum(axis=0)
+	
+	with np.errstate(divide="ignore", invalid="ignore"):
+		mean = np.where(valid, values, 0).sum(axis=0) / count
+		error = np.sqrt(np.where(valid, errors**2, 0).sum(axis=0)) / count
+		
+	return mean, error
+
+@fpi_instrument.timed("fpi_tools.hor_vel_calc")
+def hor_vel_calc(losv, losv_time_indexes, zen_v, zen_time_indexes, elm=45):
 	
 	"""
 	Calculates the horizontal velocity from the line of sight and vertical
@@ -74,21 +192,330 @@ def hor_vel_calc(losv, losv_time_indexes, zen_v, zen_time_indexes):
 		
 	vy_time_indexes: int array
 		time in seconds from first line of sight doppler measurements
+		
+	elm (optional): float
+		elevation angle of the line of sight measurements in degrees
+		(default = 45)
 	"""
 	
 	if len(losv) >= len(zen_v):
 		raise Exception("vertical velocity length must be greater than line of sight velocity")
 	
-	vx = np.empty(len(losv))
+	#get vertical velocity at the same time as line of sight measurements
+	vy = interpolate_batch(zen_v, zen_time_indexes, losv_time_indexes)
 	
-	for i in range(len(losv)):
-		#get vertical velocity at the same time as line of sight measurement
-		vy = interpolate(zen_v, zen_time_indexes, losv_time_indexes[i])
-		#calculate horizontal velocity
-		vx[i] = (losv[i] - (vy*np.sin(np.deg2rad(45)))) / np.cos(np.deg2rad(45))
+	#calculate horizontal velocity
+	elm = np.deg2rad(elm)
+	vx = (np.asarray(losv, dtype="float") - (vy*np.sin(elm))) / np.cos(elm)
 
 	return vx
 
+def columns_to_dtime64(year, month, day, hour=0, minute=0, sec=0):
+	
+	"""
+	Builds an array of datetime64[s] times from separate date and time columns
+	in a single vectorised pass
+	
+	Parameters
+	----------
+	
+	year, month, day: int arrays
+		date of each record
+		
+	hour, minute, sec (optional): int arrays
+		time of each record (default = 0)
+	"""
+	
+	year = np.asarray(year, dtype="int64")
+	month = np.asarray(month, dtype="int64")
+	day = np.asarray(day, dtype="int64")
+	
+	#build days since epoch by stepping through calendar units
+	days = (year-1970).astype("datetime64[Y]").astype("datetime64[M]")
+	days = (days + (month-1).astype("timedelta64[M]")).astype("datetime64[D]")
+	days = days + (day-1).astype("timedelta64[D]")
+	
+	secs = (np.asarray(hour, dtype="int64")*3600 
+		 + np.asarray(minute, dtype="int64")*60 
+		 + np.asarray(sec, dtype="int64"))
+	
+	return days.astype("datetime64[s]") + secs.astype("timedelta64[s]")
+
+def dtime64_to_strings(dtime64):
+	
+	"""
+	Converts an array of datetime64 times into strings (YYYY/MM/DD hh:mm:ss)
+	
+	Parameters
+	----------
+	
+	dtime64: datetime64 array
+		times to convert
+	"""
+	
+	strings = np.datetime_as_string(np.asarray(dtime64, dtype="datetime64[s]"), unit="s")
+	strings = np.char.replace(strings, "-", "/")
+	strings = np.char.replace(strings, "T", " ")
+	
+	return strings
+
+def to_epoch(dtimes):
+	
+	"""
+	Converts times into integer seconds since 1970/01/01
+	
+	Parameters
+	----------
+	
+	dtimes: dtime object/array, datetime64 array, string array or int array
+		times to convert (strings as YYYY/MM/DD hh:mm:ss, integers are taken to
+		already be epoch seconds)
+	"""
+	
+	dtimes = np.asarray(dtimes)
+	if dtimes.dtype.kind in "iuf":
+		return dtimes.astype("int64")
+	if dtimes.dtype.kind in "US":
+		dtimes = np.char.replace(np.char.replace(dtimes, "/", "-"), " ", "T")
+	
+	return dtimes.astype("datetime64[s]").astype("int64")
+
+def classify_directions(azm, elm, los_elm=45, tol=5):
+	
+	"""
+	Gives every record a look direction code (see direction_codes) in a single
+	pass over the azimuth and elevation arrays
+	
+	Parameters
+	----------
+	
+	azm: float array
+		azimuth of each record (degrees [-180 -> 180])
+		
+	elm: float array
+		elevation of each record (degrees)
+		
+	los_elm (optional): float
+		elevation of the N/E/S/W looks (default = 45)
+		
+	tol (optional): float
+		azimuth tolerance for each cardinal look in degrees (default = 5)
+	"""
+	
+	azm = np.asarray(azm)
+	elm = np.asarray(elm)
+	
+	#nearest cardinal direction (0 = N, 1 = E, 2 = S, 3 = W) and distance from it
+	quadrant = np.rint(azm/90)
+	cardinal = (np.abs(azm - quadrant*90) <= tol) & (np.abs(azm) <= 180+tol)
+	
+	codes = np.full(azm.shape, direction_codes["other"], dtype="int8")
+	codes[cardinal] = (quadrant[cardinal] % 4).astype("int8")
+	#north looks share azimuth 0 with the zenith so must also be at los_elm
+	codes[(codes == direction_codes["N"]) & (elm != los_elm)] = direction_codes["other"]
+	codes[elm == 90] = direction_codes["zen"]
+	
+	return codes
+
+def unique_rows(*columns):
+	
+	"""
+	Finds the distinct rows of several equal length columns (much faster than
+	np.unique(axis=0) for numeric columns), returning the index of one
+	occurrence of each distinct row and, for every row, the index of its 
+	distinct row
+	
+	Parameters
+	----------
+	
+	*columns: arrays
+		columns of the rows
+	"""
+	
+	columns = [np.asarray(column).ravel() for column in columns]
+	n = len(columns[0])
+	if n == 0:
+		return np.empty(0, dtype="int64"), np.empty(0, dtype="int64")
+	
+	order = np.lexsort(columns[::-1])
+	new = np.zeros(n, dtype="bool")
+	new[0] = True
+	for column in columns:
+		sorted_column = column[order]
+		new[1:] |= sorted_column[1:] != sorted_column[:-1]
+	
+	group = np.cumsum(new)-1
+	inverse = np.empty(n, dtype="int64")
+	inverse[order] = group
+	
+	return order[new], inverse
+
+class LRUCache():
+	
+	"""
+	A class used to memoise results, keeping at most maxsize entries and 
+	forgetting the least recently used first
+	"""
+	
+	def __init__(self, maxsize=65536):
+		
+		"""
+		Parameters
+		----------
+		
+		maxsize (optional): int
+			maximum number of entries to keep (default = 65536)
+		"""
+		
+		self.maxsize = maxsize
+		self.hits = 0
+		self.misses = 0
+		self._data = collections.OrderedDict()
+		
+		return
+	
+	def get(self, key, default=None):
+		
+		"""
+		Returns the value stored for key (marking it as used), or default
+		"""
+		
+		try:
+			value = self._data[key]
+		except KeyError:
+			self.misses += 1
+			return default
+		
+		self._data.move_to_end(key)
+		self.hits += 1
+		
+		return value
+	
+	def put(self, key, value):
+		
+		"""
+		Stores value for key, evicting the least recently used entry if full
+		"""
+		
+		self._data[key] = value
+		self._data.move_to_end(key)
+		while len(self._data) > self.maxsize:
+			self._data.popitem(last=False)
+			
+		return
+	
+	def clear(self):
+		
+		self._data.clear()
+		self.hits = 0
+		self.misses = 0
+		
+		return
+	
+	def __contains__(self, key):
+		
+		return key in self._data
+	
+	def __len__(self):
+		
+		return len(self._data)
+
+#memo of aacgm_convert results keyed on (method, rounded time, lat, lon, alt)
+aacgm_cache = LRUCache()
+
+@fpi_instrument.timed("fpi_tools.aacgm_convert")
+def aacgm_convert(lat, lon, alt, dtimes, method="G2A", time_res=86400, cache=None):
+	
+	"""
+	Converts arrays of coordinates between geographic and aacgm. Times are 
+	rounded down to time_res, repeated (time, lat, lon, alt) points are only
+	converted once and every point of the same rounded time is converted in a
+	single aacgmv2 call (so the coefficients are only set up once per epoch).
+	Results are memoised in cache, unless there are more distinct points than
+	the cache can hold
+	
+	Parameters
+	----------
+	
+	lat: float or float array
+		latitudes (degrees)
+		
+	lon: float or float array
+		longitudes (degrees [-180 -> 180])
+		
+	alt: float or float array
+		altitudes above sea level (km)
+		
+	dtimes: dtime object, datetime64 or epoch second array
+		times of the coordinates
+		
+	method (optional): str
+		conversion code (G2A = geo to aacgm, A2G = aacgm to geo)
+		
+	time_res (optional): int
+		resolution in seconds that times are rounded down to (default = 1 day)
+		
+	cache (optional): LRUCache
+		memo to use (default = aacgm_cache)
+	"""
+	
+	if cache is None:
+		cache = aacgm_cache
+	
+	epoch = to_epoch(dtimes)
+	lat, lon, alt, epoch = np.broadcast_arrays(np.asarray(lat, dtype="float"), 
+							   np.asarray(lon, dtype="float"), 
+							   np.asarray(alt, dtype="float"), epoch)
+	shape = lat.shape
+	rounded = (epoch.ravel() // time_res) * time_res
+	
+	#convert each distinct point once
+	points = np.stack([rounded.astype("float"), lat.ravel(), lon.ravel(), alt.ravel()], axis=1)
+	first, inverse = unique_rows(*points.T)
+	points = points[first]
+	
+	out_lat = np.empty(len(points))
+	out_lon = np.empty(len(points))
+	#more points than the cache holds would only evict each other, so skip the
+	#per point lookups and convert them all
+	use_cache = len(points) <= cache.maxsize
+	missing = []
+	if use_cache:
+		for i, point in enumerate(points):
+			value = cache.get((method,)+tuple(point))
+			if value is None:
+				missing.append(i)
+			else:
+				out_lat[i], out_lon[i] = value
+	else:
+		missing = np.arange(len(points))
+	
+	fpi_instrument.count("aacgm_cache_hit", len(points)-len(missing))
+	fpi_instrument.count("aacgm_cache_miss", len(missing))
+	
+	#one aacgmv2 call for all missing points of each rounded time
+	if len(missing) > 0:
+		import aacgmv2
+	missing = np.array(missing, dtype="int")
+	for time in np.unique(points[missing, 0]):
+		ix = missing[points[missing, 0] == time]
+		dtime = dt.datetime(1970, 1, 1) + dt.timedelta(seconds=int(time))
+		new_lat, new_lon, r = aacgmv2.convert_latlon_arr(points[ix, 1], points[ix, 2], 
+											  points[ix, 3], dtime, method)
+		out_lat[ix] = new_lat
+		out_lon[ix] = new_lon
+		if not use_cache:
+			continue
+		for i in ix:
+			cache.put((method,)+tuple(points[i]), (out_lat[i], out_lon[i]))
+	
+	out_lat = out_lat[inverse].reshape(shape)
+	out_lon = out_lon[inverse].reshape(shape)
+	if len(shape) == 0:
+		return float(out_lat), float(out_lon)
+	
+	return out_lat, out_lon
+
 def times_to_secs(dtimes, dtime_min):
 	
 	"""
@@ -110,41 +537,144 @@ def times_to_secs(dtimes, dtime_min):
 		
 	return time_indexes
 
-def merge_vecs(NS, EW):
+def look_points(glat, glon, azm, elm, alt, site_alt=0, earth_radius=6371.0):
+	
+	"""
+	Calculates the geographic latitude and longitude of the point where each
+	look (azimuth, elevation) from a site reaches the given altitude, on a
+	spherical Earth, for every record at once
+	
+	Parameters
+	----------
+	
+	glat, glon: float or float array
+		geographic latitude and longitude of the site (degrees)
+		
+	azm: float or float array
+		azimuth of each look (degrees east of north)
+		
+	elm: float or float array
+		elevation of each look (degrees, 90 = zenith)
+		
+	alt: float or float array
+		altitude of the sampled point (km above sea level, e.g. gdalt)
+		
+	site_alt (optional): float or float array
+		altitude of the site (km, default = 0)
+		
+	earth_radius (optional): float
+		radius of the Earth in km (default = 6371)
+		
+	Returns
+	-------
+	
+	latitude and longitude (-180 -> 180) of each point in degrees, NaN where
+	the look never reaches alt
+	"""
+	
+	lat1 = np.deg2rad(np.asarray(glat, dtype="float"))
+	lon1 = np.deg2rad(np.asarray(glon, dtype="float"))
+	azm = np.deg2rad(np.asarray(azm, dtype="float"))
+	elm = np.deg2rad(np.asarray(elm, dtype="float"))
+	r0 = earth_radius + np.asarray(site_alt, dtype="float")
+	r1 = earth_radius + np.asarray(alt, dtype="float")
+	
+	#angle at the centre of the Earth between the site and the point, from
+	#r1*cos(elm+angle) = r0*cos(elm)
+	with np.errstate(invalid="ignore"):
+		angle = np.arccos(np.clip(r0*np.cos(elm)/r1, -1, 1)) - elm
+	angle = np.where(r1 >= r0, angle, np.nan)
+	
+	#point at that angular distance from the site along the azimuth
+	sin_lat2 = np.sin(lat1)*np.cos(angle) + np.cos(lat1)*np.sin(angle)*np.cos(azm)
+	lat2 = np.arcsin(np.clip(sin_lat2, -1, 1))
+	lon2 = lon1 + np.arctan2(np.sin(azm)*np.sin(angle)*np.cos(lat1), 
+						  np.cos(angle) - np.sin(lat1)*sin_lat2)
+	
+	lat2 = np.rad2deg(lat2)
+	lon2 = np.mod(np.rad2deg(lon2)+180, 360)-180
+	
+	return lat2, lon2
+
+def lon360_to_180(lon):
+	
+	"""
+	Converts longitudes from 0 -> 360 to -180 -> 180 (longitudes already in
+	-180 -> 180 are unchanged)
+	
+	Parameters
+	----------
+	
+	lon: float or array of floats
+		longitude(s) in degrees
+	"""
+	
+	lon = np.asarray(lon, dtype="float")
+	lon = np.where(lon > 180, lon-360, lon)
+	if lon.ndim == 0:
+		return float(lon)
+		
+	return lon
+
+@fpi_instrument.timed("fpi_tools.merge_vecs")
+def merge_vecs(NS, EW, dN=None, dE=None):
 	
 	"""
 	Calculates the full 2D vector direction and magnitude from North->South and
-	East->West flows
+	East->West flows. Works on single values or whole arrays, and also returns
+	the propagated errors in magnitude and direction when dN and/or dE are 
+	given
 	
 	Parameters
 	----------
 	
-	NS: float
+	NS: float or float array
 		velocity of North->South neutral wind flow
 		
-	EW: float
+	EW: float or float array
 		velocity of East->West neutral wind flow
+		
+	dN (optional): float or float array
+		error in North->South velocity
+		
+	dE (optional): float or float array
+		error in East->West velocity
+		
+	Returns
+	-------
+	
+	velocity, kvec (degrees, 90 = E, -90 = W, 0 = N, 180 = S) and, if dN or dE
+	are given, dvelocity and dkvec (degrees). kvec is NaN for zero vectors
 	"""
 	
-	theta = np.rad2deg(np.arctan(NS/EW)) # 90 = E, -90 = W, 0 = N, 180 = S
-	print("theta", theta)
-	if EW >= 0:
-		kvec = 90-theta
-	elif EW < 0:
-		kvec = -90-theta
-	else:
-		print("EW must be a number")
-		return
+	NS = np.asarray(NS, dtype="float")
+	EW = np.asarray(EW, dtype="float")
 	
-	velocity = math.sqrt(pow(EW, 2) + pow(NS, 2))
+	velocity = np.hypot(NS, EW)
+	kvec = np.asarray(np.rad2deg(np.arctan2(EW, NS)))
+	#keep due south as 180 (not -180) and zero vectors without a direction
+	np.copyto(kvec, 180., where=(kvec == -180))
+	np.copyto(kvec, np.nan, where=(velocity == 0))
 	
-	return velocity, kvec
+	if dN is None and dE is None:
+		return velocity[()], kvec[()]
+	
+	dN = np.asarray(0. if dN is None else dN, dtype="float")
+	dE = np.asarray(0. if dE is None else dE, dtype="float")
+	with np.errstate(divide="ignore", invalid="ignore"):
+		dvelocity = np.hypot(NS*dN, EW*dE) / velocity
+		dkvec = np.rad2deg(np.hypot(EW*dN, NS*dE) / velocity**2)
+	
+	return velocity[()], kvec[()], dvelocity[()], dkvec[()]
 
-def vector_shift(dtime, alt=0, method="M2G"):
+@fpi_instrument.timed("fpi_tools.vector_shift")
+def vector_shift(dtime, alt=0, method="M2G", time_res=86400):
 	
 	"""
 	Returns the latitude and longitude shift to convert geographic vectors to
-	magnetic
+	magnetic. Arrays of times and/or altitudes give arrays of shifts, with 
+	each distinct (rounded time, altitude) pole position only converted once 
+	and memoised (see aacgm_convert)
 	
 	Parameters
 	----------
@@ -155,23 +685,26 @@ def vector_shift(dtime, alt=0, method="M2G"):
 	lons: float array
 		longitude to shift (in degrees [-180 -> 180])
 	
-	dtime: dtime object
-		time to calculate shift for
+	dtime: dtime object or array
+		time(s) to calculate shift for (or datetime64/epoch second array)
 		
-	alt: float
+	alt: float or float array
 		altitude above sea level (default = 0)
 		
 	method: string
 		code to convert vectors from/to (M2G = aacgm to geo, G2M = geo to aacgm)
+		
+	time_res (optional): int
+		resolution in seconds that times are rounded to (default = 1 day)
 	"""
 	
 	if method == "M2G":
 	
 		#get coordinates of geographic pole in aacgm
-		glat, glon, r = aacgmv2.wrapper.convert_latlon(90, 0, alt, dtime, "G2A")
+		glat, glon = aacgm_convert(90, 0, alt, dtime, "G2A", time_res=time_res)
 		
 		#convert glon from -180 -> 180 into 0 -> 360
-		glon = pydatadarn.tools.lon180_to_360(glon)
+		glon = np.mod(glon, 360)
 		#find angle between geographic and magnetic north
 		dr = glat - 90
 		dtheta = glon
@@ -179,15 +712,151 @@ def vector_shift(dtime, alt=0, method="M2G"):
 	elif method == "G2M":
 		
 		#get coordinates of magnetic pole in geographic
-		mlat, mlon, r = aacgmv2.wrapper.convert_latlon(90, 0, alt, dtime, "A2G")
-		#convert glon from -180 -> 180 into 0 -> 360
-		glon = pydatadarn.tools.lon180_to_360(glon)
+		mlat, mlon = aacgm_convert(90, 0, alt, dtime, "A2G", time_res=time_res)
+		#convert mlon from -180 -> 180 into 0 -> 360
+		mlon = np.mod(mlon, 360)
 		#find angle between magnetic and geographic north
 		dr = mlat - 90
 		dtheta = mlon
 	
 	else:
-		print("method code unrecognised, please try again")
-		return
+		raise ValueError("method code {!r} unrecognised (use M2G or G2M)".format(method))
+	
+	return dr, dtheta
+
+def _bearing(lat1, lon1, lat2, lon2):
+	
+	#initial great circle bearing (radians clockwise from north) from point 1 
+	#to point 2, all in radians
+	dlon = lon2-lon1
+	
+	return np.arctan2(np.sin(dlon)*np.cos(lat2), 
+				   np.cos(lat1)*np.sin(lat2) - np.sin(lat1)*np.cos(lat2)*np.cos(dlon))
+
+def frame_rotation(lat, lon, dtimes, alt=0, method="G2M", time_res=86400, step=0.01):
+	
+	"""
+	Returns the azimuth (degrees clockwise) that north of the frame being 
+	converted from has in the frame being converted to, at each point. This
+	is the angle vectors at that point are rotated by going from geographic 
+	to magnetic (G2M) or magnetic to geographic (M2G). It is found from the
+	converted positions of two points step degrees apart on the meridian
+	through each point, either side of it (see aacgm_convert), so is not 
+	defined within about step of the other frame's pole
+	
+	Parameters
+	----------
+	
+	lat, lon: float or float array
+		position of each sample in the frame being converted from (degrees)
+		
+	dtimes: dtime, datetime64 or epoch second array
+		time of each sample
+		
+	alt (optional): float or float array
+		altitude of each sample above sea level (default = 0)
+		
+	method (optional): string
+		code to convert vectors from/to (M2G = aacgm to geo, G2M = geo to aacgm)
+		
+	time_res (optional): int
+		resolution in seconds that times are rounded to (default = 1 day)
+		
+	step (optional): float
+		distance in degrees of latitude between the two points (default = 0.01)
+	"""
+	
+	codes = {"G2M": "G2A", "M2G": "A2G"}
+	if method not in codes:
+		raise ValueError("method code {!r} unrecognised (use M2G or G2M)".format(method))
+	
+	epoch = to_epoch(dtimes)
+	lat, lon, alt, epoch = np.broadcast_arrays(np.asarray(lat, dtype="float"), 
+							   np.asarray(lon, dtype="float"), 
+							   np.asarray(alt, dtype="float"), epoch)
+	
+	#two points on the meridian through each sample, either side of it (kept
+	#on the sphere near the poles)
+	lat1 = np.clip(lat, -90+step/2, 90-step/2) - step/2
+	lat2 = lat1+step
+	new_lat, new_lon = aacgm_convert(np.concatenate([lat1.ravel(), lat2.ravel()]), 
+								 np.concatenate([lon.ravel(), lon.ravel()]), 
+								 np.concatenate([alt.ravel(), alt.ravel()]), 
+								 np.concatenate([epoch.ravel(), epoch.ravel()]), 
+								 codes[method], time_res=time_res)
+	lat1, lat2 = np.split(np.deg2rad(new_lat), 2)
+	lon1, lon2 = np.split(np.deg2rad(new_lon), 2)
+	
+	#bearing of the meridian at its mid point (the sample), from the mean of
+	#its bearings leaving the first point and arriving at the second
+	initial = _bearing(lat1, lon1, lat2, lon2)
+	final = _bearing(lat2, lon2, lat1, lon1) + np.pi
+	bearing = np.rad2deg(np.arctan2(np.sin(initial)+np.sin(final), np.cos(initial)+np.cos(final)))
+	
+	return bearing.reshape(lon.shape)[()]
+
+def rotate_vecs(NS, EW, angle):
+	
+	"""
+	Rotates arrays of North->South and East->West vector components so that 
+	every vector's azimuth increases (clockwise) by angle, returning the new
+	NS and EW components
+	
+	Parameters
+	----------
+	
+	NS: float array
+		North->South components
+		
+	EW: float array
+		East->West components
+		
+	angle: float or float array
+		angle to rotate each vector by (degrees)
+	"""
+	
+	angle = np.deg2rad(angle)
+	cos_angle = np.cos(angle)
+	sin_angle = np.sin(angle)
+	NS = np.asarray(NS, dtype="float")
+	EW = np.asarray(EW, dtype="float")
+	
+	return NS*cos_angle - EW*sin_angle, EW*cos_angle + NS*sin_angle
+
+def shift_vecs(NS, EW, lat, lon, dtimes, alt=0, method="G2M", time_res=86400):
+	
+	"""
+	Rotates whole arrays of North->South and East->West vector components 
+	between the geographic and magnetic frames in one step, by the angle
+	between the two frames' north at each sample's position (see 
+	frame_rotation)
+	
+	Parameters
+	----------
+	
+	NS: float array
+		North->South components
+		
+	EW: float array
+		East->West components
+		
+	lat, lon: float or float array
+		position of each sample in the frame being converted from (degrees)
+		
+	dtimes: dtime, datetime64 or epoch second array
+		time of each sample
+		
+	alt (optional): float or float array
+		altitude of each sample above sea level (default = 0)
+		
+	method (optional): string
+		code to convert vectors from/to (M2G = aacgm to geo, G2M = geo to aacgm)
+		
+	time_res (optional): int
+		resolution in seconds that times are rounded to (default = 1 day)
+	"""
+	
+	angle = frame_rotation(lat, lon, dtimes, alt=alt, method=method, time_res=time_res)
 	
-	return dr, dtheta
\ No newline at end of file
+	#a vector at azimuth a from the old north is at a+angle from the new north
+	return rotate_vecs(NS, EW, angle)
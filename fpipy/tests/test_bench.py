@@ -0,0 +1,64 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Memory footprint of the parsed FPIData columns (see
+fpipy.benchmarks.bench.footprint)
+"""
+
+import numpy as np
+import pytest
+
+from fpipy.modules import fpi_data
+from fpipy.benchmarks import bench
+from fpipy.benchmarks import synthetic
+
+@pytest.fixture
+def fname(tmp_path):
+
+	fname = str(tmp_path / "synthetic.hdf5")
+	synthetic.write_hdf5(fname, 3000)
+
+	return fname
+
+def test_compact_layout(fname):
+
+	data = bench.load(fname)
+
+	for attr, field, dtype in fpi_data.table_columns:
+		assert getattr(data, attr).dtype == np.dtype(dtype)
+	assert data.epoch.dtype == np.dtype("int64")
+	assert data.direction.dtype == np.dtype("int8")
+	assert data.dir_order.dtype == np.dtype("int32")
+
+	#the table columns plus epoch, direction, dir_order and dir_epoch
+	expected = sum(np.dtype(dtype).itemsize for attr, field, dtype in fpi_data.table_columns)
+	assert data.bytes_per_record() == expected + 8 + 1 + 4 + 8
+
+def test_footprint_against_original_layout(fname):
+
+	data = bench.load(fname)
+	nbytes = data.bytes_per_record()
+	legacy = bench.legacy_columns(data)
+	legacy_nbytes = bench.legacy_bytes_per_record(data)
+	#building the baseline leaves the derived columns of data unbuilt
+	assert set(data.memory_usage()) == set(attr for attr, field, dtype in fpi_data.table_columns) | {
+		"epoch", "direction", "dir_order", "dir_epoch"}
+
+	#the baseline holds the same values, 64-bit columns plus the string and
+	#datetime object times
+	for attr, field, dtype in fpi_data.table_columns:
+		assert legacy[attr].itemsize == 8
+		assert np.array_equal(legacy[attr], getattr(data, attr))
+	for name, dtype in fpi_data.calendar_columns:
+		assert legacy[name].itemsize == 8
+		assert np.array_equal(legacy[name], getattr(data, name))
+	assert list(legacy["times"]) == list(data.times)
+	assert list(legacy["dtimes"]) == list(data.dtimes)
+	assert legacy_nbytes == sum(bench.column_bytes(column) for column in legacy.values())/len(data.epoch)
+	assert legacy_nbytes > 18*8 + 128 + 8
+
+	#about 6 times smaller after get_table
+	assert legacy_nbytes/nbytes > 6
+	#and still smaller with every derived column built
+	assert data.bytes_per_record() > nbytes
+	assert legacy_nbytes/data.bytes_per_record() > 1.5
@@ -0,0 +1,126 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Tests for fpipy.modules.fpi_aggregate against plain Python loops over the
+records
+"""
+
+import datetime as dt
+
+import numpy as np
+import h5py
+
+from fpipy.modules import fpi_aggregate
+from fpipy.modules import fpi_stream
+from fpipy.benchmarks import synthetic
+
+def records(n, seed=0):
+
+	rng = np.random.default_rng(seed)
+	epoch = np.datetime64("2013-01-01", "s").astype("int64") + rng.integers(0, 2*365*86400, n)
+	station = rng.choice(["uao", "ANN", "kto"], n)
+	look = rng.choice(["N", "E", "S", "W", "zen"], n)
+	a = rng.normal(0, 50, n)
+	a[rng.random(n) < 0.05] = np.nan
+	da = rng.uniform(0, 10, n)
+	da[rng.random(n) < 0.05] = np.nan
+	b = rng.normal(800, 100, n)
+
+	return epoch, station, look, a, da, b
+
+def brute_force(epoch, station, look, values, stations, looks, time_bin, doy_bin, day_start):
+
+	#(station, look, doy, time) -> list of the values of each record
+	bins = {}
+	for t, name, direction, value in zip(epoch, station, look, values):
+		name = name.lower()
+		if name not in stations or direction not in looks:
+			continue
+		day = dt.datetime(1970, 1, 1) + dt.timedelta(seconds=int(t)-day_start)
+		doy = (day.timetuple().tm_yday-1)//doy_bin*doy_bin + 1
+		secs = day.hour*3600 + day.minute*60 + day.second
+		bins.setdefault((name, direction, doy, secs//time_bin*time_bin), []).append(value)
+
+	return bins
+
+def test_matches_brute_force():
+
+	epoch, station, look, a, da, b = records(5000)
+	settings = {"stations": ["uao", "ann"], "looks": ["N", "E", "S", "W"], "time_bin": 1800,
+		"doy_bin": 30, "day_start": 43200}
+	median_res = 0.5
+
+	#chunks aggregated separately then merged
+	agg = fpi_aggregate.Aggregator(["a", "b"], median_res=median_res, **settings)
+	for chunk in np.array_split(np.arange(len(epoch)), 4):
+		part = fpi_aggregate.Aggregator(["a", "b"], median_res=median_res, **settings)
+		part.update(epoch[chunk], {"a": (a[chunk], da[chunk]), "b": b[chunk]},
+			  station=station[chunk], look=look[chunk])
+		agg.merge(part)
+	result = agg.result()
+
+	bins = brute_force(epoch, station, look, zip(a, da, b), **settings)
+	assert len(result) == len(bins)
+	for row in result:
+		a_bin, da_bin, b_bin = np.array(bins[(row["station"], row["look"], row["doy"], row["time"])]).T
+		assert row["b_count"] == len(b_bin)
+		assert np.isclose(row["b_mean"], np.mean(b_bin))
+		#b has no errors
+		assert np.isnan(row["b_wmean"])
+
+		finite = np.isfinite(a_bin)
+		values, errors = a_bin[finite], da_bin[finite]
+		assert row["a_count"] == len(values)
+		if len(values) == 0:
+			assert np.isnan(row["a_mean"]) and np.isnan(row["a_median"])
+			continue
+		assert np.isclose(row["a_mean"], np.mean(values))
+		assert np.isclose(row["a_std"], np.std(values), atol=1e-6)
+		assert abs(row["a_median"] - np.median(values)) <= median_res/2 + 1e-9
+		weighted = np.isfinite(errors) & (errors > 0)
+		if not np.any(weighted):
+			assert np.isnan(row["a_wmean"])
+			continue
+		w = 1/errors[weighted]**2
+		assert np.isclose(row["a_wmean"], np.sum(w*values[weighted])/np.sum(w))
+		assert np.isclose(row["a_dwmean"], 1/np.sqrt(np.sum(w)))
+
+def test_bins_without_errors():
+
+	agg = fpi_aggregate.Aggregator(["v"], time_bin=3600)
+	agg.update([0, 10, 4000], {"v": [1.0, 2.0, 3.0]})
+	agg.update([7300], {"v": ([4.0], [0.0])})
+	agg.update([7400], {"v": ([6.0], [2.0])})
+	result = agg.result()
+
+	assert list(result["v_count"]) == [2, 1, 2]
+	assert np.isnan(result["v_wmean"][:2]).all()
+	assert np.isnan(result["v_dwmean"][:2]).all()
+	assert result["v_wmean"][2] == 6.0
+	assert result["v_dwmean"][2] == 2.0
+
+def test_hourly_means(tmp_path):
+
+	fnames = []
+	for i in range(2):
+		fname = str(tmp_path / "night{}.hdf5".format(i))
+		with h5py.File(fname, "w") as hdf:
+			hdf.create_dataset("Data/Table Layout", data=synthetic.make_table(
+				600, start="2013-10-0{}T00:00:00".format(i+1), seed=i))
+		fnames.append(fname)
+
+	agg = fpi_aggregate.hourly_means(fnames, chunk_size=77)
+	result = agg.result()
+
+	bins = {}
+	for hor_vels in fpi_stream.stream_winds(fnames, chunk_size=77):
+		for look, (hor_v, dhor_v, epoch) in hor_vels.items():
+			for value, t in zip(hor_v, epoch):
+				if np.isfinite(value):
+					bins.setdefault((look, t % 86400 // 3600*3600), []).append(value)
+	assert len(result) == len(bins)
+	for row in result:
+		values = bins[(row["look"], row["time"])]
+		assert row["hor_v_count"] == len(values)
+		assert np.isclose(row["hor_v_mean"], np.mean(values))
+		assert np.isclose(row["hor_v_std"], np.std(values), atol=1e-6)
@@ -0,0 +1,266 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Tests for fpipy.modules.fpi_async against a local stand-in Madrigal server
+"""
+
+import os
+import asyncio
+import threading
+import urllib.parse
+
+import pytest
+
+from fpipy.modules import fpi_async
+from fpipy.modules import fpi_cache
+
+class MadrigalServer():
+
+	#the Madrigal web services AsyncMadrigalClient uses, with byte ranges and
+	#If-Range on getMadfile.cgi
+	def __init__(self):
+
+		self.payload = bytes(range(256))*1000
+		self.etag = '"v1"'
+		self.requests = []
+		#close the connection after this many body bytes of the next download
+		self.drop_after = None
+		#added to the first byte of the Content-Range a range request gets back
+		self.range_shift = 0
+
+	async def handle(self, reader, writer):
+
+		try:
+			while True:
+				line = await reader.readline()
+				if not line:
+					break
+				method, target, version = line.decode().split()
+				headers = {}
+				while True:
+					line = await reader.readline()
+					if line in (b"\r\n", b""):
+						break
+					name, value = line.decode().split(":", 1)
+					headers[name.strip().lower()] = value.strip()
+
+				url = urllib.parse.urlsplit(target)
+				query = dict(urllib.parse.parse_qsl(url.query))
+				service = url.path.rsplit("/", 1)[-1]
+				if service == "getExperimentsService.py":
+					body = b"" if query["startday"] == "5" else "100,http://madrigal/exp,fpi,1,site,{},inst\n".format(
+						query["code"]).encode()
+					writer.write(b"HTTP/1.1 200 OK\r\nContent-Length: %d\r\n\r\n" % len(body) + body)
+				elif service == "getExperimentFilesService.py":
+					body = b"/madrigal/uao.hdf5,17001,FPI,1,final,0\n"
+					writer.write(b"HTTP/1.1 200 OK\r\nTransfer-Encoding: chunked\r\n\r\n")
+					for part in [body[:10], body[10:]]:
+						writer.write(b"%x\r\n" % len(part) + part + b"\r\n")
+					writer.write(b"0\r\n\r\n")
+				elif service == "getMadfile.cgi":
+					self.requests.append(headers)
+					if not await self.send_file(writer, headers):
+						break
+				else:
+					writer.write(b"HTTP/1.1 404 Not Found\r\nContent-Length: 0\r\n\r\n")
+				await writer.drain()
+		finally:
+			writer.close()
+
+	async def send_file(self, writer, headers):
+
+		size = len(self.payload)
+		start = 0
+		if "range" in headers and headers.get("if-range", self.etag) == self.etag:
+			start = int(headers["range"].split("=")[1].rstrip("-"))
+		if start >= size:
+			writer.write(b"HTTP/1.1 416 Range Not Satisfiable\r\nContent-Range: bytes */%d\r\n"
+				b"Content-Length: 0\r\n\r\n" % size)
+			return True
+
+		body = self.payload[start:]
+		if start > 0:
+			writer.write(b"HTTP/1.1 206 Partial Content\r\nContent-Range: bytes %d-%d/%d\r\n" % (
+				start+self.range_shift, size-1, size))
+		else:
+			writer.write(b"HTTP/1.1 200 OK\r\n")
+		writer.write(b"ETag: %s\r\nContent-Length: %d\r\n\r\n" % (self.etag.encode(), len(body)))
+
+		if self.drop_after is not None:
+			body = body[:self.drop_after]
+			self.drop_after = None
+			writer.write(body)
+			await writer.drain()
+			return False
+		for i in range(0, len(body), 50000):
+			writer.write(body[i:i+50000])
+			await writer.drain()
+
+		return True
+
+def run(test):
+
+	#runs test(server, client) with a client connected to a local server
+	async def main():
+		server = MadrigalServer()
+		listener = await asyncio.start_server(server.handle, "127.0.0.1", 0)
+		url = "http://127.0.0.1:{}".format(listener.sockets[0].getsockname()[1])
+		try:
+			async with fpi_async.AsyncMadrigalClient(url, max_per_host=2, timeout=10) as client:
+				await test(server, client)
+		finally:
+			listener.close()
+			await listener.wait_closed()
+
+	asyncio.run(main())
+
+async def interrupted(server, client, fname, nbytes):
+
+	#leaves the partial file of a download dropped after nbytes
+	server.drop_after = nbytes
+	with pytest.raises(ConnectionError):
+		await client.download_file("/madrigal/uao.hdf5", fname)
+	assert os.path.getsize(fname+".tmp") == nbytes
+	assert not os.path.exists(fname)
+
+def check_file(fname, payload):
+
+	with open(fname, "rb") as f:
+		assert f.read() == payload
+	#nothing is left to resume from
+	assert not os.path.exists(fname+".tmp")
+	assert not os.path.exists(fname+".tmp.json")
+
+def test_download(tmp_path):
+
+	async def test(server, client):
+		assert await client.download("uao", "2013/10/02", str(tmp_path))
+		check_file(str(tmp_path / fpi_cache.data_fname("uao", "2013/10/02")), server.payload)
+		assert "range" not in server.requests[0]
+		assert not await client.download("uao", "2013/10/05", str(tmp_path))
+
+	run(test)
+
+def test_resume(tmp_path):
+
+	fname = str(tmp_path / "uao.hdf5")
+
+	async def test(server, client):
+		await interrupted(server, client, fname, 100000)
+		nbytes = await client.download_file("/madrigal/uao.hdf5", fname)
+
+		assert server.requests[-1]["range"] == "bytes=100000-"
+		assert server.requests[-1]["if-range"] == server.etag
+		assert nbytes == len(server.payload)-100000
+		check_file(fname, server.payload)
+
+	run(test)
+
+def test_restart_when_range_does_not_match(tmp_path):
+
+	fname = str(tmp_path / "uao.hdf5")
+
+	async def test(server, client):
+		await interrupted(server, client, fname, 100000)
+		server.range_shift = -10
+		nbytes = await client.download_file("/madrigal/uao.hdf5", fname)
+
+		assert server.requests[-2]["range"] == "bytes=100000-"
+		assert "range" not in server.requests[-1]
+		assert nbytes == len(server.payload)
+		check_file(fname, server.payload)
+
+	run(test)
+
+def test_restart_when_file_changed(tmp_path):
+
+	fname = str(tmp_path / "uao.hdf5")
+
+	async def test(server, client):
+		await interrupted(server, client, fname, 100000)
+		server.payload = server.payload[::-1]
+		server.etag = '"v2"'
+		nbytes = await client.download_file("/madrigal/uao.hdf5", fname)
+
+		#If-Range gets the whole new file rather than the rest of it
+		assert len(server.requests) == 2
+		assert nbytes == len(server.payload)
+		check_file(fname, server.payload)
+
+	run(test)
+
+def test_range_not_satisfiable(tmp_path):
+
+	fname = str(tmp_path / "uao.hdf5")
+
+	async def test(server, client):
+		#partial file that already holds the whole file
+		await interrupted(server, client, fname, 100000)
+		with open(fname+".tmp", "ab") as f:
+			f.write(server.payload[100000:])
+		assert await client.download_file("/madrigal/uao.hdf5", fname) == 0
+		check_file(fname, server.payload)
+
+		#partial file longer than the file is downloaded again
+		os.remove(fname)
+		await interrupted(server, client, fname, 100000)
+		with open(fname+".tmp", "ab") as f:
+			f.write(bytes(len(server.payload)))
+		assert await client.download_file("/madrigal/uao.hdf5", fname) == len(server.payload)
+		assert "range" not in server.requests[-1]
+		check_file(fname, server.payload)
+
+	run(test)
+
+def test_fetch_async(tmp_path, monkeypatch):
+
+	cache = fpi_cache.FPICache(str(tmp_path))
+	threads = []
+	get = cache.get
+	def record_get(*args):
+		threads.append(threading.current_thread())
+		return get(*args)
+	monkeypatch.setattr(cache, "get", record_get)
+
+	async def test(server, client):
+		fname = await fpi_async.fetch_async(cache, "uao", "2013/10/02", client=client)
+		check_file(fname, server.payload)
+		assert await fpi_async.fetch_async(cache, "uao", "2013/10/02", client=client) == fname
+		assert len(server.requests) == 1
+		assert await fpi_async.fetch_async(cache, "uao", "2013/10/05", client=client) is None
+
+	run(test)
+
+	#the cache is only looked up off the event loop
+	assert len(threads) == 3
+	assert threading.main_thread() not in threads
+
+def test_writes_off_event_loop(tmp_path, monkeypatch):
+
+	fname = str(tmp_path / "uao.hdf5")
+	threads = []
+
+	class File():
+		#records the thread every write runs on
+		def __init__(self, f):
+			self.f = f
+		def write(self, data):
+			threads.append(threading.current_thread())
+			return self.f.write(data)
+		def __getattr__(self, name):
+			return getattr(self.f, name)
+		def __enter__(self):
+			return self
+		def __exit__(self, *exc):
+			return self.f.__exit__(*exc)
+	monkeypatch.setattr(fpi_async, "open", lambda *args: File(open(*args)), raising=False)
+
+	async def test(server, client):
+		await interrupted(server, client, fname, 100000)
+		await client.download_file("/madrigal/uao.hdf5", fname)
+		check_file(fname, server.payload)
+
+	run(test)
+
+	assert len(threads) > 2
+	assert threading.main_thread() not in threads
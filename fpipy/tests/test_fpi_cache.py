@@ -0,0 +1,135 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Tests for fpipy.modules.fpi_cache
+"""
+
+import os
+import json
+import time
+import concurrent.futures
+
+from fpipy.modules import fpi_cache
+
+def put_file(cache, FPI, date, data=b"fpi"):
+
+	fname = os.path.join(cache.root, "{}_{}.download".format(FPI, fpi_cache.date_key(date)))
+	with open(fname, "wb") as f:
+		f.write(data)
+
+	return cache.put(FPI, date, fname)
+
+def manifest(cache):
+
+	with open(cache.manifest) as f:
+		return json.load(f)
+
+def test_put_from_another_instance_is_kept(tmp_path):
+
+	a = fpi_cache.FPICache(str(tmp_path), flush_every=1)
+	put_file(a, "uao", "2013/10/01")
+
+	b = fpi_cache.FPICache(str(tmp_path))
+	put_file(b, "uao", "2013/10/02")
+
+	#a's in-memory index is stale, its write must not drop b's entry
+	assert a.get("uao", "2013/10/01") is not None
+	assert set(manifest(a)) == {"uao_20131001", "uao_20131002"}
+	assert a.get("uao", "2013/10/02") is not None
+
+	a.remove("uao", "2013/10/01")
+	assert set(manifest(b)) == {"uao_20131002"}
+
+def test_get_does_not_write_manifest(tmp_path):
+
+	cache = fpi_cache.FPICache(str(tmp_path))
+	put_file(cache, "uao", "2013/10/01")
+	before = os.stat(cache.manifest).st_mtime_ns
+	last_access = manifest(cache)["uao_20131001"]["last_access"]
+
+	for _ in range(10):
+		assert cache.get("uao", "2013/10/01") is not None
+	assert os.stat(cache.manifest).st_mtime_ns == before
+
+	cache.flush()
+	assert manifest(cache)["uao_20131001"]["last_access"] > last_access
+
+def test_access_times_flush_in_batches(tmp_path):
+
+	cache = fpi_cache.FPICache(str(tmp_path), flush_every=3)
+	for day in range(1, 4):
+		put_file(cache, "uao", "2013/10/{:02d}".format(day))
+	before = manifest(cache)
+
+	cache.get("uao", "2013/10/01")
+	cache.get("uao", "2013/10/02")
+	assert manifest(cache) == before
+	cache.get("uao", "2013/10/03")
+	after = manifest(cache)
+	for key in before:
+		assert after[key]["last_access"] > before[key]["last_access"]
+
+def test_eviction_uses_pending_access_times(tmp_path):
+
+	cache = fpi_cache.FPICache(str(tmp_path), max_bytes=8)
+	put_file(cache, "uao", "2013/10/01", b"1234")
+	put_file(cache, "uao", "2013/10/02", b"1234")
+	#not flushed yet, but still makes 10/01 the most recently used
+	cache.get("uao", "2013/10/01")
+	put_file(cache, "uao", "2013/10/03", b"1234")
+
+	assert ("uao", "2013/10/01") in cache
+	assert ("uao", "2013/10/02") not in cache
+	assert not os.path.exists(cache.path("uao", "2013/10/02"))
+
+def put_night(root, day):
+
+	cache = fpi_cache.FPICache(root)
+	for FPI in ["uao", "ann", "kaf"]:
+		put_file(cache, FPI, "2013/10/{:02d}".format(day))
+		cache.get("uao", "2013/10/{:02d}".format(day))
+
+	return day
+
+def test_concurrent_processes(tmp_path):
+
+	root = str(tmp_path)
+	with concurrent.futures.ProcessPoolExecutor(4) as pool:
+		list(pool.map(put_night, [root]*12, range(1, 13)))
+
+	index = manifest(fpi_cache.FPICache(root))
+	assert len(index) == 36
+	for entry in index.values():
+		assert os.path.isfile(os.path.join(root, entry["file"]))
+
+def slow_download(FPI, date, path, fname=None):
+
+	#another process overwriting or removing fname while this one downloads
+	#shows up as a changed file
+	data = "{} {}".format(FPI, os.getpid()).encode()*1000
+	with open(fname, "wb") as f:
+		f.write(data)
+	time.sleep(0.3)
+	with open(fname, "rb") as f:
+		assert f.read() == data
+
+	return True
+
+def fetch_night(root):
+
+	return fpi_cache.FPICache(root).fetch("uao", "2013/10/02", slow_download)
+
+def test_concurrent_fetches_of_one_night(tmp_path):
+
+	root = str(tmp_path)
+	with concurrent.futures.ProcessPoolExecutor(4) as pool:
+		fnames = list(pool.map(fetch_night, [root]*4))
+
+	cache = fpi_cache.FPICache(root)
+	assert fnames == [cache.path("uao", "2013/10/02")]*4
+	assert ("uao", "2013/10/02") in cache
+	with open(fnames[0], "rb") as f:
+		assert f.read().startswith(b"uao ")
+	#no partial downloads are left behind
+	assert sorted(os.listdir(root)) == sorted(["index.json", "index.lock",
+		os.path.basename(fnames[0])])
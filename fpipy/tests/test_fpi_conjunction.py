@@ -0,0 +1,119 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Tests for fpipy.modules.fpi_conjunction against a brute force search over
+every (FPI point, radar vector) pair
+"""
+
+import numpy as np
+import pytest
+
+from fpipy.modules import fpi_conjunction
+
+def wrap(lon):
+
+	return (lon+180) % 360 - 180
+
+@pytest.fixture(scope="module")
+def points():
+
+	#FPI points and radar vectors clustered around the pole and the date line
+	rng = np.random.default_rng(1)
+	n, m = 1500, 8000
+	lat = np.r_[rng.uniform(80, 90, n//3), rng.uniform(60, 70, n//3), rng.uniform(-90, 90, n-2*(n//3))]
+	lon = wrap(np.r_[rng.uniform(-180, 180, n//3), rng.uniform(175, 185, n//3),
+		rng.uniform(-180, 180, n-2*(n//3))])
+	lat[:3], lon[:3] = [90, 65, 65], [0, 179.95, -180]
+	lat[5] = np.nan
+	epoch = rng.integers(0, 3600, n) + 1400000000
+	epoch[2] = epoch[1]
+
+	radar_lat = np.r_[rng.uniform(78, 90, m//2), rng.uniform(58, 72, m//2)]
+	radar_lon = wrap(np.r_[rng.uniform(-180, 180, m//2), rng.uniform(170, 190, m//2)])
+	radar_lat[:2], radar_lon[:2] = [89.9, 65], [123, -179.95]
+	radar_epoch = rng.integers(-200, 3800, m) + 1400000000
+	radar_epoch[:2] = epoch[:2]
+
+	return (lat, lon, epoch), (radar_lat, radar_lon, radar_epoch)
+
+def brute_force(points, max_dist, max_dt):
+
+	(lat, lon, epoch), (radar_lat, radar_lon, radar_epoch) = points
+	dist = fpi_conjunction.great_circle(lat[None, :], lon[None, :], radar_lat[:, None], radar_lon[:, None])
+	dt = radar_epoch[:, None] - epoch[None, :]
+	radar, fpi = np.nonzero((dist <= max_dist) & (np.abs(dt) <= max_dt))
+
+	return radar, fpi, dist[radar, fpi], dt[radar, fpi]
+
+def check_pairs(pairs, expected):
+
+	radar, fpi, dist, dt = expected
+	assert pairs.dtype == fpi_conjunction.pair_dtype
+	assert np.array_equal(pairs["radar"], radar)
+	assert np.array_equal(pairs["fpi"], fpi)
+	assert np.allclose(pairs["dist"], dist)
+	assert np.array_equal(pairs["dt"], dt)
+
+@pytest.mark.parametrize("max_dist, max_dt", [(200, 120), (50, 30), (1000, 600)])
+def test_query_matches_brute_force(points, max_dist, max_dt):
+
+	index = fpi_conjunction.ConjunctionIndex(*points[0], max_dist=max_dist, max_dt=max_dt)
+	pairs = index.query(*points[1], chunk_size=3000)
+	expected = brute_force(points, max_dist, max_dt)
+
+	check_pairs(pairs, expected)
+	#the pairs across the pole and the date line are found
+	assert (0, 0) in zip(pairs["radar"], pairs["fpi"])
+	assert (1, 1) in zip(pairs["radar"], pairs["fpi"])
+	assert (1, 2) in zip(pairs["radar"], pairs["fpi"])
+
+def test_tighter_query(points):
+
+	index = fpi_conjunction.ConjunctionIndex(*points[0], max_dist=1000, max_dt=600)
+
+	check_pairs(index.query(*points[1], max_dist=200, max_dt=120), brute_force(points, 200, 120))
+	with pytest.raises(Exception):
+		index.query(*points[1], max_dist=2000)
+
+def test_nearest(points):
+
+	index = fpi_conjunction.ConjunctionIndex(*points[0], max_dist=500, max_dt=300)
+	pairs = index.query(*points[1])
+	radar, fpi, dist, dt = brute_force(points, 500, 300)
+
+	closest = fpi_conjunction.nearest(pairs)
+	assert np.array_equal(closest["radar"], np.unique(radar))
+	for pair in closest:
+		mine = radar == pair["radar"]
+		assert pair["dist"] == pytest.approx(dist[mine].min())
+
+	closest = fpi_conjunction.nearest(pairs, by="fpi")
+	assert np.array_equal(np.sort(closest["fpi"]), np.unique(fpi))
+	for pair in closest:
+		mine = fpi == pair["fpi"]
+		assert pair["dist"] == pytest.approx(dist[mine].min())
+
+def test_empty_query(points):
+
+	index = fpi_conjunction.ConjunctionIndex(*points[0])
+
+	assert index.query([], [], []).shape == (0,)
+	assert len(fpi_conjunction.nearest(index.query([], [], []))) == 0
+
+def test_tiny_tolerances(points):
+
+	#points repeated exactly and a few metres apart
+	(lat, lon, epoch), radar = points
+	radar = (np.r_[lat[:50], lat[:50]+2e-5], np.r_[lon[:50], lon[:50]], np.r_[epoch[:50], epoch[:50]])
+	tiny = ((lat, lon, epoch), radar)
+
+	for max_dist in [0, 0.001, 0.005, 0.03]:
+		index = fpi_conjunction.ConjunctionIndex(lat, lon, epoch, max_dist=max_dist, max_dt=0)
+		pairs = index.query(*radar)
+		check_pairs(pairs, brute_force(tiny, max_dist, 0))
+		assert len(pairs) >= 49
+
+	with pytest.raises(ValueError):
+		fpi_conjunction.ConjunctionIndex(lat, lon, epoch, max_dist=-1)
+	with pytest.raises(ValueError):
+		fpi_conjunction.ConjunctionIndex(lat, lon, epoch, max_dist=np.nan)
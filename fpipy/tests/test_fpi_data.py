@@ -0,0 +1,157 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Tests for fpipy.modules.fpi_data
+"""
+
+import os
+
+import numpy as np
+import h5py
+import pytest
+
+from fpipy.modules import fpi_cache
+from fpipy.modules import fpi_columns
+from fpipy.modules import fpi_data
+from fpipy.modules import fpi_filter
+from fpipy.modules import fpi_hdf5
+from fpipy.modules import fpi_instrument
+from fpipy.benchmarks import synthetic
+
+@pytest.fixture
+def nights(tmp_path):
+
+	#two synthetic nights, the first already in a local cache
+	cache = fpi_cache.FPICache(str(tmp_path / "cache"))
+	first = str(tmp_path / "first.hdf5")
+	second = str(tmp_path / "second.hdf5")
+	table1 = synthetic.write_hdf5(first, 300, start="2013-10-01T00:00:00", seed=1)
+	table2 = synthetic.write_hdf5(second, 200, start="2013-10-02T00:00:00", seed=2)
+	cache.put("uao", "2013/10/01", first)
+
+	return cache, second, table1, table2
+
+def check_added(data, table1, table2):
+
+	assert not isinstance(data.Table_Layout, fpi_hdf5.LazyTable)
+	assert np.array_equal(data.Table_Layout, np.concatenate([table1, table2]))
+	assert list(data.file_offsets) == [0, len(table1), len(table1)+len(table2)]
+	assert len(data.records) == 2
+	data.get_table()
+	assert len(data.epoch) == len(table1)+len(table2)
+
+def test_add_HDF5_after_lazy_load(nights):
+
+	cache, second, table1, table2 = nights
+	data = fpi_data.FPIData("uao", "2013/10/01", cache=cache, lazy=True)
+	assert isinstance(data.Table_Layout, fpi_hdf5.LazyTable)
+	hdf = data.Table_Layout.hdf
+
+	data.add_HDF5(second)
+
+	check_added(data, table1, table2)
+	assert data.files == [cache.path("uao", "2013/10/01"), second]
+	#the lazily opened file is closed once everything is read from it
+	assert not hdf.id.valid
+
+def test_add_HDF5_after_column_cache_hit(nights, tmp_path):
+
+	cache, second, table1, table2 = nights
+	column_cache = fpi_columns.ColumnCache(str(tmp_path / "columns"))
+	data = fpi_data.FPIData("uao", "2013/10/01", cache=cache, column_cache=column_cache)
+	data.get_table()
+	assert data.columns_cached()
+
+	#cached columns open the file lazily
+	data = fpi_data.FPIData("uao", "2013/10/01", cache=cache, column_cache=column_cache)
+	assert isinstance(data.Table_Layout, fpi_hdf5.LazyTable)
+	data.add_HDF5(second)
+
+	check_added(data, table1, table2)
+
+def test_failed_add_HDF5_leaves_data_unchanged(nights, tmp_path):
+
+	cache, second, table1, table2 = nights
+	broken = str(tmp_path / "broken.hdf5")
+	with h5py.File(second, "r") as src, h5py.File(broken, "w") as dst:
+		src.copy("Data", dst)
+		dst.create_group("Metadata")
+		src.copy("Metadata/Data Parameters", dst["Metadata"])
+
+	data = fpi_data.FPIData("uao", "2013/10/01", cache=cache, lazy=True)
+	with pytest.raises(Exception):
+		data.add_HDF5(broken)
+
+	assert isinstance(data.Table_Layout, fpi_hdf5.LazyTable)
+	assert isinstance(data.records, fpi_hdf5.LazyTable)
+	assert data.files == [cache.path("uao", "2013/10/01")]
+	data.add_HDF5(second)
+	check_added(data, table1, table2)
+
+def check_cache_hit(load):
+
+	#a second load gets every column from the column cache without reading
+	#any of the files, which are only read if the tables are asked for
+	first = load()
+	first.get_table()
+	with fpi_instrument.collect() as report:
+		data = load()
+		data.get_table()
+	assert report.counters.get("column_cache_hit") == 1
+	assert "hdf5_files" not in report.counters and "hdf5_rows" not in report.counters
+
+	assert np.array_equal(data.epoch, first.epoch)
+	assert np.array_equal(data.file_offsets, first.file_offsets)
+	assert list(data.source_file(np.arange(len(data.epoch)))) == list(
+		first.source_file(np.arange(len(first.epoch))))
+	assert np.array_equal(data.Table_Layout, first.Table_Layout)
+	data.get_table(columns=["los_v"])
+	assert np.array_equal(data.los_v, first.los_v)
+
+def test_filtered_column_cache_hit(nights, tmp_path):
+
+	cache, second, table1, table2 = nights
+	column_cache = fpi_columns.ColumnCache(str(tmp_path / "columns"))
+	good = fpi_filter.TableFilter(looks=["N", "zen"])
+
+	check_cache_hit(lambda: fpi_data.FPIData("uao", "2013/10/01", cache=cache,
+		column_cache=column_cache, filter=good))
+
+def test_range_column_cache_hit(nights, tmp_path):
+
+	cache, second, table1, table2 = nights
+	cache.put("uao", "2013/10/02", second)
+	column_cache = fpi_columns.ColumnCache(str(tmp_path / "columns"))
+
+	check_cache_hit(lambda: fpi_data.FPIData.from_range("uao", "2013/10/01", "2013/10/02",
+		cache=cache, column_cache=column_cache))
+	check_cache_hit(lambda: fpi_data.FPIData.from_range("uao", "2013/10/01", "2013/10/02",
+		cache=cache, column_cache=column_cache, filter=fpi_filter.TableFilter(looks=["S"])))
+
+def test_from_files_matches_add_HDF5(nights, tmp_path):
+
+	cache, second, table1, table2 = nights
+	data = fpi_data.FPIData.from_files([cache.path("uao", "2013/10/01"), second])
+
+	check_added(data, table1, table2)
+	assert os.path.basename(data.source_file(len(table1))) == "second.hdf5"
+
+@pytest.mark.parametrize("field, value", [("kinst", 40000), ("kindat", -40000), ("temp_err", 200.0)])
+def test_get_table_rejects_values_out_of_range(field, value):
+
+	table = synthetic.make_table(50)
+	table[field][7] = value
+	data = fpi_data.FPIData.from_table(table)
+
+	with pytest.raises(ValueError, match=field):
+		data.get_table()
+
+def test_compact_column():
+
+	column = np.array([1.0, -32768.0, 32767.0])
+	assert fpi_data.compact_column(column, "int16")[2] == 32767
+	assert fpi_data.compact_column(np.arange(5), "int8").dtype == np.dtype("int8")
+	with pytest.raises(ValueError):
+		fpi_data.compact_column(np.array([0, 128]), "int8", "wind_err")
+	with pytest.raises(ValueError):
+		fpi_data.compact_column(np.array([-32769.0]), "int16")
@@ -0,0 +1,217 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Tests for fpipy.modules.fpi_download against a local stand-in Madrigal server
+"""
+
+import os
+import time
+import threading
+import types
+import urllib.parse
+import urllib.request
+import http.server
+
+import pytest
+
+from fpipy.modules import fpi_cache
+from fpipy.modules import fpi_download
+from fpipy.modules import fpi_stations
+
+class MadrigalHandler(http.server.BaseHTTPRequestHandler):
+
+	#the Madrigal web services download_data uses, one experiment (and file)
+	#per instrument and day
+	def do_GET(self):
+
+		server = self.server
+		url = urllib.parse.urlsplit(self.path)
+		query = dict(urllib.parse.parse_qsl(url.query))
+		service = url.path.rsplit("/", 1)[-1]
+
+		if service == "getExperimentsService.py":
+			code, day = int(query["code"]), int(query["startday"])
+			body = "" if day in server.no_data else "{},http://madrigal/exp,fpi,1,site,{},inst\n".format(
+				code*100+day, code)
+		elif service == "getExperimentFilesService.py":
+			body = "/madrigal/{}.hdf5,17001,FPI,1,final,0\n".format(query["id"])
+		elif service == "getMadfile.cgi":
+			experiment = int(os.path.basename(query["fileName"]).split(".")[0])
+			with server.lock:
+				server.log.append((experiment, time.perf_counter()))
+				failures = server.failures.get(experiment, 0)
+				server.failures[experiment] = failures-1
+			time.sleep(server.delays.get(experiment % 100, 0))
+			if failures > 0:
+				self.send_error(500)
+				return
+			body = server.payload(experiment)
+		else:
+			self.send_error(404)
+			return
+
+		body = body.encode() if isinstance(body, str) else body
+		self.send_response(200)
+		self.send_header("Content-Length", str(len(body)))
+		self.end_headers()
+		self.wfile.write(body)
+
+	def log_message(self, *args):
+
+		return
+
+class LocalMadrigal():
+
+	#connection with the madrigalWeb MadrigalData methods download_data calls
+	connections = 0
+
+	def __init__(self, url):
+
+		self.url = url
+		LocalMadrigal.connections += 1
+
+	def _get(self, service, **query):
+
+		url = "{}/{}?{}".format(self.url, service, urllib.parse.urlencode(query))
+		with urllib.request.urlopen(url, timeout=10) as response:
+			return response.read()
+
+	def getExperiments(self, code, year, month, day, hour, minute, sec, *end):
+
+		lines = self._get("getExperimentsService.py", code=code, startyear=year,
+					startmonth=month, startday=day).decode().splitlines()
+
+		return [types.SimpleNamespace(id=int(line.split(",")[0])) for line in lines if line]
+
+	def getExperimentFiles(self, id):
+
+		lines = self._get("getExperimentFilesService.py", id=id).decode().splitlines()
+		files = []
+		for line in lines:
+			name, kindat, desc, category = line.split(",")[0:4]
+			files.append(types.SimpleNamespace(name=name, category=int(category)))
+
+		return files
+
+	def downloadFile(self, name, fname, user_fullname, user_email, user_affiliation, format):
+
+		with open(fname, "wb") as f:
+			f.write(self._get("getMadfile.cgi", fileName=name))
+
+@pytest.fixture
+def server():
+
+	server = http.server.ThreadingHTTPServer(("127.0.0.1", 0), MadrigalHandler)
+	server.lock = threading.Lock()
+	server.log = []
+	server.failures = {}
+	server.delays = {}
+	server.no_data = set()
+	server.payload = lambda experiment: "fpi {}".format(experiment).encode()*1000
+	server.url = "http://127.0.0.1:{}".format(server.server_address[1])
+	thread = threading.Thread(target=server.serve_forever, daemon=True)
+	thread.start()
+	LocalMadrigal.connections = 0
+
+	yield server
+
+	server.shutdown()
+	server.server_close()
+
+def experiment(FPI, date):
+
+	return fpi_stations.registry.get(FPI).id*100 + int(date[8:10])
+
+def test_downloads_into_cache(server, tmp_path):
+
+	cache = fpi_cache.FPICache(str(tmp_path))
+	results = fpi_download.download_range("uao", "2013/10/01", "2013/10/02", cache=cache,
+										  madrigalURL=server.url, connect=LocalMadrigal)
+
+	for result in results:
+		assert result.status == "downloaded"
+		assert result.attempts == 1
+		with open(result.fname, "rb") as f:
+			assert f.read() == server.payload(experiment("uao", result.date))
+		assert result.nbytes == os.path.getsize(result.fname)
+		assert cache.get("uao", result.date) == result.fname
+
+def test_retry_with_backoff(server, tmp_path):
+
+	cache = fpi_cache.FPICache(str(tmp_path))
+	failing = experiment("uao", "2013/10/01")
+	server.failures[failing] = 2
+	backoff = 0.2
+
+	downloader = fpi_download.BulkDownloader(cache=cache, workers=1, retries=3, backoff=backoff,
+											 madrigalURL=server.url, connect=LocalMadrigal)
+	result = downloader.download_one("uao", "2013/10/01")
+
+	assert result.status == "downloaded"
+	assert result.attempts == 3
+	assert result.error is None
+	#a new connection is opened for every retry
+	assert LocalMadrigal.connections == 3
+
+	times = [t for exp, t in server.log if exp == failing]
+	assert len(times) == 3
+	gaps = [b-a for a, b in zip(times[:-1], times[1:])]
+	assert gaps[0] >= backoff*0.9
+	assert gaps[1] >= 2*backoff*0.9
+
+	#the failed attempts leave no partial files behind
+	assert sorted(os.listdir(str(tmp_path))) == sorted(["index.json", "index.lock",
+													  os.path.basename(result.fname)])
+
+def test_gives_up_after_retries(server, tmp_path):
+
+	cache = fpi_cache.FPICache(str(tmp_path))
+	server.failures[experiment("uao", "2013/10/01")] = 10
+
+	downloader = fpi_download.BulkDownloader(cache=cache, workers=1, retries=2, backoff=0.01,
+											 madrigalURL=server.url, connect=LocalMadrigal)
+	result = downloader.download_one("uao", "2013/10/01")
+
+	assert result.status == "failed"
+	assert result.attempts == 3
+	assert result.error is not None
+	assert ("uao", "2013/10/01") not in cache
+
+def test_skips_cached_and_no_data(server, tmp_path):
+
+	cache = fpi_cache.FPICache(str(tmp_path))
+	fname = os.path.join(str(tmp_path), "cached.hdf5")
+	with open(fname, "wb") as f:
+		f.write(b"already here")
+	cache.put("uao", "2013/10/01", fname)
+	server.no_data.add(3)
+
+	results = fpi_download.download_range("uao", "2013/10/01", "2013/10/03", cache=cache,
+										  madrigalURL=server.url, connect=LocalMadrigal)
+
+	assert [result.status for result in results] == ["cached", "downloaded", "no data"]
+	assert results[0].nbytes == len(b"already here")
+	#the cached night never reaches the server
+	downloaded = [exp for exp, t in server.log]
+	assert experiment("uao", "2013/10/01") not in downloaded
+	assert downloaded == [experiment("uao", "2013/10/02")]
+
+def test_results_in_job_order(server, tmp_path):
+
+	cache = fpi_cache.FPICache(str(tmp_path))
+	#earlier nights finish last
+	server.delays = {1: 0.3, 2: 0.15, 3: 0}
+	finished = []
+
+	results = fpi_download.download_range(["uao", "ann"], "2013/10/01", "2013/10/03", cache=cache,
+										  workers=6, madrigalURL=server.url, connect=LocalMadrigal,
+										  progress=lambda result, n_done, n_total: finished.append(
+											  (result.FPI, result.date)))
+
+	jobs = [(FPI, date) for FPI in ["uao", "ann"] for date in ["2013/10/01", "2013/10/02", "2013/10/03"]]
+	assert [(result.FPI, result.date) for result in results] == jobs
+	assert sorted(finished) == sorted(jobs)
+	assert finished != jobs
+	for result in results:
+		with open(result.fname, "rb") as f:
+			assert f.read() == server.payload(experiment(result.FPI, result.date))
@@ -0,0 +1,75 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Tests for fpipy.modules.fpi_hdf5
+"""
+
+import numpy as np
+import h5py
+import pytest
+
+from fpipy.modules import fpi_hdf5
+from fpipy.benchmarks import synthetic
+
+@pytest.fixture(params=["contiguous", "chunked"])
+def table(request, tmp_path):
+
+	#contiguous datasets are read through a memory map, chunked ones by h5py
+	data = synthetic.make_table(500)
+	fname = str(tmp_path / "table.hdf5")
+	with h5py.File(fname, "w") as hdf:
+		hdf.create_dataset("Data/Table Layout", data=data,
+					 chunks=True if request.param == "chunked" else None)
+	lazy = fpi_hdf5.LazyTable(fname, "Data/Table Layout")
+	assert (lazy._mmap is not None) == (request.param == "contiguous")
+
+	yield lazy, data
+
+	lazy.close()
+
+def test_getitem_rows(table):
+
+	lazy, data = table
+
+	assert lazy[7] == data[7]
+	assert lazy[-1] == data[-1]
+	assert lazy[np.int64(3)] == data[3]
+	assert np.array_equal(lazy[10:20], data[10:20])
+	assert np.array_equal(lazy[400:10:-7], data[400:10:-7])
+	assert np.array_equal(lazy[[5, 2, 2, 499]], data[[5, 2, 2, 499]])
+	assert np.array_equal(lazy[np.array([-1, 0])], data[[-1, 0]])
+	mask = data["elm"] < 90
+	assert np.array_equal(lazy[mask], data[mask])
+	assert len(lazy[np.array([], dtype="int64")]) == 0
+
+def test_getitem_fields(table):
+
+	lazy, data = table
+
+	assert np.array_equal(lazy["vnu"], data["vnu"])
+	assert np.array_equal(lazy[["azm", "elm"]]["elm"], data["elm"])
+	assert np.array_equal(lazy.take([9, 1], fields=["tn", "dtn"])["dtn"], data["dtn"][[9, 1]])
+	assert np.array_equal(lazy.take([9, 1], fields="tn"), data["tn"][[9, 1]])
+
+def test_getitem_out_of_range(table):
+
+	lazy, data = table
+
+	with pytest.raises(IndexError):
+		lazy[500]
+	with pytest.raises(IndexError):
+		lazy[[0, -501]]
+	with pytest.raises(IndexError):
+		lazy[np.ones(10, dtype=bool)]
+
+def test_getitem_reads_only_requested_rows(table, monkeypatch):
+
+	lazy, data = table
+
+	def read_all(*args, **kwargs):
+		raise AssertionError("whole table read for a row lookup")
+	monkeypatch.setattr(lazy, "read", read_all)
+	monkeypatch.setattr(lazy, "__array__", read_all)
+
+	assert lazy[42] == data[42]
+	assert np.array_equal(lazy[[1, 3]], data[[1, 3]])
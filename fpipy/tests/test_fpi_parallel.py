@@ -0,0 +1,61 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Tests for fpipy.modules.fpi_parallel
+"""
+
+import numpy as np
+import h5py
+import pytest
+
+from fpipy.modules import fpi_cache
+from fpipy.modules import fpi_data
+from fpipy.modules import fpi_parallel
+from fpipy.benchmarks import synthetic
+
+@pytest.fixture
+def cache_root(tmp_path):
+
+	root = str(tmp_path / "cache")
+	fname = str(tmp_path / "night.hdf5")
+	synthetic.write_hdf5(fname, 300, start="2013-10-02T00:00:00")
+	fpi_cache.FPICache(root).put("uao", "2013/10/02", fname)
+
+	return root
+
+def open_files():
+
+	return len(h5py.h5f.get_obj_ids(types=h5py.h5f.OBJ_FILE))
+
+def test_derive_night(cache_root, tmp_path):
+
+	out_fname = str(tmp_path / "winds.npy")
+	fname, nrows, error = fpi_parallel.derive_night(("uao", "2013/10/02"), out_fname,
+		cache_root=cache_root)
+
+	assert error is None
+	assert nrows > 0
+	assert np.load(out_fname).dtype == fpi_data.wind_dtype
+	assert open_files() == 0
+
+def test_failed_night_closes_file(cache_root, tmp_path, monkeypatch):
+
+	def fail(*args, **kwargs):
+		raise RuntimeError("bad night")
+	monkeypatch.setattr(fpi_data.FPIData, "get_winds", fail)
+	closed = []
+	close = fpi_data.FPIData.close
+	def record_close(self):
+		closed.append(self)
+		return close(self)
+	monkeypatch.setattr(fpi_data.FPIData, "close", record_close)
+
+	out_fname = str(tmp_path / "winds.npy")
+	fname, nrows, error = fpi_parallel.derive_night(("uao", "2013/10/02"), out_fname,
+		cache_root=cache_root)
+
+	assert error == "RuntimeError: bad night"
+	assert nrows == 0
+	#the lazily opened file is closed rather than left to the garbage collector
+	assert len(closed) == 1
+	assert open_files() == 0
@@ -0,0 +1,93 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Tests for fpipy.modules.fpi_stream
+"""
+
+import numpy as np
+import h5py
+import pytest
+
+from fpipy.modules import fpi_data
+from fpipy.modules import fpi_stream
+from fpipy.benchmarks import synthetic
+
+def write_table(fname, table):
+
+	with h5py.File(fname, "w") as hdf:
+		hdf.create_dataset("Data/Table Layout", data=table)
+
+	return fname
+
+@pytest.fixture
+def nights(tmp_path):
+
+	#two nights a day apart, the second starting on a North look so its first
+	#samples come before its first zenith
+	first = synthetic.make_table(400, start="2013-10-01T02:00:00", seed=1)
+	second = synthetic.make_table(401, start="2013-10-02T02:00:00", seed=2)[1:]
+	assert second["elm"][0] == 45 and second["azm"][0] == 0
+
+	fnames = [write_table(str(tmp_path / "first.hdf5"), first),
+		   write_table(str(tmp_path / "second.hdf5"), second)]
+
+	return fnames, [first, second]
+
+def collect(stream):
+
+	looks = {look: [[], [], []] for look in ["N", "E", "S", "W"]}
+	for hor_vels in stream:
+		for look, values in hor_vels.items():
+			for out, value in zip(looks[look], values):
+				out.append(value)
+
+	return {look: [np.concatenate(values) for values in out] for look, out in looks.items()}
+
+def load(table):
+
+	data = fpi_data.FPIData.from_table(table)
+	data.get_table()
+
+	return data
+
+def check_second_night(winds, table):
+
+	#the North sample at the start of the second night has no zenith before it
+	data = load(table)
+	first_zenith = data.epoch[data.elm == 90][0]
+	for look in ["N", "E", "S", "W"]:
+		epoch = winds[look][2]
+		assert not np.any((epoch >= data.epoch[0]) & (epoch < first_zenith))
+	assert data.epoch[0] not in winds["N"][2]
+
+def test_no_carry_over_between_nights(nights):
+
+	fnames, tables = nights
+	winds = collect(fpi_stream.stream_winds(fnames, chunk_size=50))
+
+	check_second_night(winds, tables[1])
+
+def test_max_gap_without_reset(nights):
+
+	fnames, tables = nights
+	start = load(tables[1]).epoch[0]
+
+	#carrying over with no gap limit bridges the day between the nights
+	winds = collect(fpi_stream.stream_winds(fnames, chunk_size=50, reset_files=False))
+	assert start in winds["N"][2]
+
+	winds = collect(fpi_stream.stream_winds(fnames, chunk_size=50, reset_files=False, max_gap=600))
+	check_second_night(winds, tables[1])
+
+def test_stream_matches_whole_nights(nights):
+
+	fnames, tables = nights
+	streamed = collect(fpi_stream.stream_winds(fnames, chunk_size=37))
+
+	for look in ["N", "E", "S", "W"]:
+		whole = [[], [], []]
+		for table in tables:
+			for out, value in zip(whole, load(table).get_hor_vels()[look]):
+				out.append(np.asarray(value))
+		for value, expected in zip(streamed[look], whole):
+			assert np.allclose(value, np.concatenate(expected), atol=1e-4)
@@ -0,0 +1,156 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Tests for fpipy.modules.fpi_tools
+"""
+
+import sys
+import types
+
+import numpy as np
+import pytest
+
+from fpipy.modules import fpi_tools
+
+def scalar_interpolate(y, x, times):
+
+	#interpolate gives a length 1 array, or a scalar when two points tie
+	return np.array([np.squeeze(fpi_tools.interpolate(y, x, time)) for time in times])
+
+def test_interpolate_batch_matches_interpolate():
+
+	rng = np.random.default_rng(0)
+	x = np.sort(rng.choice(np.arange(0, 20000, 7), 300, replace=False))
+	y = rng.normal(0, 50, len(x))
+	times = rng.integers(x[0], x[-1], 500)
+
+	assert np.allclose(fpi_tools.interpolate_batch(y, x, times), scalar_interpolate(y, x, times),
+					rtol=0, atol=1e-9)
+
+def test_interpolate_batch_exact_hits():
+
+	x = np.array([0, 60, 120, 180, 240])
+	y = np.array([1.0, -3.0, 7.5, 2.0, 0.5])
+
+	batch = fpi_tools.interpolate_batch(y, x, x)
+
+	assert np.allclose(batch, y)
+	assert np.allclose(batch, scalar_interpolate(y, x, x))
+
+def test_interpolate_batch_ties():
+
+	#times exactly half way between two samples are equally close to both
+	x = np.array([0, 60, 120, 180, 240])
+	y = np.array([1.0, -3.0, 7.5, 2.0, 0.5])
+	times = np.array([30, 90, 150, 210])
+
+	assert np.allclose(fpi_tools.interpolate_batch(y, x, times), scalar_interpolate(y, x, times))
+
+def test_interpolate_batch_out_of_range():
+
+	#both extrapolate along the first/last two points
+	x = np.array([100, 160, 220, 280])
+	y = np.array([4.0, 6.0, 1.0, -2.0])
+	times = np.array([0, 50, 99, 281, 400, 1000])
+
+	assert np.allclose(fpi_tools.interpolate_batch(y, x, times), scalar_interpolate(y, x, times))
+
+def test_interpolate_batch_unsorted_x():
+
+	#interpolate expects x in time order, interpolate_batch sorts it first
+	rng = np.random.default_rng(1)
+	x = np.sort(rng.choice(np.arange(0, 5000, 3), 100, replace=False))
+	y = rng.normal(0, 10, len(x))
+	times = rng.integers(-100, 5100, 200)
+	shuffle = rng.permutation(len(x))
+
+	assert np.allclose(fpi_tools.interpolate_batch(y[shuffle], x[shuffle], times),
+					scalar_interpolate(y, x, times), rtol=0, atol=1e-9)
+
+def rotated_frame(pole_lat, pole_lon):
+
+	#stand-in for aacgm_convert: a rigid rotation of the sphere that moves the
+	#geographic point (pole_lat, pole_lon) to the "magnetic" north pole
+	lat0, lon0 = np.deg2rad(pole_lat), np.deg2rad(pole_lon)
+	rz = np.array([[np.cos(lon0), np.sin(lon0), 0], [-np.sin(lon0), np.cos(lon0), 0], [0, 0, 1]])
+	tilt = np.pi/2 - lat0
+	ry = np.array([[np.cos(tilt), 0, -np.sin(tilt)], [0, 1, 0], [np.sin(tilt), 0, np.cos(tilt)]])
+	rotation = ry @ rz
+
+	def convert(lat, lon, alt, dtimes, method="G2A", time_res=86400, cache=None):
+		lat, lon = np.deg2rad(np.asarray(lat, dtype="float")), np.deg2rad(np.asarray(lon, dtype="float"))
+		xyz = np.stack([np.cos(lat)*np.cos(lon), np.cos(lat)*np.sin(lon), np.sin(lat)])
+		matrix = rotation if method == "G2A" else rotation.T
+		x, y, z = np.tensordot(matrix, xyz, axes=1)
+		return np.rad2deg(np.arcsin(np.clip(z, -1, 1))), np.rad2deg(np.arctan2(y, x))
+
+	return convert
+
+def bearing(lat1, lon1, lat2, lon2):
+
+	lat1, lon1, lat2, lon2 = [np.deg2rad(np.asarray(a, dtype="float")) for a in [lat1, lon1, lat2, lon2]]
+	dlon = lon2-lon1
+
+	return np.rad2deg(np.arctan2(np.sin(dlon)*np.cos(lat2),
+		np.cos(lat1)*np.sin(lat2) - np.sin(lat1)*np.cos(lat2)*np.cos(dlon)))
+
+def test_shift_vecs_uses_local_rotation(monkeypatch):
+
+	pole_lat, pole_lon = 80.0, -72.0
+	monkeypatch.setattr(fpi_tools, "aacgm_convert", rotated_frame(pole_lat, pole_lon))
+	rng = np.random.default_rng(2)
+	lat = np.r_[rng.uniform(-60, 89.99, 200), 60.0, 89.95]
+	lon = np.r_[rng.uniform(-180, 180, 200), pole_lon, 10.0]
+	epoch = np.full(len(lat), 1380672000)
+
+	#the magnetic north of a rigidly rotated frame points at its pole, so a
+	#geographic vector towards the pole is due north after the shift
+	to_pole = bearing(lat, lon, pole_lat, pole_lon)
+	NS, EW = np.cos(np.deg2rad(to_pole)), np.sin(np.deg2rad(to_pole))
+	mNS, mEW = fpi_tools.shift_vecs(3*NS, 3*EW, lat, lon, epoch, method="G2M")
+
+	assert np.allclose(mNS, 3, atol=1e-4)
+	assert np.allclose(mEW, 0, atol=1e-4)
+	#on the pole's own meridian the two norths agree
+	assert abs(fpi_tools.frame_rotation(60.0, pole_lon, epoch[0])) < 1e-6
+
+	#converting back recovers the geographic vectors (away from the
+	#geographic pole, where geographic north is not defined)
+	mlat, mlon = fpi_tools.aacgm_convert(lat, lon, 0, epoch, "G2A")
+	gNS, gEW = fpi_tools.shift_vecs(mNS, mEW, mlat, mlon, epoch, method="M2G")
+	keep = lat < 89
+	assert np.allclose(gNS[keep], 3*NS[keep], atol=1e-4)
+	assert np.allclose(gEW[keep], 3*EW[keep], atol=1e-4)
+
+def test_shift_vecs_unknown_method():
+
+	with pytest.raises(ValueError):
+		fpi_tools.shift_vecs([1.0], [0.0], [60.0], [0.0], [1380672000], method="G2X")
+	with pytest.raises(ValueError):
+		fpi_tools.vector_shift(1380672000, method="G2X")
+
+def test_aacgm_convert_bypasses_small_cache(monkeypatch):
+
+	#stand-in aacgmv2 that shifts latitudes and records its calls
+	calls = []
+	def convert_latlon_arr(lat, lon, alt, dtime, method):
+		calls.append(len(lat))
+		return lat+1, lon-1, np.ones(len(lat))
+	monkeypatch.setitem(sys.modules, "aacgmv2", types.SimpleNamespace(convert_latlon_arr=convert_latlon_arr))
+
+	lat = np.arange(20.0)
+	epoch = np.full(len(lat), 1380672000)
+	cache = fpi_tools.LRUCache(maxsize=10)
+	mlat, mlon = fpi_tools.aacgm_convert(lat, 0, 0, epoch, cache=cache)
+
+	#more distinct points than the cache holds are converted without it
+	assert np.array_equal(mlat, lat+1) and np.array_equal(mlon, np.full(len(lat), -1.0))
+	assert calls == [20]
+	assert len(cache) == 0 and cache.hits == cache.misses == 0
+
+	#points that fit are looked up and memoised
+	fpi_tools.aacgm_convert(lat[:10], 0, 0, epoch[:10], cache=cache)
+	mlat, mlon = fpi_tools.aacgm_convert(lat[:10], 0, 0, epoch[:10], cache=cache)
+	assert np.array_equal(mlat, lat[:10]+1)
+	assert calls == [20, 10]
+	assert len(cache) == 10 and cache.hits == 10
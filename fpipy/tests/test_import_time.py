@@ -0,0 +1,25 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Import time budget of fpipy (see fpipy.benchmarks.bench.import_time)
+
+The budget can be changed with the FPIPY_IMPORT_BUDGET environment variable
+(seconds) on slow machines.
+"""
+
+import os
+
+from fpipy.benchmarks import bench
+
+def test_import_within_budget():
+
+	budget = float(os.environ.get("FPIPY_IMPORT_BUDGET", bench.import_budget))
+	seconds, loaded = bench.import_time("fpipy", repeat=3)
+
+	assert seconds <= budget, "import fpipy took {:.3f} s (budget {:.3f} s)".format(seconds, budget)
+
+def test_import_loads_no_heavy_modules():
+
+	seconds, loaded = bench.import_time("fpipy", repeat=1)
+
+	assert loaded == [], "import fpipy loaded {}".format(", ".join(loaded))
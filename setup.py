@@ -12,6 +12,6 @@ setuptools.setup(name="fpipy",
 	classifiers = ["Programming Language :: Python :: 3",
 		"License :: OSI Approved :: MIT License",
 	],
-	python_requires=">=3.6",
+	python_requires=">=3.7",
 	install_requires=["numpy", "h5py", "pydatadarn"],
 )